@@ -205,6 +205,8 @@ class CommonSettings(BaseModel):
 		"""
 		self.__class__.objects.exclude(id=self.id).delete()
 		super(CommonSettings, self).save(*args, **kwargs)
+		from common.utils.settings_util import common_settings_cache
+		common_settings_cache.invalidate()
 
 	@classmethod
 	def load(cls):
@@ -1,6 +1,8 @@
 import django_rq
 import redis
 from django_rq import get_worker
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
 import os
 from django.conf import settings
 import datetime
@@ -49,35 +51,35 @@ class RedisQueue(object):
         """
         Queue task to the default duration queue
         """
-        self.enqueue_medium(func, *args, **kwargs)
+        return self.enqueue_medium(func, *args, **kwargs)
 
     def enqueue_extra_high(self, func, *args, **kwargs):
         """
         Queue task to the extra high duration queue
         """
         queue = self._get_queue('extra_high')
-        self._enqueue(queue, func, *args, **kwargs)
+        return self._enqueue(queue, func, *args, **kwargs)
 
     def enqueue_high(self, func, *args, **kwargs):
         """
         Queue task to the high duration queue
         """
         queue = self._get_queue('high')
-        self._enqueue(queue, func, *args, **kwargs)
+        return self._enqueue(queue, func, *args, **kwargs)
 
     def enqueue_low(self, func, *args, **kwargs):
         """
         Queue task to the low duration queue
         """
         queue = self._get_queue('low')
-        self._enqueue(queue, func, *args, **kwargs)
+        return self._enqueue(queue, func, *args, **kwargs)
 
     def enqueue_medium(self, func, *args, **kwargs):
         """
         Queue task to the medium duration queue
         """        
         queue = self._get_queue('default')
-        self._enqueue(queue, func, *args, **kwargs)        
+        return self._enqueue(queue, func, *args, **kwargs)        
 
     def _enqueue(self, queue, func, *args, **kwargs):
         """
@@ -85,16 +87,106 @@ class RedisQueue(object):
         """
         # print("Job timeout: ", self.job_timeout)
         print ("Enqueuing...{0}. Job timeout={1}".format(datetime.datetime.now(), self.job_timeout))
-        queue.enqueue(func, *args, **kwargs, job_timeout=self.job_timeout)
+        job = queue.enqueue(func, *args, **kwargs, job_timeout=self.job_timeout)
         print ("Enqueued.." + str(func))
+        return job
 
     def _get_queue(self, queue_name):
         """Get queue"""
         return django_rq.get_queue(queue_name, autocommit=True, is_async=True, default_timeout=self.job_timeout)
 
+class InFlightJobs(object):
+    """
+    Registry of queued jobs keyed by the cache key of the computation, so that
+    identical requests can subscribe to a job that is already queued or running
+    instead of enqueuing a duplicate
+    """
+    KEY_PREFIX = "ldms:inflight_job:"
+    # delete the key only if it is still owned by the job
+    RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = int(timeout or settings.JOB_TIMEOUT)
+
+    def get_connection(self):
+        return django_rq.get_connection('default')
+
+    def register(self, cache_key, job_id):
+        """Register a job as computing a cache key
+
+        Returns:
+            The id of the job computing the key. Equals `job_id` if the job was 
+            registered, else the id of the job that was already registered
+        """
+        try:
+            conn = self.get_connection()
+            if conn.set(self.KEY_PREFIX + cache_key, job_id, nx=True, ex=self.timeout):
+                return job_id
+            running_job_id = conn.get(self.KEY_PREFIX + cache_key)
+        except redis.RedisError:
+            return job_id
+        return running_job_id.decode() if running_job_id else job_id
+
+    def get(self, cache_key):
+        """Return the id of the job computing a cache key or None"""
+        try:
+            job_id = self.get_connection().get(self.KEY_PREFIX + cache_key)
+        except redis.RedisError:
+            return None
+        return job_id.decode() if job_id else None
+
+    def release(self, cache_key, job_id):
+        """Unregister a job once it has completed"""
+        try:
+            self.get_connection().eval(self.RELEASE_SCRIPT, 1, self.KEY_PREFIX + cache_key, job_id)
+        except redis.RedisError:
+            pass
+
+    def get_age(self, cache_key, job_id):
+        """Get the seconds since a job registered a cache key, or None if it does not own the key"""
+        conn = self.get_connection()
+        if self.get(cache_key) != job_id:
+            return None
+        ttl = conn.ttl(self.KEY_PREFIX + cache_key)
+        return self.timeout - ttl if ttl >= 0 else None
+
+    def is_alive(self, job_id, cache_key=None):
+        """Check if a job is still queued or running. A job whose work horse was 
+        killed is marked as failed by RQ without releasing its cache key.
+
+        A job is registered before it is enqueued, so a job that does not exist yet
+        is considered alive for `settings.IN_FLIGHT_JOB_ENQUEUE_GRACE` seconds after
+        it registered `cache_key`
+        """
+        try:
+            status = Job.fetch(job_id, connection=self.get_connection()).get_status()
+        except NoSuchJobError:
+            if not cache_key:
+                return False
+            try:
+                age = self.get_age(cache_key, job_id)
+            except redis.RedisError:
+                return True
+            return age != None and age < settings.IN_FLIGHT_JOB_ENQUEUE_GRACE
+        except redis.RedisError:
+            return True
+        return status not in ('finished', 'failed', 'stopped', 'canceled')
+
+in_flight_jobs = InFlightJobs()
+
 def job_exception_handler(job, *exc_info):
     # update Scheduled Task with error    
     print("Job exception handler ", *exc_info)
+    # let identical requests be queued again. The tasks of the job are failed
+    # by the job itself, see ldms.analysis.analysis_router.run_queued_analysis
+    cache_key = job.meta.get('cache_key')
+    if cache_key:
+        in_flight_jobs.release(cache_key, job.get_id())
     move_to_failed_queue(job, *exc_info)
     pass 
 
@@ -1,8 +1,213 @@
 from django.core.cache import cache
+from django.conf import settings
 from . import CacheParamError
 from django.utils.translation import gettext as _
-from .json_sem_hash import get_json_sem_hash 
+from .json_sem_hash import get_json_sem_hash
+from .json_util import loads, to_json_bytes
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import logging
+import redis
 import copy
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+class ResultCache():
+    """
+    Two tier cache of computation results.
+
+    The first tier is a small per-process LRU of recently used entries. The second
+    tier is Redis, shared by all the web and RQ worker processes. If Redis is not
+    configured, the Django cache is used as the second tier. Values are stored as
+    zlib compressed JSON.
+
+    Concurrent computations of the same key can be collapsed into one with `single_flight`.
+    """
+    KEY_PREFIX = "ldms:result:"
+    LOCK_PREFIX = "ldms:result_lock:"
+    METRICS_KEY = "ldms:result_cache_metrics"
+
+    def __init__(self, max_local_entries=None, local_timeout=None):
+        self.max_local_entries = max_local_entries if max_local_entries != None else settings.RESULT_CACHE_LOCAL_MAX_ENTRIES
+        self.local_timeout = local_timeout if local_timeout != None else settings.RESULT_CACHE_LOCAL_TIMEOUT
+        self.local = OrderedDict() # key: (expiry, compressed value)
+        self.local_lock = threading.Lock()
+        self.metrics = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'sets': 0, 'errors': 0, 'lock_waits': 0, 'lock_timeouts': 0}
+        self._redis = None
+
+    def get_redis(self):
+        """Get the Redis connection or None if Redis is not configured"""
+        conf = settings.RESULT_CACHE_REDIS
+        if not conf.get('HOST'):
+            return None
+        if not self._redis:
+            self._redis = redis.Redis(host=conf['HOST'], port=conf['PORT'], db=conf['DB'],
+                                    password=conf.get('PASSWORD'), socket_timeout=conf.get('SOCKET_TIMEOUT', 5))
+        return self._redis
+
+    def encode(self, value):
+        return zlib.compress(to_json_bytes(value))
+
+    def decode(self, data, raw=False):
+        data = zlib.decompress(data)
+        return data if raw else loads(data)
+
+    def incr(self, metric):
+        self.metrics[metric] += 1
+        conn = self.get_redis()
+        if conn:
+            try:
+                conn.hincrby(self.METRICS_KEY, metric, 1)
+            except redis.RedisError:
+                pass
+
+    def get_local(self, key):
+        with self.local_lock:
+            entry = self.local.get(key)
+            if not entry:
+                return None
+            expiry, data = entry
+            if expiry < time.time():
+                del self.local[key]
+                return None
+            self.local.move_to_end(key)
+            return data
+
+    def set_local(self, key, data, timeout):
+        if self.max_local_entries <= 0:
+            return
+        with self.local_lock:
+            self.local[key] = (time.time() + min(timeout, self.local_timeout), data)
+            self.local.move_to_end(key)
+            while len(self.local) > self.max_local_entries:
+                self.local.popitem(last=False)
+
+    def get_shared(self, key):
+        """Return a tuple (compressed value, seconds to expiry) from the shared tier"""
+        conn = self.get_redis()
+        if not conn:
+            return cache.get(self.KEY_PREFIX + key), None
+        try:
+            data = conn.get(self.KEY_PREFIX + key)
+            return data, conn.ttl(self.KEY_PREFIX + key)
+        except redis.RedisError as e:
+            logger.warning("Result cache unavailable: %s", e)
+            self.metrics['errors'] += 1
+            return None, None
+
+    def get(self, key, raw=False):
+        """Get the value of a key or None if it is not cached
+
+        Args:
+            key (string): Cache key
+            raw (bool): If True, the JSON bytes of the value are returned without being decoded
+        """
+        data = self.get_local(key)
+        if data:
+            self.metrics['local_hits'] += 1 # not shared to avoid a round-trip
+            return self.decode(data, raw)
+
+        data, ttl = self.get_shared(key)
+        if not data:
+            self.incr('misses')
+            return None
+        self.incr('shared_hits')
+        self.set_local(key, data, ttl if ttl and ttl > 0 else self.local_timeout)
+        return self.decode(data, raw)
+
+    def set(self, key, value, timeout):
+        """Cache a value
+
+        Args:
+            key (string): Cache key
+            value (object): JSON serializable value or its JSON bytes. Numpy types are converted
+            timeout (int): Timeout of the key in seconds
+        """
+        data = self.encode(value)
+        self.set_local(key, data, timeout)
+        self.metrics['sets'] += 1
+        conn = self.get_redis()
+        if not conn:
+            cache.set(self.KEY_PREFIX + key, data, timeout)
+            return
+        try:
+            conn.set(self.KEY_PREFIX + key, data, ex=timeout)
+        except redis.RedisError as e:
+            logger.warning("Result cache unavailable: %s", e)
+            self.metrics['errors'] += 1
+
+    def delete(self, key):
+        """Remove a key from both tiers"""
+        with self.local_lock:
+            self.local.pop(key, None)
+        conn = self.get_redis()
+        if not conn:
+            cache.delete(self.KEY_PREFIX + key)
+            return
+        try:
+            conn.delete(self.KEY_PREFIX + key)
+        except redis.RedisError:
+            self.metrics['errors'] += 1
+
+    @contextmanager
+    def single_flight(self, key, timeout=None, wait_timeout=None):
+        """Hold a lock on a key so that only one process computes its value at a time.
+        Other processes block until the lock is released, after which they
+        should find the value in the cache.
+
+        Usage:
+            with result_cache.single_flight(key):
+                value = result_cache.get(key)
+                if value is None:
+                    value = compute()
+                    result_cache.set(key, value, timeout)
+
+        Args:
+            key (string): Cache key
+            timeout (int): Maximum seconds to hold the lock, after which it expires
+                           e.g if its holder was killed
+            wait_timeout (int): Maximum seconds to wait for the lock. The value is
+                           computed without the lock if the wait times out
+        """
+        timeout = timeout or settings.RESULT_CACHE_LOCK_TIMEOUT
+        wait_timeout = wait_timeout if wait_timeout != None else settings.RESULT_CACHE_LOCK_WAIT_TIMEOUT
+        conn = self.get_redis()
+        lock = None
+        if conn:
+            lock = conn.lock(self.LOCK_PREFIX + key, timeout=timeout, blocking_timeout=wait_timeout)
+            try:
+                if not lock.acquire(blocking=False):
+                    self.incr('lock_waits')
+                    if not lock.acquire(blocking=True):
+                        self.incr('lock_timeouts')
+                        lock = None
+            except redis.RedisError as e:
+                logger.warning("Result cache lock unavailable: %s", e)
+                lock = None
+        try:
+            yield
+        finally:
+            if lock:
+                try:
+                    lock.release()
+                except redis.exceptions.LockError: # expired
+                    pass
+
+    def get_stats(self):
+        """Return the counters of the current process and of all processes"""
+        stats = {'process': dict(self.metrics), 'local_entries': len(self.local), 'shared': None}
+        conn = self.get_redis()
+        if conn:
+            try:
+                stats['shared'] = {k.decode(): int(v) for k, v in conn.hgetall(self.METRICS_KEY).items()}
+            except redis.RedisError:
+                pass
+        return stats
+
+result_cache = ResultCache()
 
 def get_cached_results(request):
     """Retrieve computed values from cache
@@ -11,12 +216,17 @@ def get_cached_results(request):
         request: HttpRequest object
     """
     payload = copy.copy(request.data)
-    key = generate_cache_key(payload, request.path)    
+    key = generate_cache_key(payload, request.path)
     return get_cache_key(key) # Retrieve value of a cache key
 
-def get_cache_key(key):
-    """Retrieve value of a cache key"""
-    return cache.get(key)
+def get_cache_key(key, raw=False):
+    """Retrieve value of a cache key
+
+    Args:
+        key (string): Cache key
+        raw (bool): If True, return the JSON bytes of the value without decoding them
+    """
+    return result_cache.get(key, raw)
 
 def set_cache_key(key, value, timeout=None):
     """Set a cache key
@@ -28,14 +238,18 @@ def set_cache_key(key, value, timeout=None):
     """
     #limit = SystemSettings.load().cache_limit or 86400 # 1 day
     limit = timeout or 86400 # 1 day
-    cache.set(key, value, limit)
+    result_cache.set(key, value, limit)
+
+def get_cache_stats():
+    """Return hit/miss counters of the result cache"""
+    return result_cache.get_stats()
 
 def generate_cache_key(obj, api_path):
     """Generate a hash key based on a dict
 
     Args:
         obj (object): An object with key value pairs
-        api_path (string): API Endpoint. We want to distinguish hash keys for 
+        api_path (string): API Endpoint. We want to distinguish hash keys for
                             different API calls since different APIs may consume
                             the same inputs
     """
@@ -48,4 +262,4 @@ def generate_cache_key(obj, api_path):
             if prop in obj:
                 del obj[prop] #remove cached property and other cosmetic properties
         obj['path'] = api_path
-    return get_json_sem_hash(obj)
\ No newline at end of file
+    return get_json_sem_hash(obj)
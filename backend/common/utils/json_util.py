@@ -0,0 +1,88 @@
+"""
+Serialization of computation results to and from JSON bytes.
+
+Results are encoded once, stored as bytes in the cache and in
+`ScheduledTask.result` and returned as they are by the views. orjson is used
+when it is installed since it serializes numpy scalars and arrays natively.
+"""
+from django.http import HttpResponse
+import numpy as np
+import enum
+import json
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
+
+def json_default(obj):
+    """Convert objects that the json module cannot serialize e.g numpy types
+
+    Args:
+        obj (object): Object to serialize
+    """
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    return str(obj) # e.g lazy translation strings
+
+def normalize_keys(value):
+    """Convert the numpy keys of nested dicts e.g pixel values to Python types"""
+    if isinstance(value, dict):
+        return {json_default(k) if isinstance(k, np.generic) else k: normalize_keys(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_keys(x) for x in value]
+    return value
+
+def dumps(value):
+    """Serialize a value to JSON bytes
+
+    Args:
+        value (object): Value to serialize. Numpy types are converted
+
+    Returns:
+        bytes: UTF-8 encoded JSON
+    """
+    if orjson:
+        try:
+            return orjson.dumps(value, default=json_default,
+                                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            value = normalize_keys(value) # e.g numpy scalar keys
+            return orjson.dumps(value, default=json_default,
+                                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(normalize_keys(value), default=json_default).encode("utf-8")
+
+def loads(data):
+    """Deserialize JSON bytes or str"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def to_json_bytes(value):
+    """Get the JSON bytes of a result whether it is already serialized or not
+
+    Args:
+        value (bytes|str|object): JSON bytes, a JSON string or a value to serialize
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return dumps(value)
+
+class JSONBytesResponse(HttpResponse):
+    """
+    Response whose content is already serialized JSON, so that cached results are
+    returned without being decoded and encoded again
+    """
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=to_json_bytes(data), **kwargs)
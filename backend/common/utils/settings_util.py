@@ -1,11 +1,90 @@
 from common.models import CommonSettings
+from django.conf import settings
+from django.db import transaction
+import django_rq
+import redis
+import threading
+import time
+import copy
+
+class SettingsCache(object):
+    """
+    Process-local cache of a singleton settings model e.g CommonSettings.
+
+    Each process keeps the loaded settings in memory. A version stamp of the
+    model is kept in Redis and bumped whenever the settings are saved. The stamp
+    is checked at most once every `settings.SETTINGS_CACHE_CHECK_INTERVAL` seconds
+    and the settings are reloaded from the database when it has changed, so that
+    edits propagate to all the web and worker processes. If Redis is not available,
+    the settings are reloaded every interval.
+    """
+    VERSION_KEY = "ldms:settings_version:"
+
+    def __init__(self, model, check_interval=None):
+        self.model = model
+        self.check_interval = check_interval
+        self.instance = None
+        self.version = None
+        self.next_check = 0
+        self.lock = threading.Lock()
+
+    def get_interval(self):
+        return self.check_interval if self.check_interval != None else settings.SETTINGS_CACHE_CHECK_INTERVAL
+
+    def get_connection(self):
+        return django_rq.get_connection('default')
+
+    def get_version(self):
+        """Get the version stamp of the settings or None if Redis is not available"""
+        try:
+            version = self.get_connection().get(self.VERSION_KEY + self.model.__name__)
+        except redis.RedisError:
+            return None
+        return version.decode() if version else "0"
+
+    def get(self):
+        """Get the settings
+
+        Returns:
+            A copy of the cached model instance so that callers cannot alter the cache
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.instance is None or now >= self.next_check:
+                version = self.get_version()
+                if self.instance is None or version is None or version != self.version:
+                    self.instance = self.model.load()
+                    self.version = version
+                self.next_check = now + self.get_interval()
+            return copy.copy(self.instance)
+
+    def clear(self):
+        """Clear the settings cached by this process"""
+        with self.lock:
+            self.instance = None
+
+    def invalidate(self):
+        """Bump the version stamp so that all the processes reload the settings.
+        The stamp is bumped after the current transaction commits so that
+        processes do not reload the settings before they are saved
+        """
+        def _bump():
+            self.clear()
+            try:
+                self.get_connection().incr(self.VERSION_KEY + self.model.__name__)
+            except redis.RedisError:
+                pass
+        self.clear()
+        transaction.on_commit(_bump)
+
+common_settings_cache = SettingsCache(CommonSettings)
 
 def get_common_settings():
     """
     Load System Settings
     """
-    setts = CommonSettings.load()
+    setts = common_settings_cache.get()
     return setts
 
 def get_backend_port(backend_port):
-    return backend_port or get_common_settings().backend_port
\ No newline at end of file
+    return backend_port or get_common_settings().backend_port
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from common_gis.models import ComputedResult
+from common_gis.utils.precompute_util import generate_zonal_histograms
+
+class Command(BaseCommand):
+	help = "Generate the zonal histograms of the admin units within existing precomputed results"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--result-id', type=int, action='append', dest='result_ids',
+							help="Id of a precomputed result. Can be repeated. Defaults to all")
+		parser.add_argument('--force', action='store_true',
+							help="Regenerate histograms of results that already have them")
+
+	def handle(self, *args, **options):
+		results = ComputedResult.objects.filter(succeeded=True).exclude(raster_file='')
+		if options['result_ids']:
+			results = results.filter(pk__in=options['result_ids'])
+		if not options['force']:
+			results = results.filter(histograms__isnull=True)
+		for result in results.distinct().iterator():
+			try:
+				count = generate_zonal_histograms(result)
+				self.stdout.write("{0}: {1} histograms".format(result, count))
+			except Exception as e:
+				self.stderr.write("{0}: {1}".format(result, e))
@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import gettext as _
+from common_gis.utils.vector_util import (get_vector_from_db, validate_coords_within_admin_level,
+				validate_custom_polygon, admin_geometry_cache)
+from common_gis.utils.settings_util import get_gis_settings
+import shapely.geometry
+import json
+import random
+import time
+
+def is_subpolygon_contained_inside_polygon_old(child_coords, parent_coords):
+	"""Check if a sub-polygon is contained within the boundaries of another polygon point by point.
+	The implementation replaced by the prepared geometry cache, kept as the baseline of the benchmark
+
+	Args:
+		child_coords (geojson): sub-polygon to check if it is within the parent_cords
+		parent_coords (geojson): Container polygon
+	
+	Returns:
+		tuple(bool, error): If there is an error, return (False, error) else return (True, None)
+
+	Sample GeoJSON:
+		"{\"type\":\"Polygon\",\"coordinates\":[[[8.949565887451172,36.478999869298576],[8.943042755126953,36.449594202722466],[8.94338607788086,36.432055939882105],[8.980979919433594,36.42846494058168],[9.010334014892578,36.434680026625855],[9.007759094238281,36.46657630040234],[8.994541168212889,36.47775760202128],[8.949565887451172,36.478999869298576]]]}"
+	"""
+	child, error = validate_custom_polygon(child_coords)
+	if error:
+		return (False, error)
+	parent, error = validate_custom_polygon(parent_coords)
+	if error:
+		return (False, error)
+
+	child = json.loads(child)
+	parent = json.loads(parent)
+
+	# Use Shapely to create the polygon
+	shape = shapely.geometry.asShape(parent) 
+
+	all_touched = get_gis_settings().raster_clipping_algorithm == "All Touched"
+	# Get points of the sub-polygon
+	for pnt in child['coordinates'][0]:
+		point = shapely.geometry.Point(pnt) # lon, lat
+
+		"""shape.contains used if the point is fully within the polygon. 
+		If the point is on the boundary, it returns false. However, if you change 
+		contains to intersects you'll get a true result if you want to ensure points on the edge of the polygon are counted."""
+		if not all_touched:
+			if not shape.contains(point):
+				return (False, _("POINT {0} does not fall within the selected polygon".format(pnt)))
+		else:
+			if not shape.intersects(point):
+				return (False, _("POINT {0} does not fall within the selected polygon".format(pnt)))
+
+	return (True, None)
+
+
+class Command(BaseCommand):
+	help = "Compare the time taken to validate custom polygons within an admin unit with and without the prepared geometry cache"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--level', type=int, default=0, help="Admin level of the unit. Defaults to 0")
+		parser.add_argument('--id', type=int, required=True, dest='vector_id', help="Id of the admin unit")
+		parser.add_argument('--polygons', type=int, default=50, help="Number of random polygons to validate")
+		parser.add_argument('--seed', type=int, default=0, help="Seed of the random polygons")
+
+	def get_polygons(self, bounds, count, seed):
+		"""Generate random polygons of 8 vertices within the bounding box of the unit"""
+		rand = random.Random(seed)
+		minx, miny, maxx, maxy = bounds
+		size = max(maxx - minx, maxy - miny) / 20
+		polygons = []
+		for i in range(count):
+			x, y = rand.uniform(minx, maxx), rand.uniform(miny, maxy)
+			points = [(x + rand.uniform(0, size), y + rand.uniform(0, size)) for j in range(8)]
+			polygon = shapely.geometry.MultiPoint(points).convex_hull
+			polygons.append(json.dumps(shapely.geometry.mapping(polygon)))
+		return polygons
+
+	def handle(self, *args, **options):
+		level, vector_id = options['level'], options['vector_id']
+		admin_geometry_cache.clear()
+		start = time.perf_counter()
+		parent, error = admin_geometry_cache.get(level, vector_id)
+		if error:
+			raise CommandError(error)
+		prepare_time = time.perf_counter() - start
+		polygons = self.get_polygons(parent.bounds, options['polygons'], options['seed'])
+
+		# the current implementation fetches the unit for every polygon
+		start = time.perf_counter()
+		old_results = []
+		for polygon in polygons:
+			vector, error = get_vector_from_db(level, vector_id)
+			old_results.append(is_subpolygon_contained_inside_polygon_old(polygon, vector)[0])
+		old_time = time.perf_counter() - start
+
+		start = time.perf_counter()
+		new_results = [validate_coords_within_admin_level(level, vector_id, polygon)[0] for polygon in polygons]
+		new_time = time.perf_counter() - start
+
+		count = len(polygons)
+		self.stdout.write("Vertices: {0}, simplification tolerance: {1}".format(
+							len(parent.geom.exterior.coords) if parent.geom.geom_type == "Polygon" else "multipolygon",
+							parent.tolerance))
+		self.stdout.write("Preparing the geometry: {0:.1f} ms".format(prepare_time * 1000))
+		self.stdout.write("Point by point: {0:.2f} ms per polygon".format(old_time * 1000 / count))
+		self.stdout.write("Prepared cache: {0:.2f} ms per polygon".format(new_time * 1000 / count))
+		self.stdout.write("Polygons within the unit: {0} of {1}".format(sum(new_results), count))
+		mismatches = sum([1 for old, new in zip(old_results, new_results) if old != new])
+		if mismatches:
+			self.stderr.write("{0} polygons were validated differently".format(mismatches))
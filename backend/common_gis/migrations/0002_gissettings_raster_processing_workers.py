@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common_gis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gissettings',
+            name='raster_processing_workers',
+            field=models.IntegerField(default=1, help_text='Number of processes used to process large rasters tile by tile. Set to 0 to use all the CPU cores'),
+        ),
+    ]
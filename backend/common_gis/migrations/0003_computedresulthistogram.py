@@ -0,0 +1,35 @@
+# Generated by Django 3.1 on 2026-10-18 11:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('common_gis', '0002_gissettings_raster_processing_workers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComputedResultHistogram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_on', models.DateTimeField(auto_now=True, null=True)),
+                ('admin_level', models.IntegerField(help_text='Administrative level of the unit')),
+                ('counts', models.TextField(help_text='JSON object of the pixel count of each value, including nodata')),
+                ('admin_one', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='common_gis.adminlevelone')),
+                ('admin_two', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='common_gis.adminleveltwo')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='common_gis_computedresulthistogram_creator', to=settings.AUTH_USER_MODEL)),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='histograms', to='common_gis.computedresult')),
+                ('updated_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='common_gis_computedresulthistogram_updater', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('result',),
+                'unique_together': {('result', 'admin_level', 'admin_one', 'admin_two')},
+            },
+        ),
+    ]
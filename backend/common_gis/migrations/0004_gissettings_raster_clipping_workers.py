@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common_gis', '0003_computedresulthistogram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gissettings',
+            name='raster_clipping_workers',
+            field=models.IntegerField(default=4, help_text='Number of threads used to clip the input rasters of an analysis concurrently. Set to 0 to use the number of CPU cores'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.1 on 2026-10-18 16:20
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Trigram indexes on UPPER(column) since Django filters icontains lookups with
+# UPPER(column) LIKE UPPER(%term%). See common_gis.utils.vector_util.search_vectors
+SEARCH_COLUMNS = [
+    ('common_gis_continentaladminlevel', 'name'),
+    ('common_gis_regionaladminlevel', 'name'),
+    ('common_gis_adminlevelzero', 'name_0'),
+    ('common_gis_adminlevelone', 'name_1'),
+    ('common_gis_adminleveltwo', 'name_2'),
+]
+
+
+def get_index_name(table, column):
+    return '%s_%s_trgm' % (table.replace('common_gis_', ''), column)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common_gis', '0004_gissettings_raster_clipping_workers'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+    ] + [
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS %s ON %s USING gin (UPPER(%s) gin_trgm_ops);' % (
+                get_index_name(table, column), table, column),
+            reverse_sql='DROP INDEX IF EXISTS %s;' % get_index_name(table, column),
+        ) for table, column in SEARCH_COLUMNS
+    ]
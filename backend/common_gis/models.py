@@ -557,6 +557,10 @@ class GISSettings(BaseModel):
 	# backend_port = models.IntegerField(_("Backend port"), default=80, 
 	# 		help_text=_("Port from which the system is served"))
 	enable_tiles = models.BooleanField(default=False, blank=True, help_text=_("If enabled, a WMS link will be returned for all analysis to allow rendering of tiles"))
+	raster_processing_workers = models.IntegerField(default=1, 
+			help_text=_("Number of processes used to process large rasters tile by tile. Set to 0 to use all the CPU cores"))
+	raster_clipping_workers = models.IntegerField(default=4, 
+			help_text=_("Number of threads used to clip the input rasters of an analysis concurrently. Set to 0 to use the number of CPU cores"))
 	 
 	
 	class Meta:
@@ -573,6 +577,8 @@ class GISSettings(BaseModel):
 		"""
 		self.__class__.objects.exclude(id=self.id).delete()
 		super(GISSettings, self).save(*args, **kwargs)
+		from common_gis.utils.settings_util import gis_settings_cache
+		gis_settings_cache.invalidate()
 
 	@classmethod
 	def load(cls):
@@ -871,6 +877,22 @@ class ComputedResultItem(BaseModel):
 	custom_string_04 = models.CharField(max_length=255, blank=True, null=True, help_text=_("String 04"))
 	custom_string_05 = models.CharField(max_length=255, blank=True, null=True, help_text=_("String 05"))
 
+class ComputedResultHistogram(BaseModel):
+	"""
+	Pixel counts per class of a precomputed raster within an administrative unit 
+	contained in the area of the precomputation. Used to answer requests for the 
+	unit without clipping the precomputed raster
+	"""
+	class Meta:
+		ordering = ('result',)
+		unique_together = ('result', 'admin_level', 'admin_one', 'admin_two')
+
+	result = models.ForeignKey(ComputedResult, on_delete=models.CASCADE, related_name="histograms")
+	admin_level = models.IntegerField(help_text=_("Administrative level of the unit"))
+	admin_one = models.ForeignKey(AdminLevelOne, null=True, blank=True, on_delete=models.CASCADE)
+	admin_two = models.ForeignKey(AdminLevelTwo, null=True, blank=True, on_delete=models.CASCADE)
+	counts = models.TextField(help_text=_("JSON object of the pixel count of each value, including nodata"))
+
 @receiver(pre_save, sender=CustomShapeFile)
 def load_shapefile_to_db(sender, instance, **kwargs):
 	"""
@@ -17,6 +17,7 @@ import numpy as np
 from django.conf import settings
 from common.utils.file_util import read_image_tiff, get_media_dir
 import json
+from common.utils.json_util import loads
 
 class AttributeValueSerializer(serializers.ModelSerializer):
     """
@@ -380,7 +381,7 @@ class ScheduledTaskDetailSerializer(serializers.ModelSerializer):
         Method must be prefixed with get_        
         """
         if obj.result:
-            return json.loads(obj.result)
+            return loads(obj.result)
         return "{}"
 
 class ComputationThresholdSerializer(serializers.ModelSerializer):
@@ -1,11 +1,14 @@
-from common_gis.models import Raster
-from django.db.models.signals import post_save
+from common_gis.models import (Raster, ContinentalAdminLevel, RegionalAdminLevel, 
+				AdminLevelZero, AdminLevelOne, AdminLevelTwo)
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.gis.gdal import GDALRaster
 from django.conf import settings
 from common.utils.file_util import file_exists, get_media_dir
 from pathlib import Path
-from common_gis.utils.raster_util import get_raster_object 
+from common_gis.utils.raster_util import get_raster_object, raster_catalog
+from common_gis.utils.vector_util import admin_geometry_cache
+from common_gis.utils.response_cache_util import bump_table_version
 
 # from cmdbox.profiles.models import Profile
 
@@ -38,4 +41,32 @@ def generate_raster_metadata(sender, instance, **kwargs):
 			"srid" : rst.srs.srid, 
 			# "max_zoom" : rst.x
 		}
-		Raster.objects.filter(id=instance.id).update(**vals)
\ No newline at end of file
+		Raster.objects.filter(id=instance.id).update(**vals)
+
+@receiver(post_save, sender=Raster)
+@receiver(post_delete, sender=Raster)
+@receiver(post_save, sender=AdminLevelZero)
+@receiver(post_delete, sender=AdminLevelZero)
+def clear_raster_catalog(sender, instance, **kwargs):
+	"""
+	Invalidate the raster catalog of all the processes when rasters or countries change
+	"""
+	raster_catalog.invalidate()
+
+@receiver(post_save, sender=ContinentalAdminLevel)
+@receiver(post_delete, sender=ContinentalAdminLevel)
+@receiver(post_save, sender=RegionalAdminLevel)
+@receiver(post_delete, sender=RegionalAdminLevel)
+@receiver(post_save, sender=AdminLevelZero)
+@receiver(post_delete, sender=AdminLevelZero)
+@receiver(post_save, sender=AdminLevelOne)
+@receiver(post_delete, sender=AdminLevelOne)
+@receiver(post_save, sender=AdminLevelTwo)
+@receiver(post_delete, sender=AdminLevelTwo)
+def clear_admin_geometry_cache(sender, instance, **kwargs):
+	"""
+	Clear the prepared admin unit geometries of this process when admin units change.
+	The cached responses of the table are invalidated once the change is committed
+	"""
+	admin_geometry_cache.clear()
+	bump_table_version(sender._meta.db_table)
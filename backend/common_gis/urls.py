@@ -15,7 +15,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.conf.urls import url, include
-from django.urls import path
+from django.urls import path, re_path
 from common_gis import views
 from rest_framework.routers import DefaultRouter
 from django.conf.urls.static import static
@@ -41,4 +41,5 @@ urlpatterns = [
     url(r'^', include(router.urls)),    
     url(r'^uploadraster/', views.UploadRasterView.as_view(), name='upload-raster'),
     path('tasks/<int:task_id>/', gis_router.task_result, name='task_result'),  
+    re_path(r'^tiles/(?P<level>-?\d+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$', views.vector_tile, name='vector_tile'),
 ]
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""
+Raw array artifacts.
+
+Intermediate arrays that consumers may need e.g the raw CQI raster are not
+serialized into the results. They are saved as `.npy` files in the media
+directory, named by the hash of their content, and the results only carry a
+reference to the file which consumers memory-map when they need the values.
+"""
+
+import os
+import hashlib
+import numpy as np
+import numpy.ma as ma
+from django.utils.translation import gettext as _
+from common import AnalysisParamError
+from common.utils.file_util import get_media_dir
+
+ARTIFACT_SUB_DIR = "artifacts"
+ARTIFACT_TYPE = "ndarray"
+
+def get_array_hash(array):
+	"""Get the sha256 of the dtype, shape and values of an array"""
+	hasher = hashlib.sha256()
+	hasher.update(str(array.dtype.str).encode("utf-8"))
+	hasher.update(str(array.shape).encode("utf-8"))
+	hasher.update(memoryview(np.ascontiguousarray(array)).cast("B"))
+	return hasher.hexdigest()
+
+def save_array_artifact(array, nodata=None, sub_dir=ARTIFACT_SUB_DIR):
+	"""Save an array as a `.npy` artifact in the media directory.
+
+	The file is named by the hash of the array so that saving the same array
+	again reuses the existing file.
+
+	Args:
+		array (ndarray): Array to save. Masked values are filled with `nodata`
+		nodata (number): Nodata value of the array
+		sub_dir (string): Sub-directory of the media directory
+
+	Returns:
+		dict: Reference to the artifact with the keys type, path, dtype, shape, hash and nodata
+	"""
+	if ma.isMaskedArray(array):
+		array = array.filled(nodata) if nodata != None else ma.getdata(array)
+	if isinstance(nodata, np.generic):
+		nodata = nodata.item()
+	array = np.ascontiguousarray(array)
+	digest = get_array_hash(array)
+	file_path = "%s/%s.npy" % (sub_dir.strip("/"), digest)
+	out_file = get_media_dir() + file_path
+	if not os.path.exists(out_file):
+		os.makedirs(os.path.dirname(out_file), exist_ok=True)
+		# write to a temp file first so that readers never see a partial file
+		temp_file = "%s.%s.tmp" % (out_file, os.getpid())
+		with open(temp_file, "wb") as f:
+			np.save(f, array, allow_pickle=False)
+		os.replace(temp_file, out_file)
+	return {
+		"type": ARTIFACT_TYPE,
+		"path": file_path,
+		"dtype": array.dtype.str,
+		"shape": list(array.shape),
+		"hash": digest,
+		"nodata": nodata,
+	}
+
+def is_array_artifact(value):
+	"""Check if a value is a reference returned by `save_array_artifact`"""
+	return isinstance(value, dict) and value.get("type") == ARTIFACT_TYPE and "path" in value
+
+def load_array_artifact(reference, mmap_mode="r", masked=False):
+	"""Load an array saved by `save_array_artifact`
+
+	Args:
+		reference (dict): Reference returned by `save_array_artifact`
+		mmap_mode (string): Memory-map mode as in `np.load`. None to read the whole array
+		masked (bool): If True, a masked array with the nodata values masked is returned
+
+	Returns:
+		ndarray or MaskedArray
+	"""
+	if not is_array_artifact(reference):
+		raise AnalysisParamError(_("Invalid array artifact reference"))
+	media_dir = os.path.realpath(get_media_dir())
+	file_path = os.path.realpath(os.path.join(media_dir, reference["path"]))
+	if not file_path.startswith(media_dir + os.sep) or not os.path.exists(file_path):
+		raise AnalysisParamError(_("The array artifact {0} does not exist").format(reference["path"]))
+
+	array = np.load(file_path, mmap_mode=mmap_mode, allow_pickle=False)
+	if array.dtype.str != reference["dtype"] or list(array.shape) != list(reference["shape"]):
+		raise AnalysisParamError(_("The array artifact {0} does not match its reference").format(reference["path"]))
+	if masked:
+		nodata = reference.get("nodata")
+		return ma.masked_equal(array, nodata) if nodata != None else ma.array(array)
+	return array
@@ -0,0 +1,149 @@
+"""
+Fused multi-factor kernels.
+
+Indices such as RUSLE, ILSWE and CVI are products of factor rasters which may
+first be fuzzified to the range [0, 1]. Instead of building a masked array per
+factor and per intermediate step, the factors are processed in blocks of rows:
+the bounds used by the fuzzification are found in one reduction pass and the
+fuzzification and the product are then evaluated block by block into a single
+preallocated float32 raster with a shared validity mask.
+"""
+
+import math
+import numpy as np
+import numpy.ma as ma
+from django.utils.translation import gettext as _
+from common import AnalysisParamError
+
+FUZZY_LINEAR = "linear"
+FUZZY_EXPONENTIAL = "exponential"
+FUZZY_SIGMOID = "sigmoid"
+
+DEFAULT_BLOCK_ROWS = 512
+
+class FuzzyMembership():
+	"""
+	Fuzzification of a factor to [0, 1] relative to the bounds of its valid values.
+	"""
+	def __init__(self, kind, switch_bounds=False, min_value=None):
+		"""
+		Args:
+			kind (str): One of FUZZY_LINEAR, FUZZY_EXPONENTIAL or FUZZY_SIGMOID
+			switch_bounds (bool): If True, the low bound is the maximum value, for
+								  factors that are monotonically decreasing
+			min_value (number): If set, valid values less than it are set to it
+		"""
+		if kind not in (FUZZY_LINEAR, FUZZY_EXPONENTIAL, FUZZY_SIGMOID):
+			raise AnalysisParamError(_("Unknown fuzzification {0}").format(kind))
+		self.kind = kind
+		self.switch_bounds = switch_bounds
+		self.min_value = min_value
+
+	def get_bounds(self, min_val, max_val):
+		"""Get the (low, high) bounds given the min and max valid values"""
+		if self.min_value is not None: # clamping is monotonic
+			min_val, max_val = max(min_val, self.min_value), max(max_val, self.min_value)
+		return (max_val, min_val) if self.switch_bounds else (min_val, max_val)
+
+	def apply(self, x, low, high):
+		"""Fuzzify a float block in place"""
+		if self.min_value is not None:
+			np.maximum(x, self.min_value, out=x)
+		x -= low
+		x /= (high - low)
+		if self.kind == FUZZY_EXPONENTIAL:
+			np.square(x, out=x)
+		elif self.kind == FUZZY_SIGMOID:
+			# cos((1 - t) * pi/2)^2
+			np.subtract(1, x, out=x)
+			x *= (math.pi / 2.0)
+			np.cos(x, out=x)
+			np.square(x, out=x)
+		return x
+
+def get_row_blocks(shape, block_rows):
+	"""Get slices over the rows (second to last axis) of an array of `shape`"""
+	rows = shape[-2]
+	for start in range(0, rows, block_rows):
+		yield (Ellipsis, slice(start, min(start + block_rows, rows)), slice(None))
+
+def get_valid_block(raster, nodata):
+	"""Get the values of a block as float32 and a mask of its valid values"""
+	data = ma.getdata(raster)
+	valid = ~ma.getmaskarray(raster) & (data != nodata)
+	if np.issubdtype(data.dtype, np.floating):
+		valid &= ~np.isnan(data)
+	return data.astype(np.float32), valid
+
+def get_valid_bounds(raster, nodata, block_rows=DEFAULT_BLOCK_ROWS):
+	"""Get the min and max valid values of a raster in one pass over its blocks
+
+	Returns:
+		tuple (min, max) or None if the raster has no valid value
+	"""
+	min_val, max_val = np.inf, -np.inf
+	for sl in get_row_blocks(np.shape(raster), block_rows):
+		data = ma.getdata(raster[sl])
+		valid = ~ma.getmaskarray(raster[sl]) & (data != nodata)
+		if np.issubdtype(data.dtype, np.floating):
+			valid &= ~np.isnan(data)
+		if valid.any():
+			min_val = min(min_val, float(np.min(data, where=valid, initial=np.inf)))
+			max_val = max(max_val, float(np.max(data, where=valid, initial=-np.inf)))
+	return None if min_val > max_val else (min_val, max_val)
+
+def compute_factor_product(rasters, nodata, memberships=None, func=None, block_rows=DEFAULT_BLOCK_ROWS):
+	"""Multiply factor rasters, optionally fuzzifying each of them first.
+
+	Like `reshape_rasters`, rasters of different shapes are cropped to the
+	smallest shape. A pixel is valid if it is valid in every factor i.e it is not
+	masked, NoData or NaN and its fuzzified value is finite.
+
+	Args:
+		rasters (list): Factor rasters of shape (rows, cols) or (bands, rows, cols)
+		nodata (number): NoData value of the rasters
+		memberships (list): FuzzyMembership or None for each raster
+		func (function): Function applied in place to each block of the product e.g a square root
+		block_rows (int): Number of rows processed at a time
+
+	Returns:
+		float32 MaskedArray whose mask is set where the product is not valid
+	"""
+	memberships = memberships or [None] * len(rasters)
+	if len(set([np.ndim(x) for x in rasters])) > 1:
+		raise AnalysisParamError(_("The factors have different dimensions"))
+	shape = tuple(min(dims) for dims in zip(*[np.shape(x) for x in rasters]))
+	rasters = [x[tuple(slice(0, n) for n in shape)] for x in rasters]
+
+	# bounds of each fuzzified factor
+	bounds = []
+	for raster, membership in zip(rasters, memberships):
+		if not membership:
+			bounds.append(None)
+			continue
+		min_max = get_valid_bounds(raster, nodata, block_rows)
+		bounds.append(membership.get_bounds(*min_max) if min_max else (0.0, 0.0))
+
+	out = np.empty(shape, dtype=np.float32)
+	valid = np.empty(shape, dtype=bool)
+	with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+		for sl in get_row_blocks(shape, block_rows):
+			out_block, valid_block = out[sl], valid[sl]
+			for i, (raster, membership) in enumerate(zip(rasters, memberships)):
+				block, block_valid = get_valid_block(raster[sl], nodata)
+				if membership:
+					low, high = bounds[i]
+					if low == high: # nothing to scale against
+						block_valid[...] = False
+					else:
+						membership.apply(block, low, high)
+				if i == 0:
+					out_block[...] = block
+					valid_block[...] = block_valid
+				else:
+					out_block *= block
+					valid_block &= block_valid
+			if func:
+				func(out_block)
+			valid_block &= np.isfinite(out_block)
+	return ma.array(out, mask=~valid)
@@ -0,0 +1,84 @@
+"""
+Histogram based percentile ranks.
+
+Computes the frequency distribution of the pixel values of one or many rasters
+with a single `np.unique`/`np.bincount` pass and assigns the percentile rank of
+every pixel with a lookup in the sorted distinct values, instead of calling
+`scipy.stats.percentileofscore` once per pixel.
+"""
+
+import numpy as np
+import numpy.ma as ma
+
+# Integer rasters whose value range is at most this size are counted with np.bincount
+MAX_BINCOUNT_RANGE = 1 << 22
+
+def get_valid_values(rasters, nodata):
+	"""Get a flat array of the pixel values of the rasters that are not nodata
+
+	Args:
+		rasters (list|ndarray): A raster or a list of rasters
+		nodata (number): NoData value
+
+	Returns:
+		1D ndarray
+	"""
+	if not isinstance(rasters, (list, tuple)):
+		rasters = [rasters]
+	values = []
+	for rast in rasters:
+		rast = ma.compressed(rast) if ma.isMaskedArray(rast) else np.ravel(rast)
+		values.append(rast[rast != nodata])
+	return np.concatenate(values) if values else np.array([])
+
+def get_value_counts(rasters, nodata):
+	"""Count the occurence of each pixel value in the rasters
+
+	Args:
+		rasters (list|ndarray): A raster or a list of rasters
+		nodata (number): NoData value. It is not counted
+
+	Returns:
+		A tuple (values, counts) of 1D arrays where values are sorted
+	"""
+	values = get_valid_values(rasters, nodata)
+	if values.size and np.issubdtype(values.dtype, np.integer):
+		min_val, max_val = int(values.min()), int(values.max())
+		if max_val - min_val < MAX_BINCOUNT_RANGE:
+			counts = np.bincount((values - min_val).astype(np.intp))
+			unique = np.nonzero(counts)[0]
+			return (unique + min_val).astype(values.dtype), counts[unique]
+	return np.unique(values, return_counts=True)
+
+def get_percentile_ranks(raster, scores, nodata):
+	"""Get the percentile rank of each pixel relative to a list of scores.
+
+	Gives the same values as `scipy.stats.percentileofscore(scores, pixel, kind='rank')`
+	for every pixel i.e the mean of the number of scores strictly less than the pixel
+	and the number of scores less than or equal to it, plus one when the pixel is
+	one of the scores, as a percentage of the number of scores.
+
+	Args:
+		raster (ndarray): Raster for which to compute the percentile ranks
+		scores (array): Scores to rank against
+		nodata (number): NoData value. NoData pixels are not ranked
+
+	Returns:
+		float64 ndarray of the shape of raster. Pixels with nodata are set to `nodata`
+		and NaN pixels remain NaN
+	"""
+	data = np.asarray(ma.getdata(raster))
+	scores = np.sort(np.asarray(scores, dtype=np.float64))
+	out = np.full(data.shape, nodata, dtype=np.float64)
+	valid = data != nodata
+	if np.issubdtype(data.dtype, np.floating):
+		out[np.isnan(data)] = np.nan
+		valid &= ~np.isnan(data)
+	if not scores.size:
+		return out
+
+	vals = data[valid]
+	left = np.searchsorted(scores, vals, side='left') # scores < val
+	right = np.searchsorted(scores, vals, side='right') # scores <= val
+	out[valid] = (left + right + (right > left)) * 50.0 / scores.size
+	return out
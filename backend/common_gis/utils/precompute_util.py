@@ -1,19 +1,27 @@
 import copy
-from common_gis.models import ComputedResult, ComputedResultItem
+import math
+from django.db import transaction
+from common_gis.models import (ComputedResult, ComputedResultItem, ComputedResultHistogram,
+					AdminLevelOne, AdminLevelTwo)
 from common.utils.cache_util import generate_cache_key, get_cache_key
 from common_gis.utils.raster_util import return_raster_with_stats
-from common_gis.utils.raster_util import extract_pixels_using_vector
+from common_gis.utils.raster_util import (extract_pixels_using_vector, compute_zonal_histograms, 
+					get_stats_from_counts, compute_area)
 from common_gis.utils.vector_util import get_vector_from_db, get_admin_level_ids_from_db
 from common.utils.file_util import get_absolute_media_path, get_physical_file_path_from_url, file_exists
-from common.utils.common_util import str_to_class
+from common.utils.common_util import str_to_class, cint
 import json
+import logging
 
+logger = logging.getLogger(__name__)
 
 def get_precomputed_result(cache_key, request, computation_type, payload=None):
 	"""Get precomputed values from the database
 	1. Will start by retrieving computed values using cache key, if it finds a match, return that record
 	2. If no match is found, check if have precomputed results for a higher admin level, if it exists, clip that raster and 
 	   do the stats
+	3. If the payload has `stats_only` set, the statistics of an admin level one or two unit are 
+	   read from the histogram stored with the precomputation instead. Such results have no raster
 	"""
 	def _clear_admin_level_filters(filters):
 		if 'continent' in filters: del filters['continent']
@@ -75,6 +83,12 @@ def get_precomputed_result(cache_key, request, computation_type, payload=None):
 				obj = ComputedResult.objects.filter(**filters).first()
 
 				if obj:
+					if lvl < cint(payload["admin_level"]) and payload.get("stats_only"):
+						# answer from the histogram of the unit if it was stored with the precomputation
+						res = get_histogram_result(obj, cint(payload["admin_level"]), payload["vector"])
+						if res:
+							obj = res
+							break
 					vector, error = get_vector_from_db(payload["admin_level"], payload["vector"]) #get vector of the area of interest
 					raster_file = get_physical_file_path_from_url(request=request, url=obj.raster_file.name)
 					if not file_exists(file_path=raster_file, raise_exception=False):
@@ -100,6 +114,128 @@ def get_precomputed_result(cache_key, request, computation_type, payload=None):
 				lvl -= 1 #reduce
 		return obj
 
+def get_child_units(computed_result):
+	"""Get the admin level one and two units within the area of a precomputed result
+
+	Returns:
+		Generator of tuples (admin_level, admin_one, admin_two)
+	"""
+	if computed_result.admin_two_id:
+		return
+	if computed_result.admin_one_id:
+		level_ones = AdminLevelOne.objects.none()
+		level_twos = AdminLevelTwo.objects.filter(admin_one_id=computed_result.admin_one_id)
+	elif computed_result.admin_zero_id:
+		level_ones = AdminLevelOne.objects.filter(admin_zero_id=computed_result.admin_zero_id)
+		level_twos = AdminLevelTwo.objects.filter(admin_one__admin_zero_id=computed_result.admin_zero_id)
+	elif computed_result.region_id:
+		level_ones = AdminLevelOne.objects.filter(admin_zero__regional_admin_id=computed_result.region_id)
+		level_twos = AdminLevelTwo.objects.filter(admin_one__admin_zero__regional_admin_id=computed_result.region_id)
+	elif computed_result.continent_id:
+		level_ones = AdminLevelOne.objects.filter(admin_zero__regional_admin__continent_admin_id=computed_result.continent_id)
+		level_twos = AdminLevelTwo.objects.filter(admin_one__admin_zero__regional_admin__continent_admin_id=computed_result.continent_id)
+	else:
+		return
+	for unit in level_ones.iterator():
+		yield (1, unit, None)
+	for unit in level_twos.iterator():
+		yield (2, None, unit)
+
+def generate_zonal_histograms(computed_result):
+	"""Store the pixel counts of a precomputed raster within each admin level one 
+	and two unit inside the area of the precomputation
+
+	Args:
+		computed_result (ComputedResult): Precomputed result
+
+	Returns:
+		Number of histograms stored
+	"""
+	if not computed_result.raster_file:
+		return 0
+	raster_file = get_absolute_media_path(computed_result.raster_file.name)
+	if not file_exists(file_path=raster_file, raise_exception=False):
+		return 0
+	units = list(get_child_units(computed_result))
+	vectors = ((unit_one or unit_two).geom.geojson for level, unit_one, unit_two in units)
+	histograms = compute_zonal_histograms(raster_file, vectors)
+	with transaction.atomic():
+		computed_result.histograms.all().delete()
+		ComputedResultHistogram.objects.bulk_create([
+			ComputedResultHistogram(result=computed_result, 
+						admin_level=level, 
+						admin_one=unit_one, 
+						admin_two=unit_two, 
+						counts=json.dumps(histogram))
+			for (level, unit_one, unit_two), histogram in zip(units, histograms)
+		])
+	return len(units)
+
+def generate_zonal_histograms_job(computed_result_id):
+	"""Queued job to generate the zonal histograms of a precomputed result. See `generate_zonal_histograms`"""
+	computed_result = ComputedResult.objects.filter(id=computed_result_id).first()
+	if not computed_result:
+		return 0
+	try:
+		return generate_zonal_histograms(computed_result)
+	except Exception:
+		logger.exception("Failed to generate zonal histograms for %s", computed_result_id)
+		raise
+
+def get_histogram_result(computed_result, admin_level, vector_id):
+	"""Build the results of an admin unit from the histogram stored with a precomputed result
+
+	Only the fields that hold for the unit are returned. The raster, tiles and extras 
+	of the precomputed result cover its whole area so `rasterfile`, `rasterpath` and 
+	the tiles are None and `extras` is empty
+
+	Args:
+		computed_result (ComputedResult): Precomputed result of an area containing the unit
+		admin_level (int): Admin level of the unit
+		vector_id (int): Id of the unit
+
+	Returns:
+		dict of results or None if there is no histogram for the unit
+	"""
+	if admin_level not in [1, 2]:
+		return None
+	filters = {'admin_one_id': vector_id} if admin_level == 1 else {'admin_two_id': vector_id}
+	histogram = computed_result.histograms.filter(admin_level=admin_level, **filters).first()
+	if not histogram:
+		return None
+	results = json.loads(computed_result.results)
+	stats = results.get('stats')
+	# only flat statistics of the form [{'change_type', 'count', 'area'}] are supported
+	if not isinstance(stats, list) or not all(['change_type' in x and 'count' in x for x in stats]):
+		return None
+
+	# derive the resolution from the areas of the precomputed statistics
+	resolution = computed_result.resolution
+	for itm in stats:
+		if itm['count'] and itm['area']:
+			resolution = math.sqrt(itm['area'] / itm['count'])
+			break
+	# json keys are strings
+	counts = {}
+	for key, val in json.loads(histogram.counts).items():
+		key = float(key)
+		counts[int(key) if key.is_integer() else key] = val
+	change_enum = str_to_class(class_name=computed_result.change_enum, module_name="ldms.enums")
+	nodata = results.get('nodataval', computed_result.nodata)
+	return {
+		'base': results.get('base'),
+		'target': results.get('target'),
+		'rasterfile': None,
+		'rasterpath': None,
+		'precomputed_field_map': results.get('precomputed_field_map'),
+		'nodataval': nodata,
+		'nodata': compute_area(counts.get(nodata, 0), resolution),
+		'stats': get_stats_from_counts(counts, change_enum, resolution),
+		'extras': {},
+		'change_enum': results.get('change_enum'),
+		'tiles': {'url': None, 'layer': None},
+	}
+
 def get_precomputed_result_OLD(cache_key, request, payload=None):
 	"""Get precomputed values from the database
 	1. Will start by retrieving computed values using cache key, if it finds a match, return that record
@@ -7,6 +7,7 @@ from common.utils.file_util import (file_exists, get_absolute_media_path,
 			get_media_dir, get_download_url, get_temp_file, delete_temp_files)
 from common_gis.models import Raster, RasterType, RegionalAdminLevel, AdminLevelZero, ComputedResult, ComputedResultItem
 from django.conf import settings
+from django.db import connections, transaction
 from django.contrib.gis.gdal import GDALRaster
 import rasterio
 from rasterio.transform import from_origin
@@ -15,12 +16,22 @@ import numpy.ma as ma
 import fiona
 import rasterio
 import rasterio.mask
+import rasterio.features
 from rasterio.enums import Resampling
 from rasterio.windows import Window
 from rasterio.warp import calculate_default_transform, reproject, Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.errors import WindowError
 import tempfile
 import json
 import sys
+import os
+import shutil
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 
 from common_gis.enums import RasterSourceEnum, GenericRasterBandEnum, MODISBandEnum, \
 	Landsat7BandEnum, Landsat8BandEnum, RasterOperationEnum, AdminLevelEnum
@@ -28,6 +39,9 @@ from common.utils.common_util import cint, list_to_queryset
 from common_gis.utils.settings_util import get_gis_settings
 from common_gis.utils.geoserver_util import GeoServerHelper
 from common import AnalysisParamError
+from common.utils.cache_util import result_cache
+import redis
+import django_rq
 
 class RasterCalcHelper():   
 	"""
@@ -490,11 +504,10 @@ def get_raster_meta(rasterfile, set_default_nodata=True, default_nodata=settings
 	Get RasterFile metadata
 	"""
 	rasterin = get_absolute_media_path(rasterfile)
-	with rasterio.open(rasterin) as src:
- 		meta = src.meta
+	meta = raster_catalog.get_meta(rasterin)
 
 	if set_default_nodata:
-		if 'nodata' not in src.meta or src.meta.get('nodata', None) == None:
+		if meta.get('nodata', None) == None:
 			meta.update({'nodata': default_nodata})
 		# if nodatavalue not within int range, set to default value
 		nodataval = meta['nodata']
@@ -529,14 +542,20 @@ def save_raster(dataset, source_path, target_path, dtype=rasterio.int16, no_data
 	Write raster dataset to disk
 
 	Args:
-		source_path (string): Path of raster where we will get the Metadata
+		source_path (string|dict): Path of raster where we will get the Metadata, or the 
+						metadata itself e.g as returned by `align_rasters`
 		target_path (string): Path to save the raster
 	"""
-	rasterin = get_absolute_media_path(source_path.replace("//", "/"), use_static_dir=False)
 	rasterout = target_path.replace("//", "/")
  
-	# open source to extract meta
-	meta = get_raster_meta(rasterin) 
+	if isinstance(source_path, dict):
+		meta = dict(source_path)
+		if meta.get('nodata', None) == None:
+			meta.update({'nodata': settings.DEFAULT_NODATA})
+	else:
+		rasterin = get_absolute_media_path(source_path.replace("//", "/"), use_static_dir=False)
+		# open source to extract meta
+		meta = get_raster_meta(rasterin) 
 	meta.update({
 				 'dtype': dtype, # rasterio.uint8,
 				 'compress': 'lzw',
@@ -664,11 +683,67 @@ def reproject_raster(reference_raster, raster, vector, resampling=Resampling.ave
 
 	return raster, ref_nodata
 
+def align_rasters(reference_raster, rasters, vector=None, resampling=Resampling.nearest, dest_nodata=None):
+	"""
+	Read rasters on the grid of a reference raster.
+
+	Each raster is opened through a WarpedVRT whose output grid is the window of 
+	the reference raster covering the vector. Only the pixels of that window are
+	read and reprojected or resampled on the fly, so nothing is written to disk 
+	and all the returned arrays are pixel-aligned.
+
+	Args:
+		reference_raster (string): Raster whose CRS, resolution and origin are used
+		rasters (list): Rasters to align
+		vector (geojson): If set, only the window covering the vector is read and 
+						pixels outside the vector are set to nodata. Else the full
+						extent of the reference raster is used
+		resampling (enum): One of the enumerated Rasterio Resampling methods
+		dest_nodata (number): Nodata of the aligned rasters. Defaults to the nodata of each raster
+
+	Returns:
+		tuple (arrays, nodata_values, meta): List of 2D arrays of the same shape, 
+		the nodata value of each array and the metadata of the grid
+	"""
+	shapes = [json.loads(vector) if isinstance(vector, str) else vector] if vector else None
+	with rasterio.open(get_absolute_media_path(reference_raster)) as ref:
+		window = get_clip_window(ref, shapes) if shapes else Window(0, 0, ref.width, ref.height)
+		meta = ref.meta
+	meta.update({
+		"driver": "GTiff",
+		"height": int(window.height),
+		"width": int(window.width),
+		"transform": ref.window_transform(window),
+	})
+
+	outside = None
+	if shapes:
+		all_touched = get_gis_settings().raster_clipping_algorithm == "All Touched"
+		outside = rasterio.features.geometry_mask(shapes, 
+						out_shape=(meta['height'], meta['width']),
+						transform=meta['transform'],
+						all_touched=all_touched)
+
+	arrays, nodata_values = [], []
+	for raster in rasters:
+		with rasterio.open(get_absolute_media_path(raster)) as src:
+			nodata = dest_nodata if dest_nodata != None else src.nodata
+			nodata = nodata if nodata != None else settings.DEFAULT_NODATA
+			with WarpedVRT(src, crs=meta['crs'], transform=meta['transform'], 
+							width=meta['width'], height=meta['height'],
+							nodata=nodata, resampling=resampling) as vrt:
+				arry = vrt.read(1, masked=True)
+		if outside is not None:
+			arry = ma.array(arry, mask=ma.getmaskarray(arry) | outside)
+		arrays.append(arry.filled(nodata))
+		nodata_values.append(nodata)
+	return (arrays, nodata_values, meta)
+
 def return_raster_with_stats(request, datasource, prefix, change_enum, 
 							   metadata_raster_path, nodata, resolution,
 							   start_year, end_year, subdir=None, results=None,
 							   extras={}, is_intermediate_variable=False, 
-							   precomputed_field_map={}):
+							   precomputed_field_map={}, raster_path=None, value_counts=None):
 	"""Generates a raster and computes the statistics
 
 	Args:
@@ -677,7 +752,7 @@ def return_raster_with_stats(request, datasource, prefix, change_enum,
 		prefix (string): Name to prefix the generated raster with
 		change_enum (enum.Enum): Type of Enumeration for different changes 
 								e.g ProductivityChangeTernaryEnum, TrajectoryChangeTernaryEnum
-		metadata_raster_path (string): Path of the raster where to get Metadata from
+		metadata_raster_path (string|dict): Path of the raster where to get Metadata from, or the metadata itself
 		nodata (int): Value of nodata
 		resolution (int): Resolution to use to compute statistics
 		subdir (string): Name of sub directory to save the raster
@@ -685,6 +760,10 @@ def return_raster_with_stats(request, datasource, prefix, change_enum,
 		extras (dict): Extra key value object that you may want to return in addition to std values
 		is_intermediate_variable: True if the results are to be used as an intermediate value not the final value
 		precomputed_field_map: Dict of how extra values of statistics will be stored. An example is ForestChange and LULC which has additional values for the results
+		raster_path (string): Path of a raster already written to the media directory e.g by `process_raster_blocks`. 
+							If set, `datasource` is not saved
+		value_counts (dict): Counts of the values of the raster as returned by `process_raster_blocks`. 
+							If set, the values of `datasource` are not counted
 
 	Returns:
 		object : An object with url to download the generated raster and
@@ -696,16 +775,20 @@ def return_raster_with_stats(request, datasource, prefix, change_enum,
 	print("(((((((((((((((((((((())))))))))))))))))))))",file=sys.stderr)
 	delete_temp_files(extension=".tif", age_in_seconds=settings.DELETE_TEMP_FILES_AFTER or 86400)
 
-	out_file = get_absolute_media_path(file_path=None, 
-									is_random_file=True, 
-									random_file_prefix=prefix,
-									random_file_ext=".tif",
-									sub_dir=subdir,
-									use_static_dir=False)
-
-	raster_file = save_raster(dataset=datasource, 
-				source_path=metadata_raster_path,
-				target_path=out_file)
+	if raster_path:
+		out_file = raster_path
+		raster_file = out_file.split("/")[-1]
+	else:
+		out_file = get_absolute_media_path(file_path=None, 
+										is_random_file=True, 
+										random_file_prefix=prefix,
+										random_file_ext=".tif",
+										sub_dir=subdir,
+										use_static_dir=False)
+
+		raster_file = save_raster(dataset=datasource, 
+					source_path=metadata_raster_path,
+					target_path=out_file)
 	
 	raster_url = "%s" % (get_download_url(request, raster_file, 
 											use_static_dir=False))
@@ -713,27 +796,14 @@ def return_raster_with_stats(request, datasource, prefix, change_enum,
 	
 	# Get counts of change types		
 	# unique, counts = np.unique(datasource[datasource != nodata], return_counts=True)			
-	unique, counts = np.unique(datasource, return_counts=True)			
-	val_counts = dict(zip(unique, counts)) # convert to {val:count} freq distribution dictionary
+	if value_counts != None:
+		val_counts = value_counts
+	else:
+		unique, counts = np.unique(datasource, return_counts=True)			
+		val_counts = dict(zip(unique, counts)) # convert to {val:count} freq distribution dictionary
 	print("TTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTT", val_counts, file=sys.stderr)
 	if not results:
-		for mapping in change_enum:
-			key = cint(mapping.key)
-			if key in val_counts:
-				val = val_counts[mapping.key]
-				results.append({
-					'change_type': key,
-					'label': str(mapping.label),
-					'count': val,
-					'area': compute_area(val, resolution)
-				})
-			else:
-				results.append({
-					'change_type': key,
-					'label': str(mapping.label),
-					'count': 0,
-					'area': 0
-				})
+		results = get_stats_from_counts(val_counts, change_enum, resolution)
 
 	nodata_count = 0 
 	if nodata in val_counts:
@@ -763,6 +833,112 @@ def return_raster_with_stats(request, datasource, prefix, change_enum,
 	print("*************************************************************************", stats_obj, file=sys.stderr)
 	return stats_obj      
 
+def get_stats_from_counts(val_counts, change_enum, resolution):
+	"""Get the count and area of each change type
+
+	Args:
+		val_counts (dict): Pixel count of each value
+		change_enum (enum.Enum): Type of Enumeration for different changes
+		resolution (int): Resolution to use to compute the area
+
+	Returns:
+		list of dicts of the form {'change_type', 'label', 'count', 'area'}
+	"""
+	results = []
+	for mapping in change_enum:
+		key = cint(mapping.key)
+		if key in val_counts:
+			val = val_counts[mapping.key]
+			results.append({
+				'change_type': key,
+				'label': str(mapping.label),
+				'count': val,
+				'area': compute_area(val, resolution)
+			})
+		else:
+			results.append({
+				'change_type': key,
+				'label': str(mapping.label),
+				'count': 0,
+				'area': 0
+			})
+	return results
+
+def compute_zonal_histograms(raster_file, vectors):
+	"""Count the pixels of each value of a raster within each of the vectors.
+	The raster is opened once and only the window covering each vector is read
+
+	Args:
+		raster_file (string): Raster path
+		vectors (list): GeoJSON geometries
+
+	Returns:
+		list with a dict of {value: count} per vector. Pixels with nodata are 
+		counted under the nodata value of the raster
+	"""
+	all_touched = get_gis_settings().raster_clipping_algorithm == "All Touched"
+	histograms = []
+	with rasterio.open(get_absolute_media_path(raster_file)) as src:
+		for vector in vectors:
+			shapes = [json.loads(vector) if isinstance(vector, str) else vector]
+			try:
+				window = get_clip_window(src, shapes)
+			except WindowError: # outside the raster
+				window = None
+			if not window or window.width < 1 or window.height < 1:
+				histograms.append({})
+				continue
+			data = src.read(1, window=window)
+			inside = ~rasterio.features.geometry_mask(shapes, 
+							out_shape=data.shape,
+							transform=src.window_transform(window),
+							all_touched=all_touched)
+			unique, counts = np.unique(data[inside], return_counts=True)
+			histograms.append(dict(zip(unique.tolist(), counts.tolist())))
+	return histograms
+
+def compute_zonal_quantiles(zones, values, q, nodata):
+	"""Compute the q-th percentile of the values within each zone and assign it 
+	to every pixel of the zone.
+
+	The pixels are sorted once by (zone, value) so that each zone is a contiguous 
+	sorted run whose percentile is read by index, with the same linear 
+	interpolation as `np.percentile`.
+
+	Args:
+		zones (ndarray): Raster of zone ids e.g ecological units
+		values (ndarray): Raster of values of the same shape as `zones`
+		q (float): Percentile to compute, between 0 and 100
+		nodata (number): NoData value of `zones`. Pixels with nodata or NaN zones
+						 do not belong to any zone
+
+	Returns:
+		float64 ndarray of the shape of `zones`. Pixels outside the zones are set to `nodata`
+	"""
+	zones_data = np.asarray(ma.getdata(zones)).ravel()
+	vals = np.asarray(ma.getdata(values), dtype=np.float64).ravel()
+	out = np.full(zones_data.shape, nodata, dtype=np.float64)
+	in_zone = zones_data != nodata
+	if np.issubdtype(zones_data.dtype, np.floating):
+		in_zone &= ~np.isnan(zones_data)
+	idx = np.flatnonzero(in_zone)
+	if not idx.size:
+		return out.reshape(np.shape(zones))
+
+	idx = idx[np.lexsort((vals[idx], zones_data[idx]))]
+	sorted_zones, sorted_vals = zones_data[idx], vals[idx]
+	starts = np.flatnonzero(np.r_[True, sorted_zones[1:] != sorted_zones[:-1]])
+	sizes = np.diff(np.r_[starts, idx.size])
+
+	pos = (sizes - 1) * (q / 100.0)
+	lower = np.floor(pos).astype(np.intp)
+	upper = np.minimum(lower + 1, sizes - 1)
+	lower_vals, upper_vals = sorted_vals[starts + lower], sorted_vals[starts + upper]
+	quantiles = lower_vals + (upper_vals - lower_vals) * (pos - lower)
+
+	out[idx] = np.repeat(quantiles, sizes)
+	return out.reshape(np.shape(zones))
+
 def generate_tiles_old(raster_file, nodata, change_enum):
 	"""Generate Tiles
 
@@ -958,33 +1134,81 @@ def clip_raster_to_regional_vector(raster_file):
 					raster_file=raster_file)		
 	return raster_file
 
-def clip_rasters(vector, models, ref_model=None, raise_file_missing_exception=True):
+def get_clipping_workers():
+	"""Get the number of threads used to clip rasters concurrently"""
+	workers = get_gis_settings().raster_clipping_workers
+	return workers if workers and workers > 0 else os.cpu_count() or 1
+
+def _clip_model_raster(vector, model, dest_nodata, raise_file_missing_exception, ref_file=None):
+	"""Clip the raster file of a model
+
+	If `ref_file` is set and the raster is not on its grid, the raster is read
+	on the grid of the clipped reference raster with `align_rasters` instead
+
+	Returns:
+		list [raster, raster_file]. [None, None] if there is no model or file
+	"""
+	if model and file_exists(get_absolute_media_path(model.rasterfile.name), raise_exception=raise_file_missing_exception):
+		raster_file = get_absolute_media_path(model.rasterfile.name)
+		if ref_file and not are_rasters_aligned([ref_file, raster_file]):
+			arrays, nodata_values, meta = align_rasters(reference_raster=ref_file, 
+										rasters=[raster_file], 
+										vector=vector, 
+										dest_nodata=dest_nodata)
+			out_image = arrays[0][np.newaxis] # same shape as the clipped rasters
+			meta.update({"count": 1, "dtype": out_image.dtype, "nodata": nodata_values[0]})
+			out_file = get_temp_file(suffix=".tif")
+			with rasterio.open(out_file, "w", **meta) as dest:
+				dest.write(out_image)
+			return [out_image, out_file]
+		out_image, out_file, out_nodata = clip_raster_to_vector(model.rasterfile.name, 
+										vector, use_temp_dir=True, 
+										dest_nodata=dest_nodata)
+		return [out_image, out_file]
+	return [None, None]
+
+def _clip_model_raster_in_thread(*args):
+	"""Run `_clip_model_raster` in a worker thread of `clip_rasters`"""
+	try:
+		return _clip_model_raster(*args)
+	finally:
+		connections.close_all() # close the connections opened by this thread
+
+def clip_rasters(vector, models, ref_model=None, raise_file_missing_exception=True, workers=None):
 	"""Clip all rasters using the vector
 
+	The rasters are clipped concurrently by a pool of threads since GDAL 
+	releases the GIL while reading and decompressing the rasters. Rasters that 
+	are not on the grid of the reference raster are read on the grid of the 
+	clipped reference raster so that all the returned rasters are pixel-aligned.
+
 	Args:
 		vector (geojson): Polygon to be used for clipping
 		models (List): Models whose raster files should be clipped
+		ref_model (Raster): Model whose grid and nodata value are used. Defaults to the first model
+		raise_file_missing_exception (bool): If True, raise an exception if a raster file does not exist
+		workers (int): Maximum number of threads. Defaults to the GIS settings
 	
 	Returns:
-		tuple (nodata, list[raster, raster_file])
+		tuple (nodata, list[raster, raster_file]) with the rasters in the order of `models`
 	"""
-	res = []
 	if not isinstance(models, list):
 		models = [models]
-	#meta = get_raster_meta(models[0].rasterfile.name)
-	meta = get_raster_meta(ref_model.rasterfile.name) if ref_model else get_raster_meta(models[0].rasterfile.name)
+	ref_model = ref_model or [x for x in models if x][0]
+	meta = get_raster_meta(ref_model.rasterfile.name)
 	dest_nodata = override_nodata(meta['nodata'])
-	for i, model in enumerate(models):
-		if model:
-			if file_exists(get_absolute_media_path(model.rasterfile.name), raise_exception=raise_file_missing_exception):
-				out_image, out_file, out_nodata = clip_raster_to_vector(model.rasterfile.name, 
-												vector, use_temp_dir=True, 
-												dest_nodata=dest_nodata)
-				res.append([out_image, out_file])
-			else:
-				res.append([None, None])
-		else:
-			res.append([None, None])
+	ref_file = get_absolute_media_path(ref_model.rasterfile.name)
+	if not file_exists(ref_file, raise_exception=False):
+		ref_file = None
+	workers = min(workers or get_clipping_workers(), len([x for x in models if x]))
+	if workers <= 1:
+		res = [_clip_model_raster(vector, model, dest_nodata, raise_file_missing_exception, ref_file) for model in models]
+		return (dest_nodata, res)
+
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		futures = [executor.submit(_clip_model_raster_in_thread, vector, model, 
+						dest_nodata, raise_file_missing_exception, ref_file) for model in models]
+		res = [future.result() for future in futures]
 	return (dest_nodata, res)
 
 def mask_rasters(rasters, nodata):
@@ -1007,30 +1231,479 @@ def mask_rasters(rasters, nodata):
 		res.append(arry)
 	return res
 
-def clip_raster_to_vector(raster_file, vector, dest_nodata=None):
+class ClippedRasterCache():
+	"""
+	Content addressed on-disk cache of clipped rasters.
+
+	An entry is keyed by the raster path and modification time, a hash of the 
+	vector, the raster clipping algorithm and the destination nodata. Each entry
+	is stored as a compressed GeoTIFF, which carries the transform and metadata
+	of the clipped raster, and an uncompressed .npy copy of the array which is
+	memory-mapped when read back. The least recently used entries are evicted 
+	once the total size exceeds `settings.CLIP_CACHE_MAX_BYTES`.
+
+	The hit/miss counters are kept per process and, like those of the result
+	cache, summed over all the processes in Redis.
+	"""
+	METRICS_KEY = "ldms:clip_cache_metrics"
+
+	def __init__(self, cache_dir=None, max_bytes=None):
+		self.cache_dir = cache_dir or settings.CLIP_CACHE_DIR
+		self.max_bytes = max_bytes if max_bytes != None else settings.CLIP_CACHE_MAX_BYTES
+		self.metrics = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+	def incr(self, metric):
+		self.metrics[metric] += 1
+		conn = result_cache.get_redis()
+		if conn:
+			try:
+				conn.hincrby(self.METRICS_KEY, metric, 1)
+			except redis.RedisError:
+				pass
+
+	def get_key(self, raster_file, vector, all_touched, dest_nodata):
+		"""Generate the cache key of a clipped raster"""
+		stat = os.stat(raster_file)
+		if not isinstance(vector, str):
+			vector = json.dumps(vector, sort_keys=True)
+		vector_hash = hashlib.sha256(vector.encode("utf-8")).hexdigest()
+		key = json.dumps([os.path.abspath(raster_file), stat.st_mtime_ns, stat.st_size, 
+						vector_hash, all_touched, str(dest_nodata)])
+		return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+	def get_paths(self, key):
+		"""Return the paths of the (array, raster) files of an entry"""
+		path = os.path.join(self.cache_dir, key)
+		return (path + ".npy", path + ".tif")
+
+	def get(self, key):
+		"""Get a cached entry
+
+		Returns:
+			tuple (array, raster_file) or None if the entry does not exist
+		"""
+		array_file, raster_file = self.get_paths(key)
+		try:
+			# copy-on-write so that callers can modify the array in place
+			array = np.load(array_file, mmap_mode='c')
+			os.utime(array_file)
+			os.utime(raster_file)
+		except (FileNotFoundError, ValueError):
+			self.incr('misses')
+			return None
+		self.incr('hits')
+		return (array, raster_file)
+
+	def set(self, key, array, meta):
+		"""Add an entry to the cache
+
+		Returns:
+			Path of the cached raster file
+		"""
+		os.makedirs(self.cache_dir, exist_ok=True)
+		array_file, raster_file = self.get_paths(key)
+		tmp_suffix = ".%s.%s.tmp" % (os.getpid(), threading.get_ident())
+		with open(array_file + tmp_suffix, "wb") as fl:
+			np.save(fl, array)
+		with rasterio.open(raster_file + tmp_suffix, "w", **meta) as dest:
+			dest.write(array)
+		# write to temp files first so that other processes never read partial entries
+		os.replace(raster_file + tmp_suffix, raster_file)
+		os.replace(array_file + tmp_suffix, array_file)
+		self.evict(keep=key)
+		return raster_file
+
+	def get_entries(self):
+		"""Return a list of (last_access, size, key) of the cached entries"""
+		entries = {}
+		if not os.path.isdir(self.cache_dir):
+			return []
+		for entry in os.scandir(self.cache_dir):
+			key, extn = os.path.splitext(entry.name)
+			if extn not in (".npy", ".tif"):
+				continue
+			try:
+				stat = entry.stat()
+			except FileNotFoundError: # evicted by another process
+				continue
+			last_access, size = entries.get(key, (0, 0))
+			entries[key] = (max(last_access, stat.st_mtime), size + stat.st_size)
+		return [(last_access, size, key) for key, (last_access, size) in entries.items()]
+
+	def evict(self, keep=None):
+		"""Remove the least recently used entries until the cache fits in `max_bytes`
+
+		Args:
+			keep (string): Key of an entry that must not be evicted e.g the entry just added
+		"""
+		entries = sorted(self.get_entries())
+		total = sum([x[1] for x in entries])
+		for last_access, size, key in entries:
+			if total <= self.max_bytes:
+				break
+			if key == keep:
+				continue
+			for fl in self.get_paths(key):
+				if os.path.exists(fl):
+					os.remove(fl)
+			total -= size
+			self.incr('evictions')
+
+	def get_stats(self):
+		"""Return the counters of the current process and of all processes and the size of the cache"""
+		entries = self.get_entries()
+		stats = {
+			'process': dict(self.metrics),
+			'shared': None,
+			'entries': len(entries),
+			'bytes': sum([x[1] for x in entries]),
+			'max_bytes': self.max_bytes,
+		}
+		conn = result_cache.get_redis()
+		if conn:
+			try:
+				stats['shared'] = {k.decode(): int(v) for k, v in conn.hgetall(self.METRICS_KEY).items()}
+			except redis.RedisError:
+				pass
+		return stats
+
+clipped_raster_cache = ClippedRasterCache()
+
+def get_clip_cache_stats():
+	"""Return hit/miss counters and size of the clipped raster cache"""
+	return clipped_raster_cache.get_stats()
+
+class RasterList(list):
+	"""List of Raster models supporting the QuerySet methods used on the results of `get_raster_models`"""
+	def first(self):
+		return self[0] if self else None
+
+	def count(self):
+		return len(self)
+
+	def exists(self):
+		return len(self) > 0
+
+class RasterCatalog():
+	"""
+	In-process index of the Raster models and of the metadata of raster files.
+
+	Rasters are loaded once per (category, source) and indexed by year so that
+	`get_raster_models` resolves the country, region and continent fallback
+	without querying the database. A version stamp of the catalog is kept in
+	Redis and bumped when a Raster or a country is saved or deleted (see 
+	common_gis.signals). The stamp is checked at most once every 
+	`settings.SETTINGS_CACHE_CHECK_INTERVAL` seconds and the index is cleared 
+	when it has changed, so that all the web and worker processes pick up the 
+	change. Entries also expire after `settings.RASTER_CATALOG_TIMEOUT` seconds,
+	which bounds their age if Redis is not available.
+
+	The metadata of raster files is cached by path, modification time and size.
+	"""
+	LOOKUPS = ('raster_category', 'raster_source', 'raster_year', 'raster_year__gte', 'raster_year__lte')
+	MAX_META_ENTRIES = 1024
+	VERSION_KEY = "ldms:raster_catalog_version"
+
+	def __init__(self, timeout=None):
+		self.timeout = timeout if timeout != None else settings.RASTER_CATALOG_TIMEOUT
+		self.lock = threading.Lock()
+		self.rasters = {} # (category, source): (expiry, {year: [rasters]})
+		self.regions = {} # admin_zero_id: regional_admin_id
+		self.regions_expiry = 0
+		self.meta = OrderedDict() # path: (mtime, size, meta)
+		self.version = None
+		self.next_check = 0
+
+	def get_connection(self):
+		return django_rq.get_connection('default')
+
+	def get_version(self):
+		"""Get the version stamp of the catalog or None if Redis is not available"""
+		try:
+			version = self.get_connection().get(self.VERSION_KEY)
+		except redis.RedisError:
+			return None
+		return version.decode() if version else "0"
+
+	def check_version(self):
+		"""Clear the index if another process has changed the rasters since it was loaded"""
+		now = time.monotonic()
+		if now < self.next_check:
+			return
+		version = self.get_version()
+		with self.lock:
+			if version != None and version != self.version:
+				self.rasters = {}
+				self.regions = {}
+				self.regions_expiry = 0
+				self.version = version
+			self.next_check = now + settings.SETTINGS_CACHE_CHECK_INTERVAL
+
+	def clear(self):
+		"""Clear the index of Raster models of this process"""
+		with self.lock:
+			self.rasters = {}
+			self.regions = {}
+			self.regions_expiry = 0
+
+	def invalidate(self):
+		"""Bump the version stamp so that all the processes clear their index.
+		The stamp is bumped after the current transaction commits so that
+		processes do not reload the rasters before they are saved
+		"""
+		def _bump():
+			self.clear()
+			try:
+				self.get_connection().incr(self.VERSION_KEY)
+			except redis.RedisError:
+				pass
+		self.clear()
+		transaction.on_commit(_bump)
+
+	def supports(self, args):
+		"""Check if the filters of a `get_raster_models` call can be answered from the catalog"""
+		return self.timeout > 0 and 'raster_category' in args and set(args).issubset(self.LOOKUPS)
+
+	def get_year_index(self, category, source):
+		"""Get the Raster models of a category and source indexed by year"""
+		self.check_version()
+		key = (category, source)
+		entry = self.rasters.get(key)
+		if entry and entry[0] > time.time():
+			return entry[1]
+		filters = {'raster_category': category}
+		if source != None:
+			filters['raster_source'] = source
+		index = {}
+		for raster in Raster.objects.filter(**filters): # in the default ordering of the model
+			if raster.raster_year:
+				index.setdefault(raster.raster_year, []).append(raster)
+		with self.lock:
+			self.rasters[key] = (time.time() + self.timeout, index)
+		return index
+
+	def get_region_id(self, admin_zero_id):
+		"""Get the id of the region of a country"""
+		self.check_version()
+		if self.regions_expiry < time.time():
+			regions = dict(AdminLevelZero.objects.values_list('id', 'regional_admin_id'))
+			with self.lock:
+				self.regions, self.regions_expiry = regions, time.time() + self.timeout
+		if cint(admin_zero_id) not in self.regions:
+			return AdminLevelZero.objects.get(pk=admin_zero_id).regional_admin_id
+		return self.regions[cint(admin_zero_id)]
+
+	def get_raster_models(self, admin_zero_id=None, **args):
+		"""Get the Raster models matching the filters with one model per year.
+		See `get_raster_models`
+
+		Returns:
+			RasterList ordered by year, latest first
+		"""
+		index = self.get_year_index(args.get('raster_category'), args.get('raster_source'))
+		years = [yr for yr in index
+					if ('raster_year' not in args or yr == cint(args['raster_year']))
+					and ('raster_year__gte' not in args or yr >= cint(args['raster_year__gte']))
+					and ('raster_year__lte' not in args or yr <= cint(args['raster_year__lte']))]
+		region_id = None
+		if admin_zero_id and years:
+			region_id = self.get_region_id(admin_zero_id)
+
+		results = []
+		for yr in sorted(years, reverse=True):
+			year_models = index[yr]
+			continental_rasters = [x for x in year_models if x.admin_level == AdminLevelEnum.CONTINENTAL.key]
+			if admin_zero_id:
+				# country, then regional then continental datasets
+				country_rasters = [x for x in year_models if x.admin_level == AdminLevelEnum.COUNTRY.key and x.admin_zero_id == admin_zero_id]
+				regional_rasters = [x for x in year_models if x.admin_level == AdminLevelEnum.REGIONAL.key and x.regional_admin_id == region_id] if region_id else []
+				year_models = country_rasters or regional_rasters or continental_rasters
+			else:
+				year_models = continental_rasters
+			if year_models:
+				results.append(year_models[0])
+		return RasterList(results)
+
+	def get_meta(self, file_path):
+		"""Get the metadata of a raster file, reading the file only if it has changed
+
+		Returns:
+			dict. A copy of the cached metadata
+		"""
+		try:
+			stat = os.stat(file_path)
+		except OSError: # let rasterio raise its error
+			stat = None
+		if not stat:
+			with rasterio.open(file_path) as src:
+				return src.meta
+		entry = self.meta.get(file_path)
+		if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+			return dict(entry[2])
+		with rasterio.open(file_path) as src:
+			meta = src.meta
+		with self.lock:
+			self.meta[file_path] = (stat.st_mtime_ns, stat.st_size, meta)
+			self.meta.move_to_end(file_path)
+			while len(self.meta) > self.MAX_META_ENTRIES:
+				self.meta.popitem(last=False)
+		return dict(meta)
+
+raster_catalog = RasterCatalog()
+
+def get_streaming_windows(src, bounds_window, window_size=None):
+	"""
+	Split a window of a raster into windows aligned to the internal blocks of the raster.
+
+	Each window is made of whole source blocks (except at the edges of `bounds_window`)
+	so that every block is read from disk only once.
+
+	Args:
+		src: Open rasterio dataset
+		bounds_window (Window): Window to split
+		window_size (int): Approximate width and height of the windows in pixels
+
+	Returns:
+		Generator of Windows in the pixel space of `src`
+	"""
+	window_size = window_size or settings.CLIP_STREAMING_WINDOW_SIZE
+	block_height, block_width = src.block_shapes[0]
+	# use whole blocks, unless a block is bigger than the window size e.g a striped raster
+	win_width = block_width * max(1, window_size // block_width) if block_width <= window_size else window_size
+	win_height = block_height * max(1, window_size // block_height) if block_height <= window_size else window_size
+
+	col_start, row_start = int(bounds_window.col_off), int(bounds_window.row_off)
+	col_stop, row_stop = col_start + int(bounds_window.width), row_start + int(bounds_window.height)
+	for row in range((row_start // win_height) * win_height, row_stop, win_height):
+		row_off = max(row, row_start)
+		height = min(row + win_height, row_stop) - row_off
+		for col in range((col_start // win_width) * win_width, col_stop, win_width):
+			col_off = max(col, col_start)
+			width = min(col + win_width, col_stop) - col_off
+			yield Window(col_off, row_off, width, height)
+
+def get_clip_window(src, shapes):
+	"""Get the window of a raster covered by the bounds of the shapes"""
+	full_window = Window(0, 0, src.width, src.height)
+	window = rasterio.features.geometry_window(src, shapes).round_offsets().round_lengths()
+	return window.intersection(full_window)
+
+def stream_clip_raster(src, shapes, window, nodata, all_touched, raster_file, array_file):
+	"""
+	Clip a raster one window at a time so that peak memory is proportional to the
+	window size rather than to the size of the area of interest.
+
+	The geometry mask is rasterized for each window and the clipped windows are
+	written to a tiled GeoTIFF and to an uncompressed .npy file that can be 
+	memory-mapped by the caller.
+
+	Args:
+		src: Open rasterio dataset
+		shapes (list): Geometries used for clipping
+		window (Window): Window of `src` covered by the bounds of the shapes
+		nodata (number): Value of pixels outside the shapes
+		all_touched (bool): Include a pixel if it touches any of the shapes
+		raster_file (string): Path of the GeoTIFF to write
+		array_file (string): Path of the .npy file to write
+
+	Returns:
+		Metadata of the clipped raster
+	"""
+	out_meta = src.meta
+	out_meta.update({"driver": "GTiff",
+				"height": int(window.height),
+				"width": int(window.width),
+				"transform": src.window_transform(window),
+				"nodata": nodata,
+				"compress": "lzw",
+	})
+	shape = (src.count, int(window.height), int(window.width))
+	out_array = np.lib.format.open_memmap(array_file, mode="w+", dtype=src.dtypes[0], shape=shape)
+	with rasterio.open(raster_file, "w", tiled=True, blockxsize=256, blockysize=256, 
+						BIGTIFF="IF_SAFER", **out_meta) as dest:
+		for win in get_streaming_windows(src, window):
+			data = src.read(window=win, masked=True)
+			outside = rasterio.features.geometry_mask(shapes, 
+							out_shape=(int(win.height), int(win.width)),
+							transform=src.window_transform(win),
+							all_touched=all_touched)
+			data = ma.array(data, mask=ma.getmaskarray(data) | outside).filled(nodata)
+			dest_win = Window(win.col_off - window.col_off, win.row_off - window.row_off, win.width, win.height)
+			dest.write(data, window=dest_win)
+			out_array[:, int(dest_win.row_off):int(dest_win.row_off + dest_win.height), 
+						int(dest_win.col_off):int(dest_win.col_off + dest_win.width)] = data
+	out_array.flush()
+	del out_array
+	return out_meta
+
+def get_clipped_raster(raster_file, vector, dest_nodata=None, streaming=None):
 	"""
 	Mask out regions of a raster that are outside the polygons defined in the shapefile.
+	Results are served from the clipped raster cache if enabled.
+
+	Areas of interest larger than `settings.CLIP_STREAMING_PIXEL_THRESHOLD` pixels 
+	are clipped window by window and the returned array is memory-mapped from disk.
 
 	Args:
-		raster_file: absolute raster_path
+		raster_file: raster path
 		vector (geojson): Polygon to be used for clipping
 		dest_nodata (number): Value to set as nodata when returning the clipped raster
+		streaming (bool): If True, always clip window by window. If False, never. 
+						If None, decide based on the number of pixels to clip
 	
-	Returns (array): Tuple of the clipped raster array (image?) and metatdata
+	Returns:
+		tuple (array, meta, clipped_file) of the clipped raster array, its metadata 
+		and the path of the clipped raster written to disk (None if the raster 
+		was clipped in memory and caching is disabled)
 	"""
-	
-	
-		
+	raster_file = get_absolute_media_path(raster_file)
 	all_touched = get_gis_settings().raster_clipping_algorithm == "All Touched"
+
+	key = None
+	if settings.CLIP_CACHE_ENABLED:
+		key = clipped_raster_cache.get_key(raster_file, vector, all_touched, dest_nodata)
+		cached = clipped_raster_cache.get(key)
+		if cached:
+			out_image, cached_file = cached
+			with rasterio.open(cached_file) as src:
+				out_meta = src.meta
+			out_meta.update({'compress': 'lzw'})
+			return (out_image, out_meta, cached_file)
+
+	shapes = [json.loads(vector) if isinstance(vector, str) else vector] # accepts array of shapes
 	# read the file and crop areas outside the polygon
 	with rasterio.open(raster_file) as src:
 		nodata = dest_nodata if dest_nodata != None else src.meta['nodata'] or settings.DEFAULT_NODATA
-		out_image, out_transform = rasterio.mask.mask(src, 
-					[json.loads(vector)], # accepts array of shapes
-					all_touched=all_touched,
-					nodata=nodata,
-					crop=True)
-		out_meta = src.meta
+		window = get_clip_window(src, shapes)
+		if streaming == None:
+			streaming = window.width * window.height > settings.CLIP_STREAMING_PIXEL_THRESHOLD
+		if streaming:
+			if key:
+				array_file, clipped_file = clipped_raster_cache.get_paths(key)
+				os.makedirs(clipped_raster_cache.cache_dir, exist_ok=True)
+			else:
+				array_file, clipped_file = get_temp_file(suffix=".npy"), get_temp_file(suffix=".tif")
+			tmp_suffix = ".%s.%s.tmp" % (os.getpid(), threading.get_ident())
+			out_meta = stream_clip_raster(src, shapes, window, nodata, all_touched, 
+							raster_file=clipped_file + tmp_suffix, array_file=array_file + tmp_suffix)
+		else:
+			out_image, out_transform = rasterio.mask.mask(src, 
+						shapes,
+						all_touched=all_touched,
+						nodata=nodata,
+						crop=True)
+			out_meta = src.meta
+
+	if streaming:
+		os.replace(clipped_file + tmp_suffix, clipped_file)
+		os.replace(array_file + tmp_suffix, array_file)
+		# copy-on-write so that callers can modify the array in place
+		out_image = np.load(array_file, mmap_mode='c')
+		if key:
+			clipped_raster_cache.evict(keep=key)
+		else:
+			os.remove(array_file) # the mapping outlives the file
+		return (out_image, out_meta, clipped_file)
 	
 	# update meta
 	out_meta.update({"driver": "GTiff",
@@ -1045,7 +1718,48 @@ def clip_raster_to_vector(raster_file, vector, dest_nodata=None):
 	# update nodata
 	out_meta.update({'nodata': nodata})
 
-	return (out_image, out_meta)
+	cached_file = None
+	if key:
+		cached_file = clipped_raster_cache.set(key, out_image, out_meta)
+	return (out_image, out_meta, cached_file)
+
+def clip_raster_to_vector(raster_file, vector, use_temp_dir=True, dest_nodata=None, streaming=None):
+	"""
+	Mask out regions of a raster that are outside the polygons defined in the shapefile.
+
+	Args:
+		raster_file: raster path
+		vector (geojson): Polygon to be used for clipping
+		use_temp_dir: If True, the resulting raster will be stored in /tmp directory, else in the media directory
+		dest_nodata (number): Value to set as nodata when returning the clipped raster
+		streaming (bool): Clip window by window. See `get_clipped_raster`
+	
+	Returns:
+		tuple (array, file, nodata): The clipped raster array, the path of the clipped raster and nodata value
+	"""
+	out_image, out_meta, cached_file = get_clipped_raster(raster_file, vector, dest_nodata=dest_nodata, streaming=streaming)
+
+	# get output file
+	if use_temp_dir:
+		out_file = get_temp_file(suffix=".tif")
+	else:
+		out_file = get_absolute_media_path(file_path=None, 
+									is_random_file=True, 
+									random_file_prefix="",
+									random_file_ext=".tif")
+
+	if cached_file and os.path.exists(cached_file):
+		# link the clipped raster so that the file outlives the eviction of the entry
+		if os.path.exists(out_file):
+			os.remove(out_file)
+		try:
+			os.link(cached_file, out_file)
+		except OSError:
+			shutil.copyfile(cached_file, out_file)
+	else:
+		with rasterio.open(out_file, "w", **out_meta) as dest:
+			dest.write(out_image)
+	return (out_image, out_file, out_meta['nodata'])
 
 def clip_raster_to_vector_old(raster_file, vector, use_temp_dir=True, dest_nodata=None):
 	"""
@@ -1259,6 +1973,7 @@ def clip_raster_to_vector_windowed(raster_file, vector, window_size, use_temp_di
 		apply_func=None, dest_nodata=None): 
 	"""
 	Mask out regions of a raster that are outside the polygons defined in the shapefile.
+	The raster is always clipped window by window, see `get_clipped_raster`.
 
 	Args:
 		raster_file (string or array): Raster file or raster array
@@ -1270,26 +1985,132 @@ def clip_raster_to_vector_windowed(raster_file, vector, window_size, use_temp_di
 		dest_nodata (number): Value to set as nodata when returning the clipped raster
 
 	Returns:
-		tuple(array, nodata, file): Raster, value of nodata, filepath of the generated raster
+		tuple(array, file, nodata): Raster, filepath of the generated raster, value of nodata
 	"""
-	def get_dest_file():
-		# get output file
-		if use_temp_dir:
-			out_file = get_temp_file(suffix=".tif")
-		else:
-			out_file = get_absolute_media_path(file_path=None, 
-										is_random_file=True, 
-										random_file_prefix="",
-										random_file_ext=".tif")
-		return out_file
-		
 	# Clip the raster first
-	array, file, nodata = clip_raster_to_vector(raster_file, vector, use_temp_dir=use_temp_dir, dest_nodata=dest_nodata)
-	out_file = get_dest_file()# get output file
+	array, file, nodata = clip_raster_to_vector(raster_file, vector, use_temp_dir=use_temp_dir, 
+									dest_nodata=dest_nodata, streaming=True)
+	if not apply_func:
+		return (array, file, nodata)
+
+	# get output file
+	if use_temp_dir:
+		out_file = get_temp_file(suffix=".tif")
+	else:
+		out_file = get_absolute_media_path(file_path=None, 
+									is_random_file=True, 
+									random_file_prefix="",
+									random_file_ext=".tif")
 	out_raster = segment_and_concatenate(matrix=array, func=apply_func, block_size=window_size, nodata=nodata)
 	res = save_raster(dataset=out_raster, source_path=file, target_path=out_file)
 	return (out_raster, out_file, nodata)
 	
+def are_rasters_aligned(raster_files):
+	"""Check whether rasters share the same grid i.e the same shape, transform and CRS
+
+	Args:
+		raster_files (list): Paths of the rasters
+
+	Returns:
+		bool
+	"""
+	grids = []
+	for raster_file in raster_files:
+		if not raster_file:
+			return False
+		with rasterio.open(raster_file) as src:
+			grids.append((src.shape, src.transform, src.crs))
+	return all([grid == grids[0] for grid in grids])
+
+def get_block_processing_workers():
+	"""Get the number of processes used to process raster blocks"""
+	workers = get_gis_settings().raster_processing_workers
+	return workers if workers and workers > 0 else os.cpu_count() or 1
+
+def _process_raster_block(raster_files, window, func, func_kwargs):
+	"""Read a window of each raster and apply `func` to the blocks.
+	Runs in the worker processes of `process_raster_blocks`
+
+	Returns:
+		tuple (window, block, unique_values, counts)
+	"""
+	blocks = []
+	for raster_file in raster_files:
+		with rasterio.open(raster_file) as src:
+			blocks.append(src.read(1, window=window))
+	out = np.asarray(func(blocks, **func_kwargs))
+	unique, counts = np.unique(out, return_counts=True)
+	return (window, out, unique, counts)
+
+def process_raster_blocks(raster_files, func, out_file, nodata, dtype=rasterio.int16, 
+		func_kwargs=None, workers=None, window_size=None):
+	"""
+	Apply a function to aligned rasters tile by tile and write the result to a raster.
+
+	The grid of the rasters is split into tiles which are processed by a pool of
+	`workers` processes. Each worker reads its tile from the raster files, so only
+	the paths are sent to the workers. Finished tiles are written to the output 
+	raster as they complete and the values of the output raster are counted along
+	the way, so memory is bounded by the tile size and the number of workers.
+
+	Args:
+		raster_files (list): Paths of the input rasters. They must be aligned
+		func (function): Function called as func(blocks, **func_kwargs) where `blocks`
+					is a list with a 2D array per input raster. Must return a 2D array 
+					of the same shape. Must be defined at module level so that it can
+					be sent to the worker processes
+		out_file (string): Path of the output raster
+		nodata (number): Nodata value of the output raster
+		dtype (dtype): Data type of the output raster
+		func_kwargs (dict): Extra keyword arguments passed to `func`
+		workers (int): Number of processes. Defaults to the GIS settings
+		window_size (int): Approximate width and height of the tiles in pixels
+
+	Returns:
+		dict of {value: count} of the output raster, as expected by `return_raster_with_stats`
+	"""
+	func_kwargs = func_kwargs or {}
+	workers = workers or get_block_processing_workers()
+	if not are_rasters_aligned(raster_files):
+		raise AnalysisParamError(_("The rasters must have the same shape, transform and CRS"))
+
+	with rasterio.open(raster_files[0]) as src:
+		meta = src.meta
+		windows = list(get_streaming_windows(src, Window(0, 0, src.width, src.height), window_size))
+	meta.update({
+		"driver": "GTiff",
+		"count": 1,
+		"dtype": dtype,
+		"nodata": override_nodata(nodata),
+		"compress": "lzw",
+	})
+
+	value_counts = {}
+	def write_block(dest, result):
+		window, out, unique, counts = result
+		dest.write(out.astype(dtype), 1, window=window)
+		for val, count in zip(unique.tolist(), counts.tolist()):
+			value_counts[val] = value_counts.get(val, 0) + count
+
+	with rasterio.open(out_file, "w", tiled=True, blockxsize=256, blockysize=256, 
+						BIGTIFF="IF_SAFER", **meta) as dest:
+		if workers == 1 or len(windows) == 1:
+			for window in windows:
+				write_block(dest, _process_raster_block(raster_files, window, func, func_kwargs))
+		else:
+			with ProcessPoolExecutor(max_workers=workers) as executor:
+				pending = set()
+				for window in windows:
+					# limit the number of finished tiles held in memory
+					if len(pending) >= 2 * workers:
+						done, pending = wait(pending, return_when=FIRST_COMPLETED)
+						for future in done:
+							write_block(dest, future.result())
+					pending.add(executor.submit(_process_raster_block, raster_files, window, func, func_kwargs))
+				for future in as_completed(pending):
+					write_block(dest, future.result())
+	return value_counts
+
 def reshape_rasters(rasters):
 	"""Returns an array whose size is smallest amongst the rasters
 	Only reshapes rasters of shape (x, y) or (x, y, z)
@@ -1340,16 +2161,11 @@ def reshape_raster(raster, shape):
 	return raster
 
 def reshape_and_reproject_rasters(raster_objects, vector):
-	"""Reshape and reproject rasters
+	"""Align rasters to the grid of the largest raster
 	Pass a list of objects of type {'raster': array, 'rasterfile': string}
 	Args:		
 		raster_objects (list): List of objects of type {'raster': array, 'rasterfile': string}
-		vector: Vector to clip using
-	"""
-
-	"""
-	1. Loop through all the rasters and reproject. Get the raster with the largest dimension and use that as the ref raster
-
+		vector: Vector to clip using. Unused since the rasters are already clipped
 	"""
 	is_masked = isinstance(raster_objects[0]['raster'], ma.MaskedArray) if raster_objects else False
 	# get raster with max size
@@ -1357,21 +2173,20 @@ def reshape_and_reproject_rasters(raster_objects, vector):
 	largest_raster = [x for x in raster_objects if x['raster'].size == max_size][0] #get the first
 	results = []
 	for obj in raster_objects:
-		if obj['rasterfile'] != largest_raster['rasterfile']:
-			raster, ref_nodata = reproject_raster(reference_raster=largest_raster['rasterfile'],
-				raster=obj['rasterfile'],
-				vector=vector
-			)
-			raster_vals = get_raster_values(raster, 
-								band=GenericRasterBandEnum.HAS_SINGLE_BAND, 
-								raster_source=RasterSourceEnum.MODIS, 
-								windowed=False)	
-			if is_masked:
-				raster_vals = ma.array(raster_vals)
-				raster_vals[raster_vals==ref_nodata] = ma.masked #mask nodata values
-			results.append(raster_vals)
-		else:
-			results.append(largest_raster['raster'])
+		if obj['rasterfile'] == largest_raster['rasterfile'] or \
+				are_rasters_aligned([largest_raster['rasterfile'], obj['rasterfile']]):
+			results.append(obj['raster'])
+			continue
+		arrays, nodata_values, meta = align_rasters(reference_raster=largest_raster['rasterfile'],
+			rasters=[obj['rasterfile']],
+			resampling=Resampling.average,
+			dest_nodata=settings.DEFAULT_NODATA
+		)
+		raster_vals = arrays[0]
+		if is_masked:
+			raster_vals = ma.array(raster_vals)
+			raster_vals[raster_vals==nodata_values[0]] = ma.masked #mask nodata values
+		results.append(raster_vals)
 	return results
 
 def get_raster_models(admin_zero_id=None, **args):
@@ -1380,6 +2195,9 @@ def get_raster_models(admin_zero_id=None, **args):
 	Returns:
 		Enumerable: Return filtered Raster Models
 	"""
+	if raster_catalog.supports(args):
+		return raster_catalog.get_raster_models(admin_zero_id=admin_zero_id, **args)
+
 	raster_models = Raster.objects.filter(**args)
 	results = []
 	if raster_models:
@@ -1602,3 +2420,86 @@ def reclassify_by_quantiles(src_raster, classes_count, nodata):
 	# restore the nodata values
 	raster[np.isnan(raster)] = nodata
 	return raster.astype(src_raster.dtype)
+
+# Largest range of integer values reclassified using a dense lookup table 
+MAX_DENSE_LUT_SIZE = 1 << 16
+
+def compile_reclassification_matrix(matrix, mapping_key='mapping'):
+	"""Compile a reclassification matrix into sorted breakpoints and a lookup table
+
+	The matrix is a list of dicts of the form {'low': x, 'high': y, 'mapping': z}
+	where values in the range [low, high) are mapped to z. The breakpoints are
+	all the distinct low and high values so that each value falls into exactly
+	one interval [breakpoints[k], breakpoints[k+1]) which maps to lut[k].
+	Where entries of the matrix overlap, the last entry wins as if the
+	matrix was applied row by row.
+
+	Args:
+		matrix (list): List of dicts with low, high and mapping values
+		mapping_key (str): Key of the class value in each entry of the matrix
+
+	Returns:
+		tuple (breakpoints, lut, mapped) where `mapped` is False for the 
+		intervals not covered by any entry of the matrix
+	"""
+	lows = np.array([row['low'] for row in matrix], dtype=np.float64)
+	highs = np.array([row['high'] for row in matrix], dtype=np.float64)
+	mappings = np.array([row[mapping_key] for row in matrix])
+	breakpoints = np.unique(np.concatenate([lows, highs]))
+
+	# cover[r, k] is True if matrix entry r covers the interval k
+	cover = (lows[:, None] <= breakpoints[None, :-1]) & (highs[:, None] >= breakpoints[None, 1:])
+	last_entry = np.where(cover, np.arange(len(matrix))[:, None], -1).max(axis=0, initial=-1)
+	mapped = last_entry >= 0
+	lut = np.where(mapped, mappings[np.maximum(last_entry, 0)], 0)
+	return breakpoints, lut, mapped
+
+def reclassify_raster(raster, matrix, nodata, mapping_key='mapping', dtype=np.int32, out=None):
+	"""Reclassify a raster using a reclassification matrix in a single pass
+
+	Values in the range [low, high) of an entry of the matrix are replaced by 
+	the mapping of the entry. NoData, masked, NaN values and values not covered
+	by the matrix are set to `nodata`.
+	Integer rasters with a small range of values are mapped using a dense lookup
+	table indexed by the pixel values. Other rasters are mapped by searching the
+	sorted breakpoints of the matrix.
+
+	Args:
+		raster (ndarray|MaskedArray): Raster to reclassify
+		matrix (list): List of dicts of the form {'low': x, 'high': y, 'mapping': z}
+		nodata (number): NoData value
+		mapping_key (str): Key of the class value in each entry of the matrix
+		dtype (dtype): Data type of the returned raster. Ignored if `out` is passed
+		out (ndarray, optional): Array to write the classes into. Pass the 
+			source raster to reclassify it in place
+
+	Returns:
+		ndarray of the same shape as `raster`
+	"""
+	if not matrix:
+		raise AnalysisParamError(_("The reclassification matrix must not be empty"))
+	data = ma.getdata(raster)
+	invalid = ma.getmaskarray(raster) | (data == nodata)
+	breakpoints, lut, mapped = compile_reclassification_matrix(matrix, mapping_key)
+
+	def lookup(values):
+		idx = np.searchsorted(breakpoints, values, side='right') - 1
+		found = (idx >= 0) & (idx < len(lut)) # NaN is sorted after all the breakpoints
+		idx = np.clip(idx, 0, len(lut) - 1)
+		return lut[idx], found & mapped[idx]
+
+	if np.issubdtype(data.dtype, np.integer) and data.size:
+		min_val, max_val = int(data.min()), int(data.max())
+		if max_val - min_val <= MAX_DENSE_LUT_SIZE:
+			dense_lut, dense_mapped = lookup(np.arange(min_val, max_val + 1))
+			offsets = data.astype(np.intp) - min_val
+			classes, found = dense_lut[offsets], dense_mapped[offsets]
+		else:
+			classes, found = lookup(data)
+	else:
+		classes, found = lookup(data)
+
+	if out is None:
+		out = np.empty(data.shape, dtype=dtype)
+	out[...] = np.where(found & ~invalid, classes, nodata)
+	return out
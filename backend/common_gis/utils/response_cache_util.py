@@ -0,0 +1,128 @@
+"""
+Cached, conditional responses of tables that rarely change e.g admin levels.
+
+Each table has a version stamp kept in Redis, the time at which it last changed.
+Responses are rendered once per version and stored compressed in the result
+cache, and are returned with an ETag and a Last-Modified header derived from
+the version so that clients revalidate with If-None-Match/If-Modified-Since and
+get a 304 when the table has not changed.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from common.utils.cache_util import result_cache
+from common.utils.json_util import dumps, JSONBytesResponse
+import django_rq
+import hashlib
+import logging
+import redis
+import time
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "ldms:table_version:"
+# used when Redis is not available
+local_versions = {}
+
+def get_connection():
+	return django_rq.get_connection('default')
+
+def get_table_version(table):
+	"""Get the version stamp of a table i.e the time at which it last changed
+
+	Args:
+		table (string): Name of the table
+
+	Returns:
+		float
+	"""
+	try:
+		conn = get_connection()
+		version = conn.get(VERSION_KEY + table)
+		if version is None:
+			# unknown, so consider that the table changed now
+			conn.setnx(VERSION_KEY + table, repr(time.time()))
+			version = conn.get(VERSION_KEY + table)
+		return float(version)
+	except redis.RedisError as e:
+		logger.warning("Table versions unavailable: %s", e)
+		return local_versions.setdefault(table, time.time())
+
+def bump_table_version(table):
+	"""Mark a table as changed so that its cached responses are no longer used.
+	The version is bumped after the current transaction commits. Otherwise a
+	request could read the rows before the commit and cache them under the new version
+	"""
+	def _bump():
+		now = time.time()
+		local_versions[table] = now
+		try:
+			get_connection().set(VERSION_KEY + table, repr(now))
+		except redis.RedisError as e:
+			logger.warning("Table versions unavailable: %s", e)
+	transaction.on_commit(_bump)
+
+def get_etag(table, version, request):
+	"""Get the ETag of the response to a request given the version of the table"""
+	variant = "%s?%s" % (request.path, request.META.get('QUERY_STRING', ''))
+	digest = hashlib.sha1(("%s:%r:%s" % (table, version, variant)).encode("utf-8")).hexdigest()
+	return quote_etag(digest)
+
+def is_not_modified(request, etag, last_modified):
+	"""Check the conditional headers of a request"""
+	if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+	if if_none_match:
+		# If-None-Match takes precedence over If-Modified-Since
+		etags = [x.strip() for x in if_none_match.split(',')]
+		return '*' in etags or etag in etags or ('W/' + etag) in etags
+	if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+	return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+def get_cached_response(request, table, render):
+	"""Get the response to a request on a table, rendering it only if it is not cached
+
+	Args:
+		request: Request object
+		table (string): Name of the table the response depends on
+		render (function): Function returning the data of the response
+
+	Returns:
+		HttpResponseNotModified if the client has the current version, else a JSONBytesResponse
+	"""
+	version = get_table_version(table)
+	etag = get_etag(table, version, request)
+	headers = {
+		'ETag': etag,
+		'Last-Modified': http_date(int(version)),
+		'Cache-Control': 'no-cache', # the client may store it but must revalidate it
+	}
+	if is_not_modified(request, etag, version):
+		response = HttpResponseNotModified()
+	else:
+		key = "table_response:" + etag.strip('"')
+		data = result_cache.get(key, raw=True)
+		if data is None:
+			data = dumps(render())
+			result_cache.set(key, data, settings.TABLE_RESPONSE_CACHE_TIMEOUT)
+		response = JSONBytesResponse(data)
+	for header, value in headers.items():
+		response[header] = value
+	return response
+
+class CachedTableResponseMixin():
+	"""
+	Viewset mixin returning cached, conditional list and detail responses.
+	Viewsets implement `get_list_data` and `get_detail_data`.
+	"""
+	def get_table_name(self):
+		return self.queryset.model._meta.db_table
+
+	def list(self, request, *args, **kwargs):
+		return get_cached_response(request, self.get_table_name(),
+								lambda: self.get_list_data(request, *args, **kwargs))
+
+	def retrieve(self, request, *args, **kwargs):
+		return get_cached_response(request, self.get_table_name(),
+								lambda: self.get_detail_data(request, *args, **kwargs))
@@ -1,8 +1,11 @@
 from common_gis.models import GISSettings
+from common.utils.settings_util import SettingsCache
+
+gis_settings_cache = SettingsCache(GISSettings)
 
 def get_gis_settings():
     """
     Load System Settings
     """
-    setts = GISSettings.load()
-    return setts
\ No newline at end of file
+    setts = gis_settings_cache.get()
+    return setts
@@ -0,0 +1,68 @@
+"""
+Running per-pixel statistics of a stack of rasters.
+
+The rasters of a multi-year stack are consumed one at a time and only the
+running statistics are kept in memory, so that the memory used does not grow
+with the number of periods.
+"""
+
+import numpy as np
+import numpy.ma as ma
+
+class RunningStats():
+	"""
+	Per-pixel running mean and variance using Welford's algorithm.
+
+	Like `reshape_rasters`, rasters of different shapes are cropped to the
+	smallest number of rows and columns. Pixel values are used as they are,
+	NoData included, which is what `np.mean` and `np.std` of the stacked rasters give.
+	"""
+	def __init__(self):
+		self.count = 0
+		self.mean = None
+		self.m2 = None # sum of squared differences from the mean
+
+	def crop(self, shape):
+		"""Crop the running statistics to the top left `shape`"""
+		rows, cols = shape
+		self.mean = self.mean[:rows, :cols]
+		self.m2 = self.m2[:rows, :cols]
+
+	def update(self, raster):
+		"""Add a raster to the statistics
+
+		Args:
+			raster (ndarray): 2D raster
+		"""
+		data = ma.getdata(raster)
+		if self.mean is None:
+			self.mean = np.zeros(data.shape, dtype=np.float64)
+			self.m2 = np.zeros(data.shape, dtype=np.float64)
+		shape = tuple(min(x, y) for x, y in zip(self.mean.shape, data.shape))
+		if shape != self.mean.shape:
+			self.crop(shape)
+		data = data[:shape[0], :shape[1]].astype(np.float64)
+
+		self.count += 1
+		delta = data - self.mean
+		self.mean += delta / self.count
+		data -= self.mean # reuse the copy for the delta from the updated mean
+		self.m2 += delta * data
+
+	def get_variance(self, ddof=0):
+		"""Get the per-pixel variance
+
+		Args:
+			ddof (int): Delta degrees of freedom as in `np.var`
+		"""
+		if self.count - ddof <= 0:
+			return np.full(self.mean.shape, np.nan)
+		return self.m2 / (self.count - ddof)
+
+	def get_std(self, ddof=0):
+		"""Get the per-pixel standard deviation
+
+		Args:
+			ddof (int): Delta degrees of freedom as in `np.std`
+		"""
+		return np.sqrt(self.get_variance(ddof))
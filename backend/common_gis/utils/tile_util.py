@@ -0,0 +1,129 @@
+"""
+Mapbox Vector Tiles of the administrative boundaries.
+
+Tiles are encoded by PostGIS with `ST_AsMVTGeom`/`ST_AsMVT` so that the map only
+downloads the simplified, clipped boundaries within the tile it draws instead
+of the full geometries. Encoded tiles are cached in the result cache under a
+key that contains the version stamp of the table, so a change to the admin
+units invalidates the tiles of their table only.
+"""
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.utils.translation import gettext as _
+from common import AnalysisParamError
+from common.utils.cache_util import result_cache
+from common_gis.utils.vector_util import get_admin_level_model_class
+from common_gis.utils.response_cache_util import get_table_version, get_etag, is_not_modified
+
+MVT_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+# half the width of the web mercator (EPSG:3857) square
+WEB_MERCATOR_EXTENT = 20037508.342789244
+
+# name of the layer and name column of each admin level
+TILE_LAYERS = {
+	-2: ("continental", "name"),
+	-1: ("regional", "name"),
+	0: ("admin0", "name_0"),
+	1: ("admin1", "name_1"),
+	2: ("admin2", "name_2"),
+}
+
+def get_tile_bounds(z, x, y):
+	"""Get the web mercator bounds (xmin, ymin, xmax, ymax) of a XYZ tile"""
+	size = 2 * WEB_MERCATOR_EXTENT / (1 << z)
+	xmin = -WEB_MERCATOR_EXTENT + x * size
+	ymax = WEB_MERCATOR_EXTENT - y * size
+	return (xmin, ymax - size, xmin + size, ymax)
+
+def get_tile_tolerance(z, extent):
+	"""Get the simplification tolerance in degrees of a tile i.e the width of one of
+	its pixels at the equator, below which vertices are merged by ST_AsMVTGeom anyway"""
+	return 360.0 / (1 << z) / extent
+
+def validate_tile(level, z, x, y):
+	"""Validate the level and coordinates of a tile
+
+	Returns:
+		tuple (model class, z, x, y)
+	"""
+	model = get_admin_level_model_class(level)
+	if not model or int(level) not in TILE_LAYERS:
+		raise AnalysisParamError(_("Invalid admin level {0}").format(level))
+	z, x, y = int(z), int(x), int(y)
+	if z < 0 or z > settings.VECTOR_TILE_MAX_ZOOM:
+		raise AnalysisParamError(_("The zoom level must be between 0 and {0}").format(settings.VECTOR_TILE_MAX_ZOOM))
+	if not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+		raise AnalysisParamError(_("Invalid tile {0}/{1}/{2}").format(z, x, y))
+	return model, z, x, y
+
+def render_tile(level, z, x, y):
+	"""Encode the admin units of a level within a tile
+
+	Args:
+		level (int): Administration level
+		z, x, y (int): XYZ coordinates of the tile
+
+	Returns:
+		bytes: Mapbox Vector Tile. Empty if the tile has no admin units
+	"""
+	model, z, x, y = validate_tile(level, z, x, y)
+	layer, name_column = TILE_LAYERS[int(level)]
+	extent = settings.VECTOR_TILE_EXTENT
+	buffer = settings.VECTOR_TILE_BUFFER
+	qn = connection.ops.quote_name
+	table = qn(model._meta.db_table)
+	geom = qn(model._meta.get_field('geom').column)
+	name = qn(model._meta.get_field(name_column).column)
+	srid = model._meta.get_field('geom').srid
+
+	# the envelope is clamped to the latitudes that can be transformed to the
+	# geometries' srid. Geometries are simplified before they are transformed
+	# so that low zoom tiles do not project every vertex of every unit
+	sql = """
+		WITH bounds AS (
+			SELECT ST_MakeEnvelope(%s, %s, %s, %s, 3857) AS geom
+		),
+		mvtgeom AS (
+			SELECT t.id, t.{name} AS name,
+				ST_AsMVTGeom(ST_Transform(ST_Simplify(t.{geom}, %s, true), 3857),
+							 bounds.geom, %s, %s, true) AS geom
+			FROM {table} t, bounds
+			WHERE t.{geom} && ST_Transform(bounds.geom, {srid})
+		)
+		SELECT ST_AsMVT(mvtgeom.*, %s, %s, 'geom') FROM mvtgeom WHERE mvtgeom.geom IS NOT NULL
+	""".format(name=name, geom=geom, table=table, srid=int(srid))
+	xmin, ymin, xmax, ymax = get_tile_bounds(z, x, y)
+	limit = WEB_MERCATOR_EXTENT * 0.999 # ~85.05 degrees
+	ymin, ymax = max(ymin, -limit), min(ymax, limit)
+	params = [xmin, ymin, xmax, ymax, get_tile_tolerance(z, extent), extent, buffer, layer, extent]
+	with connection.cursor() as cursor:
+		cursor.execute(sql, params)
+		row = cursor.fetchone()
+	return bytes(row[0]) if row and row[0] else b""
+
+def get_tile_response(request, level, z, x, y):
+	"""Get the response of a tile, encoding it only if it is not cached.
+
+	Tiles are revalidated with their ETag like the admin level lists so that a
+	client only downloads a tile again when its table has changed.
+	"""
+	model, z, x, y = validate_tile(level, z, x, y)
+	table = model._meta.db_table
+	version = get_table_version(table)
+	etag = get_etag(table, version, request)
+	if is_not_modified(request, etag, version):
+		response = HttpResponseNotModified()
+	else:
+		key = "tile:%s:%r:%s/%s/%s" % (table, version, z, x, y)
+		data = result_cache.get(key, raw=True)
+		if data is None:
+			data = render_tile(level, z, x, y)
+			result_cache.set(key, data, settings.VECTOR_TILE_CACHE_TIMEOUT)
+		response = HttpResponse(data, content_type=MVT_CONTENT_TYPE)
+	response['ETag'] = etag
+	response['Last-Modified'] = http_date(int(version))
+	response['Cache-Control'] = 'no-cache'
+	return response
@@ -0,0 +1,146 @@
+"""
+Categorical transition kernel.
+
+Compiles change matrices that map a combination of categories (e.g. base and
+target land cover classes) to an output value into a dense N-dimensional lookup
+table indexed by category codes, so that a whole raster is mapped with a single
+fancy-indexing operation.
+"""
+
+import numpy as np
+import numpy.ma as ma
+from django.utils.translation import gettext as _
+from common import AnalysisParamError
+
+class TransitionMatrix():
+	"""
+	Dense lookup table compiled from a categorical transition matrix.
+
+	Each dimension of the lookup table corresponds to one input raster. The
+	categories of each dimension are the distinct values of that dimension in the
+	matrix plus an extra last slot for every other value (including nodata).
+	Combinations not defined in the matrix map to `nodata`.
+	"""
+	def __init__(self, transitions, nodata, dtype=np.int32):
+		"""
+		Args:
+			transitions (list): List of (categories, value) tuples where `categories` is
+				a tuple with one category per input raster. If a combination is repeated,
+				the last value wins as if the matrix was applied row by row
+			nodata (number): Value of combinations not defined in the matrix
+			dtype (dtype): Data type of the output raster
+		"""
+		if not transitions:
+			raise AnalysisParamError(_("The transition matrix must not be empty"))
+		ndim = len(transitions[0][0])
+		self.nodata = nodata
+		self.categories = [np.unique([key[dim] for key, val in transitions]) for dim in range(ndim)]
+		self.shape = tuple(len(cats) + 1 for cats in self.categories)
+		self.lut = np.full(self.shape, nodata, dtype=dtype)
+		for key, val in transitions:
+			idx = tuple(int(np.searchsorted(cats, key[dim])) for dim, cats in enumerate(self.categories))
+			self.lut[idx] = val
+
+	@classmethod
+	def from_rows(cls, matrix, keys, nodata, mapping_key='mapping', dtype=np.int32):
+		"""Compile a list of dicts such as [{'base': x, 'curr': y, 'mapping': z}]
+
+		Args:
+			matrix (list): List of dicts
+			keys (list): Keys of the categories, one per input raster. e.g ['base', 'curr']
+			nodata (number): Value of combinations not defined in the matrix
+			mapping_key (str): Key of the output value
+		"""
+		transitions = [(tuple(row[key] for key in keys), row[mapping_key]) for row in matrix]
+		return cls(transitions, nodata, dtype)
+
+	@classmethod
+	def from_class_lists(cls, matrix, class_map, nodata, dtype=np.int32):
+		"""Compile a dict of the form {base: {'stable': [targets], 'improved': [targets]}}
+		as used by the LULC transition matrix
+
+		Args:
+			matrix (dict): Dict keyed by the base category
+			class_map (dict): Output value of each list e.g {'stable': 0, 'improved': 1}
+			nodata (number): Value of combinations not defined in the matrix
+		"""
+		transitions = []
+		for base in matrix:
+			for list_key, val in class_map.items():
+				transitions.extend([((base, target), val) for target in matrix[base].get(list_key, [])])
+		return cls(transitions, nodata, dtype)
+
+	@classmethod
+	def from_coefficient_matrix(cls, matrix, nodata, dtype=np.float64):
+		"""Compile a list of dicts of the form [{'base_lc': x, 'coeffs': {target: coeff}}]
+		as used by the SOC coefficient matrix. Categories are enum values whose
+		first element is the category key
+
+		Args:
+			matrix (list): List of dicts
+			nodata (number): Value of combinations not defined in the matrix
+		"""
+		transitions = []
+		for mapping in matrix:
+			for target, coeff in mapping['coeffs'].items():
+				transitions.append(((mapping['base_lc'][0], target[0]), coeff))
+		return cls(transitions, nodata, dtype)
+
+	def encode(self, raster, dim):
+		"""Convert a raster to the category codes of a dimension
+
+		Args:
+			raster (ndarray|MaskedArray): Raster of categories
+			dim (int): Dimension of the lookup table
+
+		Returns:
+			ndarray of codes. Values not in the matrix and masked values get the last code
+		"""
+		cats = self.categories[dim]
+		data = ma.getdata(raster)
+		idx = np.clip(np.searchsorted(cats, data), 0, len(cats) - 1)
+		found = (cats[idx] == data) & ~ma.getmaskarray(raster)
+		return np.where(found, idx, len(cats)).astype(np.min_scalar_type(len(cats)))
+
+	def apply(self, rasters, return_counts=False):
+		"""Map a combination of rasters to the output values
+
+		Args:
+			rasters (list): Rasters of the same shape, one per dimension
+			return_counts (bool): If True, also return the transition counts
+
+		Returns:
+			The mapped raster or, if `return_counts`, a tuple (raster, counts)
+			where `counts` has the shape of the lookup table and counts[i, j, ...]
+			is the number of pixels with the categories (categories[0][i], categories[1][j], ...)
+		"""
+		if len(rasters) != len(self.shape):
+			raise AnalysisParamError(_("Expected {0} rasters but got {1}").format(len(self.shape), len(rasters)))
+		flat_idx = np.zeros(np.shape(rasters[0]), dtype=np.intp)
+		for dim, raster in enumerate(rasters):
+			flat_idx *= self.shape[dim]
+			flat_idx += self.encode(raster, dim)
+		out = self.lut.ravel()[flat_idx]
+		if not return_counts:
+			return out
+		counts = np.bincount(flat_idx.ravel(), minlength=self.lut.size).reshape(self.shape)
+		return out, counts
+
+	def get_transition_counts(self, counts):
+		"""Convert the counts returned by `apply` to a list of dicts
+
+		Args:
+			counts (ndarray): Counts returned by `apply`
+
+		Returns:
+			List of {'categories': [...], 'count': n} for the non-zero combinations
+			of categories defined in the matrix
+		"""
+		res = []
+		defined = counts[tuple(slice(0, len(cats)) for cats in self.categories)]
+		for idx in zip(*np.nonzero(defined)):
+			res.append({
+				'categories': [self.categories[dim][i].item() for dim, i in enumerate(idx)],
+				'count': int(defined[idx])
+			})
+		return res
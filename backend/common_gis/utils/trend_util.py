@@ -0,0 +1,167 @@
+"""
+Vectorized per-pixel trend statistics.
+
+All functions operate on a stack of rasters of shape (years, rows, cols) and
+compute the statistics for every pixel at once using numpy array math, instead
+of calling scipy once per pixel.
+"""
+
+import math
+import numpy as np
+import numpy.ma as ma
+from scipy.special import erfc
+from django.utils.translation import gettext as _
+from common import AnalysisParamError
+
+# Above this number of periods, scipy.stats.kendalltau switches from the exact
+# null distribution to the normal approximation. We do the same so that the
+# significance test gives the same results as the per-pixel implementation.
+MAX_PERIODS_FOR_EXACT_PVALUE = 33
+
+def get_trend_valid_mask(stack, nodata):
+	"""Get a mask of pixels that have valid data for every period
+
+	Args:
+		stack (ndarray|MaskedArray): Array of shape (years, rows, cols)
+		nodata (number): NoData value
+
+	Returns:
+		Boolean ndarray of shape (rows, cols). True where all periods have data
+	"""
+	invalid = ma.getmaskarray(stack) | (ma.getdata(stack) == nodata)
+	if np.issubdtype(stack.dtype, np.floating):
+		invalid |= np.isnan(ma.getdata(stack))
+	return ~np.logical_or.reduce(invalid, axis=0)
+
+def compute_ols_slope(stack, time_array):
+	"""Compute the Ordinary Least Squares slope of each pixel against time.
+
+	Uses the closed form slope = sum(tc * y) / sum(tc^2) where tc is the centered
+	time vector. Centering the time vector removes the need for the intercept.
+
+	Args:
+		stack (ndarray): Array of shape (years, ...)
+		time_array (list): List of periods, one per layer of the stack
+
+	Returns:
+		float64 ndarray of shape stack.shape[1:]
+	"""
+	t = np.asarray(time_array, dtype=np.float64)
+	tc = t - t.mean()
+	denom = np.sum(tc * tc)
+	slope = np.zeros(stack.shape[1:], dtype=np.float64)
+	if denom == 0:
+		return slope
+	# accumulate one layer at a time to avoid a float64 copy of the whole stack
+	for i in range(len(tc)):
+		slope += tc[i] * stack[i]
+	slope /= denom
+	return slope
+
+def compute_mann_kendall(stack, time_array):
+	"""Compute the Mann-Kendall S statistic and its two sided p-value for each pixel.
+
+	S is computed as the pairwise sign-sum over all period pairs. The p-value
+	is derived from the exact null distribution of S when the pixel series has no
+	ties and the number of periods is at most `MAX_PERIODS_FOR_EXACT_PVALUE`.
+	Otherwise the normal approximation with the tie-corrected variance is used.
+	This mirrors the behaviour of `scipy.stats.kendalltau`.
+
+	Args:
+		stack (ndarray): Array of shape (years, ...)
+		time_array (list): List of distinct periods, one per layer of the stack
+
+	Returns:
+		A tuple (s, pvalue) of arrays of shape stack.shape[1:]. Series where all
+		values are equal have a p-value of 1
+	"""
+	t = np.asarray(time_array, dtype=np.float64)
+	n = len(t)
+	if len(np.unique(t)) != n:
+		raise AnalysisParamError(_("The periods used to compute the trend must be distinct"))
+
+	shape = stack.shape[1:]
+	s = np.zeros(shape, dtype=np.int32)
+	# number of values in the series equal to the value at each period
+	tie_counts = np.ones((n,) + shape, dtype=np.int32)
+	for i in range(n - 1):
+		for j in range(i + 1, n):
+			diff = np.sign(stack[j] - stack[i]).astype(np.int32)
+			s += diff if t[j] > t[i] else -diff
+			equal = diff == 0
+			tie_counts[i] += equal
+			tie_counts[j] += equal
+
+	"""
+	A tie group of size k contributes k(k-1)(2k+5) to the variance correction.
+	Each of the k members of the group has a tie count of k, hence summing
+	(k-1)(2k+5) over every period yields the same sum over all the groups.
+	"""
+	tie_correction = np.sum((tie_counts - 1) * (2 * tie_counts + 5), axis=0, dtype=np.float64)
+	has_ties = tie_correction > 0
+	del tie_counts
+
+	var_s = (n * (n - 1) * (2 * n + 5) - tie_correction) / 18.0
+	pvalue = np.ones(shape, dtype=np.float64)
+
+	approx = var_s > 0
+	if n <= MAX_PERIODS_FOR_EXACT_PVALUE:
+		approx &= has_ties
+		exact = ~has_ties
+		pvalue[exact] = get_exact_kendall_pvalues(n)[((n * (n - 1) // 2 - np.abs(s[exact])) // 2)]
+	z = np.abs(s[approx]) / np.sqrt(var_s[approx])
+	pvalue[approx] = erfc(z / math.sqrt(2))
+	return s, pvalue
+
+def get_exact_kendall_pvalues(n):
+	"""Get the two sided p-values of the exact null distribution of S for a series
+	of `n` values without ties.
+
+	Under the null hypothesis, the number of discordant pairs follows the
+	Mahonian distribution (number of permutations of n items with k inversions).
+
+	Args:
+		n (int): Number of periods
+
+	Returns:
+		ndarray where the value at index c is the p-value when the smaller of the
+		discordant and concordant pair counts is c
+	"""
+	total_pairs = n * (n - 1) // 2
+	counts = np.zeros(total_pairs + 1, dtype=np.float64)
+	counts[0] = 1.0
+	for j in range(2, n + 1):
+		# adding the j-th item adds between 0 and j-1 inversions
+		cum = np.cumsum(counts)
+		shifted = np.zeros_like(cum)
+		shifted[j:] = cum[:-j]
+		counts = cum - shifted
+	cdf = np.cumsum(counts) / math.factorial(n)
+	return np.clip(2.0 * cdf, 0, 1)
+
+def compute_trend(stack, time_array, nodata):
+	"""Compute the per-pixel trend of a stack of rasters.
+
+	Args:
+		stack (ndarray|list): Array of shape (years, rows, cols) or a list of 2D arrays
+		time_array (list): List of periods, one per layer of the stack
+		nodata (number): NoData value. Pixels with nodata in any period are masked
+
+	Returns:
+		A tuple (slope, pvalue) of masked arrays of shape (rows, cols) where `slope`
+		is the OLS slope and `pvalue` is the Mann-Kendall significance
+	"""
+	if isinstance(stack, (list, tuple)):
+		stack = ma.stack(stack) if any(ma.isMaskedArray(x) for x in stack) else np.stack(stack)
+	if stack.ndim != 3 or stack.shape[0] != len(time_array):
+		raise AnalysisParamError(_("The stack must have one layer for each period"))
+
+	valid = get_trend_valid_mask(stack, nodata)
+	data = ma.getdata(stack)[:, valid].astype(np.float64) # (years, valid_pixels)
+
+	slope = np.full(valid.shape, nodata, dtype=np.float64)
+	pvalue = np.full(valid.shape, nodata, dtype=np.float64)
+	if data.shape[1]:
+		slope[valid] = compute_ols_slope(data, time_array)
+		pvalue[valid] = compute_mann_kendall(data, time_array)[1]
+	return ma.array(slope, mask=~valid), ma.array(pvalue, mask=~valid)
@@ -17,8 +17,8 @@ import shapely.geometry
 import pyproj
 from shapely.geometry import shape
 from shapely.ops import transform
-from functools import partial
 from common_gis.utils.settings_util import get_gis_settings
+from common.utils.common_util import cint
 import geopandas as gpd
 from django.contrib.auth import get_user_model
 
@@ -29,8 +29,20 @@ import zipfile
 import shutil
 import tempfile
 import logging
-from itertools import chain
-import operator
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+from django.db.models.functions import Cast
+from django.contrib.gis.db.models import GeographyField
+from django.contrib.gis.db.models.functions import Area
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import F, Value, IntegerField, FloatField, CharField
+from django.db.models.functions import Concat
+from common.utils.cache_util import result_cache
+import hashlib
+from shapely.prepared import prep
+from shapely import wkb
+from django.conf import settings
 
 log = logging.getLogger(f'common_gis.apps.{__name__}')
 
@@ -393,22 +405,182 @@ def get_vector_from_db(level_id, admin_shapefile_id):
 	Returns:
 		tuple(vector, error): If valid model, vector has a GeoJSON while error is empty
 	"""
-	vector_model = None
-	if level_id == -2:
-		vector_model = ContinentalAdminLevel.objects.filter(id=admin_shapefile_id).first()	
-	if level_id == -1:
-		vector_model = RegionalAdminLevel.objects.filter(id=admin_shapefile_id).first()	
-	if level_id == 0:
-		vector_model = AdminLevelZero.objects.filter(id=admin_shapefile_id).first()			
-	if level_id == 1:
-		vector_model = AdminLevelOne.objects.filter(id=admin_shapefile_id).first()
-	if level_id == 2:
-		vector_model = AdminLevelTwo.objects.filter(id=admin_shapefile_id).first()
-
+	vector_model = get_admin_level_model(level_id, admin_shapefile_id)
 	if not vector_model:		
 		return (None, _("The selected vector %s does not exist" % (admin_shapefile_id)))		
 	return (vector_model.geom.geojson, None)
 
+def get_admin_level_model(level_id, admin_shapefile_id):
+	"""Get the model of an administrative unit or None if it does not exist
+
+	Args:
+		level_id (int): Administration Level
+		admin_shapefile_id (int): ID of the administrative unit shapefile
+	"""
+	model = get_admin_level_model_class(level_id)
+	if not model:
+		return None
+	return model.objects.filter(id=admin_shapefile_id).first()
+
+def get_admin_level_model_class(level_id):
+	"""Get the model class of an administration level or None if the level is invalid"""
+	models = {
+		-2: ContinentalAdminLevel,
+		-1: RegionalAdminLevel,
+		0: AdminLevelZero,
+		1: AdminLevelOne,
+		2: AdminLevelTwo,
+	}
+	try:
+		return models.get(int(level_id))
+	except (TypeError, ValueError):
+		return None
+
+class PreparedAdminGeometry():
+	"""
+	Prepared shapely geometry of an administrative unit.
+
+	Besides the exact geometry, it keeps the geometry simplified with a tolerance
+	shrunk and grown by twice the tolerance. Since simplification moves the boundary
+	by at most the tolerance, the shrunk geometry is within the exact geometry and
+	the grown one contains it, so most points are accepted or rejected against
+	these much smaller geometries and only the points close to the boundary are
+	tested against the exact geometry.
+	"""
+	def __init__(self, geom):
+		"""
+		Args:
+			geom (shapely geometry): Geometry of the administrative unit
+		"""
+		self.geom = geom
+		self.bounds = geom.bounds
+		self.prepared = prep(geom)
+		self.inner, self.outer = None, None
+		self.tolerance = self.get_tolerance()
+		if self.tolerance > 0:
+			simplified = geom.simplify(self.tolerance, preserve_topology=True)
+			if len(get_vertices(simplified)) < len(get_vertices(geom)):
+				# twice the tolerance as a margin for the approximation of the buffer arcs
+				inner = simplified.buffer(-2 * self.tolerance)
+				self.inner = prep(inner) if not inner.is_empty else None
+				self.outer = prep(simplified.buffer(2 * self.tolerance))
+
+	def get_tolerance(self):
+		"""Get the simplification tolerance, a fraction of the size of the geometry bounded 
+		by `settings.ADMIN_GEOMETRY_MAX_TOLERANCE`"""
+		minx, miny, maxx, maxy = self.bounds
+		size = max(maxx - minx, maxy - miny)
+		return min(size * settings.ADMIN_GEOMETRY_TOLERANCE_RATIO, settings.ADMIN_GEOMETRY_MAX_TOLERANCE)
+
+	def in_bounds(self, points):
+		"""Check if the bounding box of the points is within the bounding box of the geometry"""
+		minx, miny, maxx, maxy = points.bounds
+		return (minx >= self.bounds[0] and miny >= self.bounds[1] 
+			and maxx <= self.bounds[2] and maxy <= self.bounds[3])
+
+	def contains_points(self, points, all_touched=False):
+		"""Check if all the points fall within the geometry
+
+		Args:
+			points (MultiPoint): Points to check
+			all_touched (bool): If True, points on the boundary are within the geometry
+
+		Returns:
+			bool
+		"""
+		if not self.in_bounds(points):
+			return False
+		if self.inner and self.inner.contains_properly(points):
+			return True
+		if self.outer and not self.outer.covers(points):
+			return False
+		if all_touched:
+			return self.prepared.covers(points)
+		return self.prepared.contains_properly(points)
+
+	def get_point_outside(self, points, all_touched=False):
+		"""Get the first of the points that does not fall within the geometry"""
+		for pnt in points.geoms:
+			if all_touched:
+				if not self.prepared.intersects(pnt):
+					return pnt
+			elif not self.prepared.contains_properly(pnt):
+				return pnt
+		return None
+
+class AdminGeometryCache():
+	"""
+	Per-process LRU of the prepared geometries of administrative units, keyed by
+	admin level and id. It is cleared when an administrative unit is saved or deleted.
+	"""
+	def __init__(self, max_entries=None):
+		self.max_entries = max_entries
+		self.entries = OrderedDict()
+		self.areas = {} # areas are small, so all of them are kept
+		self.lock = threading.Lock()
+
+	def get_max_entries(self):
+		return self.max_entries if self.max_entries != None else settings.ADMIN_GEOMETRY_CACHE_MAX_ENTRIES
+
+	def get(self, level_id, admin_shapefile_id):
+		"""Get the prepared geometry of an administrative unit
+
+		Returns:
+			tuple(PreparedAdminGeometry, error)
+		"""
+		key = (str(level_id), str(admin_shapefile_id))
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry:
+				self.entries.move_to_end(key)
+				return (entry, None)
+
+		vector_model = get_admin_level_model(level_id, admin_shapefile_id)
+		if not vector_model:		
+			return (None, _("The selected vector %s does not exist" % (admin_shapefile_id)))
+		entry = PreparedAdminGeometry(wkb.loads(bytes(vector_model.geom.wkb)))
+
+		max_entries = self.get_max_entries()
+		if max_entries > 0:
+			with self.lock:
+				self.entries[key] = entry
+				while len(self.entries) > max_entries:
+					self.entries.popitem(last=False)
+		return (entry, None)
+
+	def get_area(self, level_id, admin_shapefile_id):
+		"""Get the geodesic area of an administrative unit in hectares, computed by the database
+
+		Returns:
+			The area or None if the unit does not exist
+		"""
+		key = (str(level_id), str(admin_shapefile_id))
+		with self.lock:
+			if key in self.areas:
+				return self.areas[key]
+		area = get_admin_level_areas(level_id, [cint(admin_shapefile_id)]).get(cint(admin_shapefile_id))
+		if area != None:
+			with self.lock:
+				self.areas[key] = area
+		return area
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.areas.clear()
+
+admin_geometry_cache = AdminGeometryCache()
+
+def get_vertices(geom):
+	"""Get the vertices of the exterior rings of a polygon or multipolygon"""
+	if geom.is_empty:
+		return []
+	if geom.geom_type == "Polygon":
+		return list(geom.exterior.coords)
+	if geom.geom_type == "MultiPolygon":
+		return [pnt for poly in geom.geoms for pnt in poly.exterior.coords]
+	return [pnt for pnt in geom.coords] if hasattr(geom, "coords") else []
+
 def get_admin_level_ids_from_db(level_id, admin_shapefile_id, return_models=False):
 	"""Retrieve the shapefile stored in the database
 
@@ -530,54 +702,40 @@ def validate_coords_within_admin_level(level_id, admin_shapefile_id, vector_coor
 		admin_shapefile_id (int): ID of the administrative unit shapefile
 		vector_coords (string): String representation of a geometry. GeoJson
 	"""
-	vector, error = get_vector_from_db(level_id, admin_shapefile_id)
+	parent, error = admin_geometry_cache.get(level_id, admin_shapefile_id)
 	if error:
 		return (False, error)
-	return is_subpolygon_contained_inside_polygon(vector_coords, vector)
+	return is_subpolygon_contained_inside_polygon(vector_coords, parent)
 
 def is_subpolygon_contained_inside_polygon(child_coords, parent_coords):
-	"""Check if a sub-polygon is contained within the boundaries of another polygon
+	"""Check if the vertices of a sub-polygon are contained within the boundaries of another polygon
 
 	Args:
 		child_coords (geojson): sub-polygon to check if it is within the parent_cords
-		parent_coords (geojson): Container polygon
+		parent_coords (geojson|PreparedAdminGeometry): Container polygon
 	
 	Returns:
 		tuple(bool, error): If there is an error, return (False, error) else return (True, None)
-
-	Sample GeoJSON:
-		"{\"type\":\"Polygon\",\"coordinates\":[[[8.949565887451172,36.478999869298576],[8.943042755126953,36.449594202722466],[8.94338607788086,36.432055939882105],[8.980979919433594,36.42846494058168],[9.010334014892578,36.434680026625855],[9.007759094238281,36.46657630040234],[8.994541168212889,36.47775760202128],[8.949565887451172,36.478999869298576]]]}"
 	"""
 	child, error = validate_custom_polygon(child_coords)
 	if error:
 		return (False, error)
-	parent, error = validate_custom_polygon(parent_coords)
-	if error:
-		return (False, error)
-
-	child = json.loads(child)
-	parent = json.loads(parent)
-
-	# Use Shapely to create the polygon
-	shape = shapely.geometry.asShape(parent) 
-
+	if not isinstance(parent_coords, PreparedAdminGeometry):
+		parent, error = validate_custom_polygon(parent_coords)
+		if error:
+			return (False, error)
+		parent_coords = PreparedAdminGeometry(shape(json.loads(parent)))
+
+	"""Points on the boundary are only within the polygon if all_touched, 
+	like the pixels selected by the raster clipping algorithm"""
 	all_touched = get_gis_settings().raster_clipping_algorithm == "All Touched"
-	# Get points of the sub-polygon
-	for pnt in child['coordinates'][0]:
-		point = shapely.geometry.Point(pnt) # lon, lat
-
-		"""shape.contains used if the point is fully within the polygon. 
-		If the point is on the boundary, it returns false. However, if you change 
-		contains to intersects you'll get a true result if you want to ensure points on the edge of the polygon are counted."""
-		if not all_touched:
-			if not shape.contains(point):
-				return (False, _("POINT {0} does not fall within the selected polygon".format(pnt)))
-		else:
-			if not shape.intersects(point):
-				return (False, _("POINT {0} does not fall within the selected polygon".format(pnt)))
+	points = shapely.geometry.MultiPoint(get_vertices(shape(json.loads(child))))
+	if parent_coords.contains_points(points, all_touched):
+		return (True, None)
+	pnt = parent_coords.get_point_outside(points, all_touched)
+	pnt = list(pnt.coords[0]) if pnt else None
+	return (False, _("POINT {0} does not fall within the selected polygon".format(pnt)))
 
-	return (True, None)
-		
 def get_vector(admin_level, shapefile_id, custom_vector_coords, admin_0, request, validate_threshold=True):
 	"""
 	Get vector to use for analysis
@@ -615,11 +773,17 @@ def get_vector(admin_level, shapefile_id, custom_vector_coords, admin_0, request
 	# 		return (None, msg)
 	return (vector, error)
 
-def queue_threshold_exceeded(request, vector):
+def queue_threshold_exceeded(request, vector, admin_level=None, vector_id=None):
 	"""
 	Queued tasks store the request.user as a dict and with the is_authenticated set as True, while
 	normal requests have the request.user as an object.
 
+	Args:
+		request: Request object
+		vector (geojson): Vector of the request. Not required if admin_level and vector_id are set
+		admin_level (int): Admin level of the vector if it is an admin unit
+		vector_id (int): Id of the admin unit. If set with admin_level, the area is computed by the database
+
 	Returns:
 		tuple(Bool, Bool, Str): 
 			First element: is True if area of vector is above set threshold
@@ -630,10 +794,15 @@ def queue_threshold_exceeded(request, vector):
 	# if 'is_queued' in request: # this is a request from a queued task
 	# 	return (True, "") 
 
+	def get_area():
+		if admin_level != None and vector_id != None:
+			return admin_geometry_cache.get_area(admin_level, vector_id)
+		return calculate_polygon_area(vector) if vector else None
+
 	def validate(setting, vector, guest_threshold, authenticated_threshold):
-		if not vector:
-			return (false, False, _("""The specified vector does not exist"""))
-		area = calculate_polygon_area(vector)
+		area = get_area()
+		if area == None:
+			return (False, False, _("""The specified vector does not exist"""))
 		if not authenticated:
 			if setting.enable_guest_user_limit and area > guest_threshold:
 				return (True, False, _("The area you selected is too big for processing. Please sign up first."))
@@ -665,83 +834,145 @@ def queue_threshold_exceeded(request, vector):
 			
 	return (False, False, "") # any other scenario, just process, no queueing	
 
+@lru_cache(maxsize=None)
+def get_geod():
+	"""Get the WGS84 ellipsoid used to compute geodesic areas"""
+	return pyproj.Geod(ellps="WGS84")
+
+@lru_cache(maxsize=32)
+def get_transformer(srid):
+	"""Get a transformer from a spatial reference to WGS84 longitudes and latitudes"""
+	return pyproj.Transformer.from_crs("EPSG:{0}".format(srid), "EPSG:4326", always_xy=True)
+
+def calculate_polygon_areas(geoms, srid=4326):
+	"""Calculate the geodesic areas of polygons
+
+	Args:
+		geoms (list): GeoJSON strings, GeoJSON dicts or shapely geometries
+		srid (int): Spatial reference of the coordinates of the geometries
+
+	Returns:
+		list of the areas in hectares. To convert to square kilometers, divide by 100
+	"""
+	geod = get_geod()
+	transformer = get_transformer(srid) if cint(srid) != 4326 else None
+	areas = []
+	for geom in geoms:
+		if isinstance(geom, str):
+			geom = json.loads(geom)
+		if isinstance(geom, dict):
+			geom = shape(geom)
+		if transformer:
+			geom = transform(transformer.transform, geom)
+		area, perimeter = geod.geometry_area_perimeter(geom)
+		areas.append(abs(area) / 10000) # metre squared to hectares
+	return areas
+
 def calculate_polygon_area(geom):
-	"""Calculate the area of polygon in square meters 
+	"""Calculate the geodesic area of a polygon
 
 	Args:
 		geom (geojson): GeoJson.
 
 	Returns:
-		Area in hectares. To convert to square kilometers, divide by 1000000
+		Area in hectares. To convert to square kilometers, divide by 100
 	"""
-	# geom = "{\"type\":\"Polygon\",\"coordinates\":[[[8.949565887451172,36.478999869298576],[8.943042755126953,36.449594202722466],[8.94338607788086,36.432055939882105],[8.980979919433594,36.42846494058168],[9.010334014892578,36.434680026625855],[9.007759094238281,36.46657630040234],[8.994541168212889,36.47775760202128],[8.949565887451172,36.478999869298576]]]}"
-	# geom = {'type': 'Polygon',
-	# 	'coordinates': [[[-122., 37.], [-125., 37.],
-	# 						[-125., 38.], [-122., 38.],
-	# 						[-122., 37.]]]}
-	# s = shape(geom)
-	s = shapely.geometry.asShape(json.loads(geom))
-	proj = partial(pyproj.transform, pyproj.Proj(init='epsg:4326'),
-				pyproj.Proj(init='epsg:3857'))
+	return calculate_polygon_areas([geom])[0]
 
-	s_new = transform(proj, s)
+def get_admin_level_areas(level_id, admin_shapefile_ids):
+	"""Calculate the geodesic areas of administrative units in the database 
+	with ST_Area(geography) so that their geometries are not fetched
 
-	projected_area = transform(proj, s).area
-
-	hectares = projected_area / 10000 #metre squared to hectares
-	return hectares
+	Args:
+		level_id (int): Administration Level
+		admin_shapefile_ids (list): IDs of the administrative units
 
-def search_vectors(query=None):
-	"""Search admin level zero, one and two for full text match
+	Returns:
+		dict of the area in hectares of each id that exists
+	"""
+	model = get_admin_level_model_class(level_id)
+	if not model:
+		return {}
+	rows = model.objects.filter(id__in=admin_shapefile_ids).annotate(
+				geog_area=Area(Cast('geom', output_field=GeographyField()))
+			).values_list('id', 'geog_area')
+	return {unit_id: area.sq_m / 10000 for unit_id, area in rows if area != None}
+
+def normalize_search_query(query):
+	"""Normalize a search term so that equivalent terms share the same cache entry"""
+	return " ".join(str(query).split()).lower() if query != None else ""
+
+def get_search_querysets(query):
+	"""Get a queryset per admin level returning the same columns (id, name, level, admin0, 
+	admin1, admin2, rank) so that they can be combined in a single UNION query.
+	The names are filtered with icontains, which uses the trigram indexes on UPPER(name),
+	and ranked by their trigram similarity to the query
+	"""
+	null_id = Value(None, output_field=IntegerField())
+	sep = Value(', ')
+	levels = [
+		(ContinentalAdminLevel, 'name', -2, F('name'), null_id, null_id, null_id),
+		(RegionalAdminLevel, 'name', -1, F('name'), null_id, null_id, null_id),
+		(AdminLevelZero, 'name_0', 0, F('name_0'), F('id'), null_id, null_id),
+		(AdminLevelOne, 'name_1', 1, 
+			Concat(F('admin_zero__name_0'), sep, F('name_1'), Value(' ')), 
+			F('admin_zero_id'), F('id'), null_id),
+		(AdminLevelTwo, 'name_2', 2, 
+			Concat(F('admin_one__admin_zero__name_0'), sep, F('admin_one__name_1'), sep, F('name_2')),
+			F('admin_one__admin_zero_id'), F('admin_one_id'), F('id')),
+	]
+	querysets = []
+	for model, column, level, name, admin0, admin1, admin2 in levels:
+		qs = model.objects.order_by()
+		if query:
+			qs = qs.filter(**{column + '__icontains': query})
+			rank = TrigramSimilarity(column, query)
+		else:
+			rank = Value(0.0, output_field=FloatField())
+		qs = qs.annotate(
+				search_name=Cast(name, output_field=CharField()), 
+				search_level=Value(level, output_field=IntegerField()),
+				search_admin0=admin0, 
+				search_admin1=admin1, 
+				search_admin2=admin2,
+				search_rank=Cast(rank, output_field=FloatField())
+			).values_list('id', 'search_name', 'search_level', 'search_admin0', 
+						'search_admin1', 'search_admin2', 'search_rank')
+		querysets.append(qs)
+	return querysets
+
+def search_vectors(query=None, limit=None, offset=0):
+	"""Search continents, regions and admin levels zero, one and two for names containing a term.
+
+	All the levels are searched with a single UNION query. The results are ordered by
+	level and by their similarity to the term, and paginated by the database.
+	Results are cached per normalized term for `settings.VECTOR_SEARCH_CACHE_TIMEOUT` seconds.
 
 	Args:
-		query (_type_, optional): String to search. Defaults to None.
+		query (string, optional): String to search. Defaults to None.
+		limit (int, optional): Maximum number of results. Defaults to `settings.VECTOR_SEARCH_MAX_RESULTS`
+		offset (int, optional): Number of results to skip
 
 	Returns:
-		List of AdminSearchResult objects
-	"""
-	continental_results = ContinentalAdminLevel.objects.search(query=query)
-	regional_results = RegionalAdminLevel.objects.search(query=query)
-	level_zero_results = AdminLevelZero.objects.search(query=query)
-	level_one_results = AdminLevelOne.objects.search(query=query)
-	level_two_results = AdminLevelTwo.objects.search(query=query)
-	qs_chain = chain(
-		continental_results,
-		regional_results,
-		level_one_results,
-		level_two_results,
-		level_zero_results
-	)
-	# qs = sorted(qs_chain,
-	# 		key=lambda instance: instance.search_display_text,
-	# 		reverse=True)
-	qs = qs_chain
-	result = []
-	for itm in qs:
-		level = -1
-		admin0 = None
-		admin1 = None
-		admin2 = None
-		if isinstance(itm, ContinentalAdminLevel):
-			level = -2
-		if isinstance(itm, RegionalAdminLevel):
-			level = -1
-		if isinstance(itm, AdminLevelZero):
-			level = 0
-			admin0 = itm.id
-		if isinstance(itm, AdminLevelOne):
-			level = 1
-			admin0 = itm.admin_zero.id
-			admin1 = itm.id
-		if isinstance(itm, AdminLevelTwo):
-			level = 2
-			admin0 = itm.admin_one.admin_zero.id
-			admin1 = itm.admin_one.id
-			admin2 = itm.id
-		#result.append(AdminSearchResult(id=itm.id, name=itm.search_display_text, level=level))
-		result.append({'id':itm.id, 'name': itm.search_display_text, 'level': level, "admin0": admin0, "admin1": admin1, "admin2": admin2})
-	result = sorted(result, key=operator.itemgetter("level", "name"))
-	# result = sorted(result, key=operator.attrgetter("level", "name"))
+		List of dicts with the keys id, name, level, admin0, admin1 and admin2
+	"""
+	query = normalize_search_query(query)
+	limit = min(cint(limit) or settings.VECTOR_SEARCH_MAX_RESULTS, settings.VECTOR_SEARCH_MAX_RESULTS)
+	offset = max(cint(offset), 0)
+
+	cache_key = "vector_search:" + hashlib.sha256(json.dumps([query, limit, offset]).encode("utf-8")).hexdigest()
+	if settings.VECTOR_SEARCH_CACHE_TIMEOUT > 0:
+		cached = result_cache.get(cache_key)
+		if cached != None:
+			return cached
+
+	querysets = get_search_querysets(query)
+	qs = querysets[0].union(*querysets[1:], all=True).order_by('search_level', '-search_rank', 'search_name')
+	result = [{'id': id, 'name': name, 'level': level, "admin0": admin0, "admin1": admin1, "admin2": admin2}
+				for id, name, level, admin0, admin1, admin2, rank in qs[offset:offset + limit]]
+
+	if settings.VECTOR_SEARCH_CACHE_TIMEOUT > 0:
+		result_cache.set(cache_key, result, settings.VECTOR_SEARCH_CACHE_TIMEOUT)
 	return result
 
 def test_contain():
@@ -32,6 +32,11 @@ from common_gis.serializers import (
 from common_gis.parsers import ShapeFileParser
 from common.utils.file_util import save_file_to_system_storage
 from common_gis.utils.vector_util import verify_shapefile, load_shapefile_dynamic, delete_shapefile, read_shapefile
+from common_gis.utils.response_cache_util import CachedTableResponseMixin
+from common_gis.utils.tile_util import get_tile_response
+from common import AnalysisParamError
+from django.http import HttpResponseBadRequest
+from django.views.decorators.http import require_GET
 from django.shortcuts import get_object_or_404 
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser, FileUploadParser
 from rest_framework.decorators import api_view, action 
@@ -40,7 +45,7 @@ User = get_user_model()
 
 # Create your views here.
 
-class RegionalAdminLevelViewSet(viewsets.ReadOnlyModelViewSet):
+class RegionalAdminLevelViewSet(CachedTableResponseMixin, viewsets.ReadOnlyModelViewSet):
 	"""
 	Exposes API endpoints that allows RegionalAdminLevel to be viewed or edited
 	In ListView mode, we exclude geo data, but when retrieving,
@@ -50,13 +55,18 @@ class RegionalAdminLevelViewSet(viewsets.ReadOnlyModelViewSet):
 	serializer_class = RegionalAdminLevelListSerializer
 	detail_serializer_class = RegionalAdminLevelDetailSerializer
 
-	def retrieve(self, request, *args, **kwargs):
+	def get_detail_data(self, request, *args, **kwargs):
 		instance = self.get_object()
 		serializer = self.detail_serializer_class(instance, context=self.get_serializer_context())
-		return Response(serializer.data)
+		return serializer.data
+
+	def get_list_data(self, request, *args, **kwargs):
+		queryset = RegionalAdminLevel.objects.defer('geom')
+		serializer = self.serializer_class(queryset, many=True)
+		return serializer.data
 
 
-class ContinentalAdminLevelViewSet(viewsets.ReadOnlyModelViewSet):
+class ContinentalAdminLevelViewSet(CachedTableResponseMixin, viewsets.ReadOnlyModelViewSet):
 	"""
 	Exposes API endpoints that allows ContinentalAdminLevel to be viewed or edited
 	In ListView mode, we exclude geo data, but when retrieving,
@@ -66,12 +76,17 @@ class ContinentalAdminLevelViewSet(viewsets.ReadOnlyModelViewSet):
 	serializer_class = ContinentalAdminLevelListSerializer
 	detail_serializer_class = ContinentalAdminLevelDetailSerializer
 
-	def retrieve(self, request, *args, **kwargs):
+	def get_detail_data(self, request, *args, **kwargs):
 		instance = self.get_object()
 		serializer = self.detail_serializer_class(instance, context=self.get_serializer_context())
-		return Response(serializer.data)		
+		return serializer.data
+
+	def get_list_data(self, request, *args, **kwargs):
+		queryset = ContinentalAdminLevel.objects.defer('geom')
+		serializer = self.serializer_class(queryset, many=True)
+		return serializer.data
 
-class AdminLevelZeroViewSet(viewsets.ReadOnlyModelViewSet):
+class AdminLevelZeroViewSet(CachedTableResponseMixin, viewsets.ReadOnlyModelViewSet):
 	"""
 	Exposes API endpoints that allows AdminLevelZero to be viewed or edited
 	In ListView mode, we exclude geo data, but when retrieving,
@@ -81,12 +96,12 @@ class AdminLevelZeroViewSet(viewsets.ReadOnlyModelViewSet):
 	serializer_class = AdminLevelZeroListSerializer
 	detail_serializer_class = AdminLevelZeroDetailSerializer
 
-	def retrieve(self, request, *args, **kwargs):
+	def get_detail_data(self, request, *args, **kwargs):
 		instance = self.get_object()
 		serializer = self.detail_serializer_class(instance, context=self.get_serializer_context())
-		return Response(serializer.data)
+		return serializer.data
 
-	def list(self, request, *args, **kwargs):
+	def get_list_data(self, request, *args, **kwargs):
 		"""We can either request all admin_level_ones or
 		only show the filtered ones
 		"""
@@ -100,8 +115,8 @@ class AdminLevelZeroViewSet(viewsets.ReadOnlyModelViewSet):
 		else:
 			queryset = AdminLevelZero.objects.all()
 		
-		serializer = self.serializer_class(queryset, many=True)
-		return Response(serializer.data)
+		serializer = self.serializer_class(queryset.defer('geom'), many=True)
+		return serializer.data
 
 class AdminLevelOneViewSet(viewsets.ReadOnlyModelViewSet):
 	"""
@@ -131,7 +146,7 @@ class AdminLevelOneViewSet(viewsets.ReadOnlyModelViewSet):
 			queryset = queryset.filter(admin_zero_id=parent_id)
 		return queryset
 
-class AdminLevelOneViewSet(viewsets.ReadOnlyModelViewSet):
+class AdminLevelOneViewSet(CachedTableResponseMixin, viewsets.ReadOnlyModelViewSet):
 	"""
 	API Endpoint that allows AdminLevelOne to be viewed or edited
 	In ListView mode, we exclude geo data, but when retrieving,
@@ -141,26 +156,26 @@ class AdminLevelOneViewSet(viewsets.ReadOnlyModelViewSet):
 	serializer_class = AdminLevelOneListSerializer
 	detail_serializer_class = AdminLevelOneDetailSerializer
 
-	def retrieve(self, request, *args, **kwargs):
+	def get_detail_data(self, request, *args, **kwargs):
 		"""
 		Retrieve an instance of AdminLevelOne	
 		"""	
 		instance = self.get_object()
 		serializer = self.detail_serializer_class(instance, context=self.get_serializer_context())
-		return Response(serializer.data)
+		return serializer.data
 
-	def list(self, request, *args, **kwargs):
+	def get_list_data(self, request, *args, **kwargs):
 		"""We can either request all admin_level_ones or
 		we can request admin_level_one items given an admin_level_zero id
 		"""
-		queryset = AdminLevelOne.objects.all()
+		queryset = AdminLevelOne.objects.defer('geom')
 		parent_id = self.request.query_params.get('pid', None)
 		if parent_id is not None:
 			queryset = queryset.filter(admin_zero_id=parent_id)
 		serializer = self.serializer_class(queryset, many=True)
-		return Response(serializer.data)
+		return serializer.data
 
-class AdminLevelTwoViewSet(viewsets.ReadOnlyModelViewSet):
+class AdminLevelTwoViewSet(CachedTableResponseMixin, viewsets.ReadOnlyModelViewSet):
 	"""
 	Exposes API endpoints that allows AdminLevelOne to be viewed or edited
 	In ListView mode, we exclude geo data, but when retrieving,
@@ -170,14 +185,14 @@ class AdminLevelTwoViewSet(viewsets.ReadOnlyModelViewSet):
 	serializer_class = AdminLevelTwoListSerializer
 	detail_serializer_class = AdminLevelTwoDetailSerializer
 
-	def retrieve(self, request, *args, **kwargs):
+	def get_detail_data(self, request, *args, **kwargs):
 		"""Retrieve an instance of AdminLevelTwo
 		"""
 		instance = self.get_object()
 		serializer = self.detail_serializer_class(instance, context=self.get_serializer_context())
-		return Response(serializer.data)
+		return serializer.data
 
-	def list(self, request, *args, **kwargs):
+	def get_list_data(self, request, *args, **kwargs):
 		"""We can either request all admin_level_ones or
 		we can request admin_level_two items given an admin_level_one id
 		Args:
@@ -186,12 +201,12 @@ class AdminLevelTwoViewSet(viewsets.ReadOnlyModelViewSet):
 		Returns:
 			[type]: [description]
 		"""
-		queryset = AdminLevelTwo.objects.all()
+		queryset = AdminLevelTwo.objects.defer('geom')
 		parent_id = self.request.query_params.get('pid', None)
 		if parent_id is not None:
 			queryset = queryset.filter(admin_one_id=parent_id)
 		serializer = self.serializer_class(queryset, many=True)
-		return Response(serializer.data)
+		return serializer.data
 
 class ShapeFileViewSet(viewsets.ModelViewSet):
 	"""
@@ -524,4 +539,15 @@ class ScheduledPreComputationViewSet(viewsets.ReadOnlyModelViewSet):
 		# if request.user.is_anonymous:
 		# 	queryset = queryset.exclude(protected=True)
 		serializer = self.serializer_class(queryset, many=True)
-		return Response(serializer.data)
\ No newline at end of file
+		return Response(serializer.data)
+
+@require_GET
+def vector_tile(request, level, z, x, y):
+	"""
+	Mapbox Vector Tile of the boundaries of an admin level.
+	Not a DRF view since the tile is binary and must not go through content negotiation
+	"""
+	try:
+		return get_tile_response(request, level, z, x, y)
+	except AnalysisParamError as e:
+		return HttpResponseBadRequest(str(e))
@@ -28,7 +28,7 @@ from django_rq import job
 from rq import get_current_job
 
 # from ldms.tasks import add_numbers
-from common.queue import RedisQueue
+from common.queue import RedisQueue, in_flight_jobs
 from common.utils.common_util import get_random_int, get_random_string
 from common_gis.utils.common_util import can_queue
 from rq_scheduler import Scheduler
@@ -41,7 +41,9 @@ from communication.utils import email_helper
 from common.utils.settings_util import get_common_settings
 from common_gis.utils.settings_util import get_gis_settings
 from common_gis.utils.vector_util import get_vector, queue_threshold_exceeded, get_admin_level_ids_from_db, search_vectors
-from common.utils.cache_util import set_cache_key, get_cached_results, generate_cache_key, get_cache_key
+from common.utils.cache_util import (set_cache_key, get_cached_results, generate_cache_key, get_cache_key,
+									result_cache)
+from common.utils.json_util import dumps, to_json_bytes, json_default, JSONBytesResponse
 from common.utils.file_util import (get_download_url)
 from common.utils.url_map_util import get_mapped_url
 from common_gis.models import ComputedResult
@@ -51,6 +53,7 @@ from common.utils import monitoring_util
 from common.utils.common_util import cint
 from memory_profiler import profile
 import copy
+import uuid
 
 import logging
 
@@ -226,6 +229,9 @@ def _enqueue(func, request, computation_type, force_queue=False, **kwargs):
 		admin_level = params.get('admin_level', None)
 		vector_id = params.get('vector', None)
 		custom_coords = params.get('custom_coords', None)
+		if not custom_coords and admin_level != None and vector_id != None:
+			# the area of admin units is computed by the database without fetching the vector
+			return queue_threshold_exceeded(request, None, admin_level=admin_level, vector_id=vector_id)
 		
 		vector, err = get_vector(admin_level=admin_level, 
 						  shapefile_id=vector_id, 
@@ -252,18 +258,16 @@ def _enqueue(func, request, computation_type, force_queue=False, **kwargs):
 		request.data['admin2'] = level_2
 
 	def _get_cached_results(rqst):
+		"""Get the JSON bytes of the cached or precomputed results"""
 		cache_key = generate_cache_key(rqst.data, rqst.path)
-		cache = get_cache_key(cache_key) # get_cached_results(request)
+		cache = get_cache_key(cache_key, raw=True) # get_cached_results(request)
 		if not cache:
 			from common_gis.utils.precompute_util import get_precomputed_result
 			obj = get_precomputed_result(cache_key, rqst, computation_type=computation_type, payload=rqst.data)
-			#json.dumps(eval(str(results.data)))
 			if isinstance(obj, ComputedResult):
-				cache = json.loads(obj.results)
-			elif isinstance(obj, str):
-				cache = json.loads(str)
-			elif isinstance(obj, dict):
-				cache = obj
+				cache = to_json_bytes(obj.results)
+			elif isinstance(obj, (str, dict)):
+				cache = to_json_bytes(obj)
 		return cache
 	
 	if not isinstance(computation_type, ComputationEnum):
@@ -283,8 +287,7 @@ def _enqueue(func, request, computation_type, force_queue=False, **kwargs):
 			cached = _get_cached_results(request)
 
 		if cached: # return cached results
-			val = json.loads(cached) if not isinstance(cached, dict) else cached
-			return Response(val)
+			return JSONBytesResponse(cached)
 
 	# do_queue = can_queue(request)
 	exceeded, do_queue, msg = validate_vector_threshold()
@@ -316,48 +319,93 @@ def _enqueue(func, request, computation_type, force_queue=False, **kwargs):
 
 		orig_data = copy.copy(request.data)
 		append_admin_level_args()
-		q = RedisQueue()
-		if is_precomputation:
-			q.enqueue_extra_high(func=func, 
-						request=None, 
-						data=request.data, 
-						user=user, 
-						orig_request=clone_request(), # if not is_precomputation else request, 
-						orig_data=orig_data,
-						can_queue=do_queue)
-		else: # the other jobs can be set to different queues depending on the vector size
-			if orig_data.get('admin_level') == -1:
-				q.enqueue_extra_high(func=func, 
-							request=None, 
-							data=request.data, 
-							user=user, 
-							orig_request=clone_request(), # if not is_precomputation else request, 
-							orig_data=orig_data,
-							can_queue=do_queue)
-			elif orig_data.get('admin_level') == 0:
-				q.enqueue_high(func=func, 
-							request=None, 
-							data=request.data, 
-							user=user, 
-							orig_request=clone_request(), # if not is_precomputation else request, 
-							orig_data=orig_data,
-							can_queue=do_queue)
-			elif orig_data.get('admin_level') == 2:
-				q.enqueue_low(func=func, 
-							request=None, 
-							data=request.data, 
-							user=user, 
-							orig_request=clone_request(), # if not is_precomputation else request, 
-							orig_data=orig_data,
-							can_queue=do_queue)
+		job_id = str(uuid.uuid4())
+		job_meta = {}
+		if not is_precomputation:
+			"""If an identical request is already queued or running, subscribe to its 
+			job instead of computing the same results again"""
+			cache_key = generate_cache_key(orig_data, request.path)
+			job_meta['cache_key'] = cache_key
+			for attempt in range(settings.IN_FLIGHT_JOB_REGISTER_ATTEMPTS):
+				running_job_id = in_flight_jobs.register(cache_key, job_id)
+				if running_job_id == job_id:
+					break
+				if not in_flight_jobs.is_alive(running_job_id, cache_key):
+					# the job died without completing its tasks e.g its work horse was killed
+					fail_job_tasks(request, running_job_id, cache_key, func.__name__, _("The task did not complete"))
+					continue
+				if subscribe_to_job(running_job_id, cache_key, request, func, user, orig_data, clone_request()):
+					return Response({ "success": 'true', 'message': get_enqueue_message(request) })
+				# the job completed in the meantime
+				cached = get_cache_key(cache_key, raw=True)
+				if cached:
+					return JSONBytesResponse(cached)
+				# e.g it failed, so try to compute the results again
 			else:
-				q.enqueue_medium(func=func, 
+				return Response({ "success": 'false', 'message': _("An identical request is being processed. Please try again later.") })
+		try:
+			q = RedisQueue()
+			if is_precomputation:
+				q.enqueue_extra_high(func=run_queued_analysis, 
+							analysis=func, 
 							request=None, 
 							data=request.data, 
 							user=user, 
 							orig_request=clone_request(), # if not is_precomputation else request, 
 							orig_data=orig_data,
-							can_queue=do_queue)
+							can_queue=do_queue,
+							job_id=job_id,
+							meta=job_meta)
+			else: # the other jobs can be set to different queues depending on the vector size
+				if orig_data.get('admin_level') == -1:
+					q.enqueue_extra_high(func=run_queued_analysis, 
+								analysis=func, 
+								request=None, 
+								data=request.data, 
+								user=user, 
+								orig_request=clone_request(), # if not is_precomputation else request, 
+								orig_data=orig_data,
+								can_queue=do_queue,
+								job_id=job_id,
+								meta=job_meta)
+				elif orig_data.get('admin_level') == 0:
+					q.enqueue_high(func=run_queued_analysis, 
+								analysis=func, 
+								request=None, 
+								data=request.data, 
+								user=user, 
+								orig_request=clone_request(), # if not is_precomputation else request, 
+								orig_data=orig_data,
+								can_queue=do_queue,
+								job_id=job_id,
+								meta=job_meta)
+				elif orig_data.get('admin_level') == 2:
+					q.enqueue_low(func=run_queued_analysis, 
+								analysis=func, 
+								request=None, 
+								data=request.data, 
+								user=user, 
+								orig_request=clone_request(), # if not is_precomputation else request, 
+								orig_data=orig_data,
+								can_queue=do_queue,
+								job_id=job_id,
+								meta=job_meta)
+				else:
+					q.enqueue_medium(func=run_queued_analysis, 
+								analysis=func, 
+								request=None, 
+								data=request.data, 
+								user=user, 
+								orig_request=clone_request(), # if not is_precomputation else request, 
+								orig_data=orig_data,
+								can_queue=do_queue,
+								job_id=job_id,
+								meta=job_meta)
+		except Exception:
+			# let identical requests enqueue the computation
+			if job_meta.get('cache_key'):
+				in_flight_jobs.release(job_meta['cache_key'], job_id)
+			raise
 		return Response({ "success": 'true', 'message': get_enqueue_message(request) })
 	else:
 		monitor = monitoring_util.start_monitoring(execution_name=str(func), 
@@ -365,18 +413,159 @@ def _enqueue(func, request, computation_type, force_queue=False, **kwargs):
 											 caller_id='Instant Computation',
 											 caller_type='Instant Computation', 
 											 caller_details=str(func))
-		results = func(request)		
 		# we are not caching forest_fire since GEE urls expire after some time
-		if system_settings.enable_cache and func != forest_fire:		
-			# Only save to cache if there is no error and if caching enabled
-			if 'error' not in results.data:				
-				set_cache_key(key=generate_cache_key(request.data, request.path), 
-						value=json.dumps(eval(str(results.data))),
-						timeout=system_settings.cache_limit)
+		if system_settings.enable_cache and func != forest_fire:
+			cache_key = generate_cache_key(request.data, request.path)
+			# compute identical concurrent requests once. The others wait and get the cached results
+			with result_cache.single_flight(cache_key):
+				cached = get_cache_key(cache_key, raw=True)
+				if cached:
+					results = JSONBytesResponse(cached)
+				else:
+					results = func(request)
+					# Only save to cache if there is no error and if caching enabled
+					if 'error' not in results.data:
+						# serialize once for both the cache and the response
+						data = dumps(results.data)
+						set_cache_key(key=cache_key, 
+								value=data,
+								timeout=system_settings.cache_limit)
+						results = JSONBytesResponse(data)
+		else:
+			results = func(request)
 		if monitor:
 			monitoring_util.stop_monitoring(monitoring_log_id=monitor.id)
 		return results
 
+def subscribe_to_job(job_id, cache_key, request, func, user, orig_data, orig_request):
+	"""Create a task for an identical request that will be completed by a queued job.
+	See `notify_subscribers`
+
+	Args:
+		job_id (string): Id of the queued or running job
+		cache_key (string): Cache key of the computation
+		request: Request object
+		func: Function being queued
+		user (dict): Fields of the user who made the request
+		orig_data (dict): Original payload as passed by the user
+		orig_request (dict): Cloned request
+
+	Returns:
+		The ScheduledTask or None if the job completed before the task was created
+	"""
+	task = ScheduledTask.objects.create(
+		owner=user['email'] if user else "",
+		job_id=job_id,
+		name=func.__name__,
+		method=request.path,
+		args=json.dumps(request.data, default=json_default),
+		orig_args=json.dumps(orig_data, default=json_default),
+		status=_("Processing"),
+		request=orig_request,
+	)
+	if in_flight_jobs.get(cache_key) != job_id:
+		"""The job completed before the task was created. Give up the task, unless 
+		`notify_subscribers` has completed it in the meantime"""
+		deleted, _deleted = ScheduledTask.objects.filter(id=task.id, completed_on__isnull=True).delete()
+		if deleted:
+			return None
+	return task
+
+def notify_subscribers(request, task, cache_key):
+	"""Complete the tasks of identical requests that subscribed to the job of `task` 
+	and notify their owners
+
+	Args:
+		request: Request object
+		task: ScheduledTask of the job
+		cache_key (string): Cache key of the computation
+	"""
+	# unregister first so that no other request subscribes after the tasks are fetched
+	in_flight_jobs.release(cache_key, task.job_id)
+	subscribers = ScheduledTask.objects.filter(job_id=task.job_id, completed_on__isnull=True)
+	if task.id:
+		subscribers = subscribers.exclude(id=task.id)
+	for subscriber_id in list(subscribers.values_list('id', flat=True)):
+		"""Only complete a task that is still pending, so that a task deleted by a
+		request that gave up on the job (see `subscribe_to_job`) is not saved again"""
+		completed = ScheduledTask.objects.filter(id=subscriber_id, completed_on__isnull=True).update(
+			name=task.name,
+			result=task.result,
+			error=task.error,
+			succeeded=task.succeeded,
+			status=task.status,
+			completed_on=task.completed_on or timezone.now(),
+			change_enum=task.change_enum,
+		)
+		subscriber = ScheduledTask.objects.filter(id=subscriber_id).first() if completed else None
+		if subscriber:
+			notify_user(request, subscriber, subscriber.owner)
+
+def fail_job_tasks(request, job_id, cache_key, name, error):
+	"""Fail the pending tasks of a job that did not complete them and notify their owners
+
+	Args:
+		request: Request object
+		job_id (string): Id of the job
+		cache_key (string): Cache key of the computation
+		name (string): Name of the tasks
+		error (string): Error description
+	"""
+	task = ScheduledTask(job_id=job_id, name=name, result="", error=error, succeeded=False, 
+					status=_("Failed"), completed_on=timezone.now())
+	notify_subscribers(request, task, cache_key)
+
+def run_queued_analysis(analysis, **kwargs):
+	"""Run a queued analysis. 
+	
+	If the analysis raises, times out or returns before completing its task e.g on 
+	invalid parameters, its task and the tasks of identical requests subscribed 
+	to the job are failed and their owners notified. See `complete_failed_job`
+
+	Args:
+		analysis (function): Analysis function e.g `lulc`
+		kwargs: Arguments of the analysis function
+	"""
+	res, error = None, None
+	try:
+		res = analysis(**kwargs)
+	except Exception as e:
+		error = str(e) or e.__class__.__name__
+		raise
+	finally:
+		try:
+			complete_failed_job(get_current_job(), analysis, res, error, kwargs)
+		except Exception:
+			logging.getLogger(__name__).exception("Could not fail the tasks of job %s", analysis.__name__)
+	return res
+
+def complete_failed_job(job, analysis, res, error, kwargs):
+	"""Fail the tasks of a job whose analysis did not complete its task
+
+	Args:
+		job: RQ Job
+		analysis (function): Analysis function
+		res: Response returned by the analysis if any
+		error (string): Error raised by the analysis if any
+		kwargs (dict): Arguments of the analysis function
+	"""
+	if not job:
+		return
+	task_id = job.meta.get('task_id')
+	task = ScheduledTask.objects.filter(id=task_id).first() if task_id else None
+	if task and task.completed_on: # completed by post_analysis_save_task
+		return
+	if not error:
+		data = getattr(res, 'data', None)
+		error = data.get('error') if isinstance(data, dict) else None
+		error = error or _("The task did not complete")
+
+	request = clone_post_request(kwargs.get('data'), kwargs.get('user'), kwargs.get('orig_request'))
+	if task:
+		post_analysis_save_task(request, task, None, error, kwargs.get('data'), func=analysis)
+	elif job.meta.get('cache_key'):
+		fail_job_tasks(request, job.get_id(), job.meta['cache_key'], analysis.__name__, error)
+
 def get_user_fields():
 	return ["email", "first_name", "last_name", "id", "username"]
 
@@ -1105,6 +1294,8 @@ def dispatch_medalus(request, medalus_calc_enum, data=None, user=None, orig_requ
 	reference_soc = params.get('reference_raster', None)
 	raster_source = params.get('raster_source', RasterSourceEnum.MODIS.value)
 	admin_0 = params.get('admin_0', None)
+	# return the CQI, SQI, VQI and MQI rasters computed for the ESAI in the extras
+	save_intermediate_rasters = params.get('save_intermediate_rasters', False) in [True, 1, "1", "true"]
 	
 	raster_source = map_raster_source(raster_source)
 	if raster_source == None:
@@ -1127,6 +1318,7 @@ def dispatch_medalus(request, medalus_calc_enum, data=None, user=None, orig_requ
 		# reference_soc=reference_soc,
 		raster_source=raster_source,
 		reference_eco_units=reference_eco_units,
+		save_intermediate_rasters=save_intermediate_rasters,
 		# veg_index=veg_index
 	)
 
@@ -1523,6 +1715,10 @@ def pre_analysis_save_task(request, data, user, task_name, orig_data):
 		request=request,
 		scheduled_precomputation_id=data['scheduled_precomputation_id'] if 'scheduled_precomputation_id' in data else None #associated sch
 	)
+	if job:
+		# used to fail the task if the job does not complete it. See `run_queued_analysis`
+		job.meta['task_id'] = task.id
+		job.save_meta()
 	monitor = monitoring_util.start_monitoring(execution_name=request['path'], 
 											 params=json.dumps(orig_data) if orig_data else "{}", 
 											 caller_id=task.id, 
@@ -1534,9 +1730,8 @@ def parse_result(res):
 	"""
 	Pass JSON results received after computation and returns a string representation of the data
 	"""
-
 	if isinstance(res, dict):
-		return json.dumps(eval(str(res)))
+		return dumps(res).decode("utf-8")
 	return res
 
 def post_analysis_save_task(request, task, res, error, data, func):
@@ -1556,8 +1751,9 @@ def post_analysis_save_task(request, task, res, error, data, func):
 			"""To generate key, use data and not request.data since data contains 
 			the original user payload while request.data may have been interfered with 
 			when adminlevel one and two ids are appended"""
+			# reuse the serialized results
 			set_cache_key(key=cache_key, 
-					value=parse_result(res),
+					value=to_json_bytes(task.result),
 					timeout=get_gis_settings().cache_limit)
 
 	"""To generate key, use data and not request.data since data contains 
@@ -1587,6 +1783,7 @@ def post_analysis_save_task(request, task, res, error, data, func):
 		cache_results()
 		# cache_results(task.orig_args, res, error)
 	notify_user(request, task, task.owner)
+	notify_subscribers(request, task, cache_key)
 
 	# finish monitoring
 	doc = MonitoringLog.objects.filter(id=cint(task.id)).first()
@@ -1693,8 +1890,10 @@ def forest_fire_qml(request, **kwargs):
 def search_vector(request, **kwargs):
 	params = request.query_params
 	query = params.get('query', None)
-	result = search_vectors(query=query)
-	return Response({ "success": 'true', 'data': result })
+	limit = cint(params.get('limit', None)) or None
+	offset = cint(params.get('offset', 0))
+	result = search_vectors(query=query, limit=limit, offset=offset)
+	return Response({ "success": 'true', 'data': result, 'offset': offset })
 
 # @api_view(['POST'])
 def test_queue():
@@ -1,6 +1,5 @@
 import numpy as np
 import numpy.ma as ma
-import pandas as pd
 import tempfile
 from django.utils.translation import gettext as _
 from rest_framework.response import Response
@@ -8,7 +7,8 @@ from rest_framework.response import Response
 from common_gis.utils.vector_util import get_vector
 from common_gis.utils.raster_util import (get_raster_models, clip_raster_to_vector,
 					clip_rasters, mask_rasters,
-					get_raster_meta, return_raster_with_stats, reshape_rasters)
+					get_raster_meta, return_raster_with_stats, reshape_rasters, reclassify_raster)
+from common_gis.utils.factor_util import compute_factor_product
 from ldms.enums import (RasterSourceEnum, RasterOperationEnum, RasterCategoryEnum, 
 						CVIEnum, CVIFactorsEnum, CVIComputationTypeEnum)
 from common.utils.common_util import return_with_error
@@ -21,6 +21,11 @@ from django.conf import settings
 MIN_INT = settings.MIN_INT #-9223372036854775807
 MAX_INT = settings.MAX_INT # 9223372036854775807 
 
+def square_root_of_mean(product, factors=6):
+	"""Compute sqrt(product / factors) of a block in place"""
+	np.divide(product, factors, out=product)
+	np.sqrt(product, out=product)
+
 class CVISettings:
 	SUB_DIR = "" # "cvi" # Subdirectory to store rasters for CVI
 	LOW_BOUND = 0
@@ -125,9 +130,12 @@ class CoastalVulnerabilityIndex:
 		
 		# get the rasters and leave out the file
 		clipped_raster_paths = [x[1] for x in clipped_rasters]
-		clipped_rasters = [x[0] for x in clipped_rasters]
-		# mask arrays to ensure nodata pixels are not considered
-		clipped_rasters = mask_rasters(clipped_rasters, nodata)
+		raw_rasters = [x[0] for x in clipped_rasters]
+		# mask arrays to ensure nodata pixels are not considered. The CVI
+		# product masks the factors itself
+		clipped_rasters = raw_rasters
+		if self.computation_type != CVIComputationTypeEnum.CVI:
+			clipped_rasters = mask_rasters(raw_rasters, nodata)
 		# geo_raster = clipped_rasters[0][0] 
 		# coastal_slope_raster = clipped_rasters[1][0] 
 		# sealevel_change_raster = clipped_rasters[2][0]
@@ -164,26 +172,13 @@ class CoastalVulnerabilityIndex:
 		if self.computation_type == CVIComputationTypeEnum.CVI:
 			change_enum = CVIEnum
 			# Multiply factors.
-			rasters = reshape_rasters([geo_raster, coastal_slope_raster, sealevel_change_raster, shoreline_erosion_raster, mean_tide_raster, mean_wave_raster])
-			cvi = np.sqrt((rasters[0] * rasters[1] * rasters[2] * rasters[3] * rasters[4] * rasters[5])/6)
+			cvi = compute_factor_product(raw_rasters, nodata, func=square_root_of_mean)
 
 		cvi = ma.array(cvi)		
 		
 		# Step 3
 		matrix = self.initialize_matrix()
-		df = pd.DataFrame({
-						'ratio': cvi.filled(fill_value=nodata).flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-		
-		out_raster = df['mapping'].values.reshape(cvi.shape)
-		out_raster = out_raster.astype(np.int32)
+		out_raster = reclassify_raster(cvi, matrix, nodata)
 		resolution = geo_model.resolution if self.computation_type == CVIComputationTypeEnum.CVI else ref_model.resolution
 		return return_raster_with_stats(
 			request=self.request,
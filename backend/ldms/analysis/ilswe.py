@@ -1,13 +1,14 @@
 import numpy as np
 import numpy.ma as ma
-import pandas as pd
 import tempfile
 from django.utils.translation import gettext as _
 from rest_framework.response import Response
 
 from common_gis.utils.vector_util import get_vector
 from common_gis.utils.raster_util import (get_raster_models, clip_raster_to_vector, clip_rasters,
-					get_raster_meta, return_raster_with_stats, reshape_rasters, mask_rasters)
+					get_raster_meta, return_raster_with_stats, reshape_rasters, mask_rasters, reclassify_raster)
+from common_gis.utils.factor_util import (compute_factor_product, FuzzyMembership, 
+					FUZZY_LINEAR, FUZZY_EXPONENTIAL, FUZZY_SIGMOID)
 from ldms.enums import (RasterSourceEnum, RasterOperationEnum, RasterCategoryEnum, 
 						ILSWEEnum, ILSWEFactorsEnum, ILSWEComputationTypeEnum)
 from common.utils.common_util import return_with_error, get_random_floats, cint
@@ -131,61 +132,29 @@ class ILSWE:
 
 		clipped_raster_paths = [x[1] for x in clipped_rasters]
 		clipped_rasters = [x[0] for x in clipped_rasters]
-		# mask arrays to ensure nodata pixels are not considered
-		#clipped_rasters = mask_rasters([x[0] for x in clipped_rasters], nodata)
-		clipped_rasters = mask_rasters(clipped_rasters, nodata)
-		vc_raster = clipped_rasters[0]
-		sr_raster = clipped_rasters[1] 
-		sc_raster = clipped_rasters[2]
-		ef_raster = clipped_rasters[3]
-		ce_raster = clipped_rasters[4]
-
-		# Step 1
-		vc_fuzz = self.fuzzify_vegetation_cover(vc_raster, nodata) if vc_raster.shape else None
-		sr_fuzz = self.fuzzify_soil_roughness(sr_raster, nodata) if sr_raster.shape else None
-		sc_fuzz = self.fuzzify_soil_crust(sc_raster, nodata) if sc_raster.shape else None
-		ef_fuzz = self.fuzzify_erodible_fraction(ef_raster, nodata) if ef_raster.shape else None
-		ce_fuzz = self.fuzzify_climatic_erosivity(ce_raster, nodata) if ce_raster.shape else None
 
+		# Step 1 and 2. Fuzzify the factors and multiply them in a single pass
+		memberships = self.get_fuzzy_memberships()
+		factor_types = [
+			(ILSWEComputationTypeEnum.VEGETATION_COVER, "vc_"),
+			(ILSWEComputationTypeEnum.SOIL_ROUGHNESS, "sr_"),
+			(ILSWEComputationTypeEnum.SOIL_CRUST, "sc_"),
+			(ILSWEComputationTypeEnum.ERODIBLE_FRACTION, "ef_"),
+			(ILSWEComputationTypeEnum.CLIMATE_EROSIVITY, "ce_"),
+		]
 		prefix = "ilswe"
 		change_enum = ILSWEFactorsEnum
-		# Step 2.			
-		if self.computation_type == ILSWEComputationTypeEnum.VEGETATION_COVER:
-			ilswe = vc_fuzz
-			prefix = "vc_"
-		if self.computation_type == ILSWEComputationTypeEnum.SOIL_CRUST:
-			ilswe = sc_fuzz
-			prefix = "sc_"
-		if self.computation_type == ILSWEComputationTypeEnum.SOIL_ROUGHNESS:
-			ilswe = sr_fuzz
-			prefix = "sr_"
-		if self.computation_type == ILSWEComputationTypeEnum.ERODIBLE_FRACTION:
-			ilswe = ef_fuzz
-			prefix = "ef_"
-		if self.computation_type == ILSWEComputationTypeEnum.CLIMATE_EROSIVITY:
-			ilswe = ce_fuzz
-			prefix = "ce_"
 		if self.computation_type == ILSWEComputationTypeEnum.ILSWE:
 			change_enum = ILSWEEnum
-			rasters = reshape_rasters([vc_fuzz, sr_fuzz, sc_fuzz, ef_fuzz, ce_fuzz])
-			# multiply rasters
-			ilswe = rasters[0] * rasters[1] * rasters[2] * rasters[3] * rasters[4]
+			ilswe = compute_factor_product(clipped_rasters, nodata, memberships)
+		for i, (computation_type, factor_prefix) in enumerate(factor_types):
+			if self.computation_type == computation_type:
+				ilswe = compute_factor_product([clipped_rasters[i]], nodata, [memberships[i]])
+				prefix = factor_prefix
 
 		# Step 3
 		matrix = self.initialize_matrix()
-		df = pd.DataFrame({
-						'ratio': ilswe.filled(fill_value=nodata).flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-		
-		out_raster = df['mapping'].values.reshape(ilswe.shape)
-		out_raster = out_raster.astype(np.int32)
+		out_raster = reclassify_raster(ilswe, matrix, nodata)
 		resolution = vc_model.resolution if self.computation_type == ILSWEComputationTypeEnum.ILSWE else ref_model.resolution
 		return return_raster_with_stats(
 			request=self.request,
@@ -200,68 +169,29 @@ class ILSWE:
 			subdir=ILSWESettings.SUB_DIR
 		)
 
-	def get_bounds(self, arry, nodata):
-		"""Return the min and max vals
+	def get_fuzzy_memberships(self):
+		"""Get the fuzzification of each of the VC, SR, SC, EF and CE factors
 
-		Args:
-			arry (ndarry): Array for whose to find max and min values
-
-		Returns:
-			tuple(min, max)
+		NOTE: Vegetation cover is monotonically decreasing hence the 
+			low_bound = Max and NOT min. Also set all values of the pixels in the raster (VC values < 0)
+			that are less than zero to Zero
 		"""
-		# exclude nodata
-		return np.amin(arry[arry != nodata]), np.amax(arry[arry != nodata])
-
-	def apply_func(self, func, arry, nodata, switch_bounds=False):
-		"""[summary]
-
-		Args:
-			func ([type]): [description]
-			arry ([type]): [description]
-			switch_bounds (bool, optional): [description]. Defaults to False.
-		""" 
-		ma_rast = ma.array(arry)		
-		ma_rast[np.isnan(ma_rast)] = ma.masked #mask nan values
-		# ma_rast[(ma_rast < ILSWESettings.LOW_BOUND) & (ma_rast != nodata)] = 0 # If values less than LOW_BOUND, set to 0
-		ma_rast[ma_rast==nodata] = ma.masked #mask nodata values
-		
-		min, max = self.get_bounds(ma_rast, nodata)	
-		if not switch_bounds:
-			low_bound = min
-			high_bound = max 
-		else:
-			low_bound = max
-			high_bound = min 
-
-		fuzz = func(ma_rast, low_bound, high_bound)
-		return fuzz
-
-	def linear_fuzzification(self, x, low_bound, high_bound):
-		return (x - low_bound) / (high_bound - low_bound)
-	
-	def exponential_fuzzification(self, x, low_bound, high_bound):
-		return np.power((x - low_bound) / (high_bound - low_bound), 2)
-	
-	def sigmoid_fuzzification(self, x, low_bound, high_bound):
-		# cs = np.cos(((x - high_bound) / (low_bound - high_bound)) * (np.pi / 2))
-		# cs = np.cos((1 - ((raster_array - low_bound) / (high_bound - low_bound))) * (np.pi / 2.0))
-		cs = np.cos((1 - ((x - low_bound) / (high_bound - low_bound))) * (np.pi / 2.0))
-		return np.power(cs, 2.0)
+		return [
+			FuzzyMembership(FUZZY_EXPONENTIAL, switch_bounds=True, min_value=0), # VC
+			FuzzyMembership(FUZZY_SIGMOID), # SR
+			FuzzyMembership(FUZZY_LINEAR), # SC
+			FuzzyMembership(FUZZY_LINEAR), # EF
+			FuzzyMembership(FUZZY_LINEAR), # CE
+		]
 
 	def fuzzify_vegetation_cover(self, arry, nodata):
 		"""VCfuzz is the Fuzzified VC, x is the pixel value of VC, low_bound = Max VC value and high_bound = min VC
-		NOTE: Vegetation cover is monotonically decreasing hence the 
-			low_bond = Max and NOT min. Also set all values of the pixels in the raster (VC values < 0)
-			 that are less than zero to Zero
 
 		Args:
 			arry (ndarray): Array to fuzzify
 			nodata (int): Nodata value
 		"""
-		# set all values of the pixels in the raster (VC values < 0) that are less than zero to Zero
-		arry = np.where(arry >= 0, arry, 0)
-		vc_fuzz = self.apply_func(self.exponential_fuzzification, arry, nodata, switch_bounds=True)		
-		return vc_fuzz
+		return compute_factor_product([arry], nodata, self.get_fuzzy_memberships()[0:1])
 
 	def fuzzify_soil_roughness(self, arry, nodata):
 		"""SR_fuzz is the Fuzzified SC, x is the pixel value of SR, low_bound = Min SR value and high_bound = max SR
@@ -269,8 +199,7 @@ class ILSWE:
 			arry (ndarray): Array to fuzzify
 			nodata (int): Nodata value
 		"""
-		sr_fuzz = self.apply_func(self.sigmoid_fuzzification, arry, nodata, switch_bounds=False)		
-		return sr_fuzz
+		return compute_factor_product([arry], nodata, self.get_fuzzy_memberships()[1:2])
 
 	def fuzzify_soil_crust(self, arry, nodata):
 		""" SC_fuzz is the Fuzzified SC, x is the pixel value of SC, low_bound = Min SC value and high_bound = max SC
@@ -278,8 +207,7 @@ class ILSWE:
 			arry (ndarray): Array to fuzzify
 			nodata (int): Nodata value
 		"""
-		sc_fuzz = self.apply_func(self.linear_fuzzification, arry, nodata, switch_bounds=False)	
-		return sc_fuzz
+		return compute_factor_product([arry], nodata, self.get_fuzzy_memberships()[2:3])
 
 	def fuzzify_erodible_fraction(self, arry, nodata):
 		""" EF_fuzz is the Fuzzified EF, x is the pixel value of EF, low_bound = Min EF value and high_bound = max EF
@@ -287,8 +215,7 @@ class ILSWE:
 			arry (ndarray): Array to fuzzify
 			nodata (int): Nodata value
 		"""
-		ef_fuzz = self.apply_func(self.linear_fuzzification, arry, nodata, switch_bounds=False)	
-		return ef_fuzz
+		return compute_factor_product([arry], nodata, self.get_fuzzy_memberships()[3:4])
 		
 	def fuzzify_climatic_erosivity(self, arry, nodata):
 		""" CE_fuzz is the Fuzzified CE, x is the pixel value of CE, low_bound = Min CE value and high_bound = max CE
@@ -296,8 +223,7 @@ class ILSWE:
 			arry (ndarray): Array to fuzzify
 			nodata (int): Nodata value
 		"""
-		ce_fuzz = self.apply_func(self.linear_fuzzification, arry, nodata, switch_bounds=False)	
-		return ce_fuzz
+		return compute_factor_product([arry], nodata, self.get_fuzzy_memberships()[4:5])
 
 	def prevalidate(self, both_valid=True):
 		"""
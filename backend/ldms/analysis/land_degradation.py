@@ -7,7 +7,7 @@ from ldms.enums import (ClimaticRegionEnum, LandDegradationTernaryChangeEnum,
 		ProductivityChangeTernaryEnum, SOCChangeEnum, LulcChangeEnum, RasterCategoryEnum)
 from common_gis.utils.raster_util import (extract_pixels_using_vector, get_raster_meta, clip_raster_to_vector,
 				return_raster_with_stats, get_raster_models)
-import pandas as pd
+from common_gis.utils.transition_util import TransitionMatrix
 import numpy as np
 from common_gis.utils.vector_util import get_vector
 from common import ModelNotExistError 
@@ -135,33 +135,24 @@ class LandDegradation:
 
 		self.initialize_degradation_matrix()
 
-		df = pd.DataFrame({
-						'productivity': prod_array.flatten(),
-						'soc': soc_array.flatten(),
-						'lulc': lulc_array.flatten()
-					})
-		df['mapping'] = nodata
-
 		if LandDegrationSettings.OUTPUT_BINARY:
 			# If any of the indicators has degraded, then output degraded else output not-degraded
-			degraded_mask = (df['productivity'] == ProductivityChangeTernaryEnum.DEGRADED.key) | (df['soc'] == SOCChangeEnum.DEGRADED.key) | (df['lulc'] == LulcChangeEnum.DEGRADED.key)
-			nodata_mask = (df['productivity'] != nodata) & (df['soc'] != nodata) & (df['lulc'] != nodata)
-			df.loc[degraded_mask, ['mapping']] = LandDegradationTernaryChangeEnum.DEGRADED.key
+			degraded_mask = (prod_array == ProductivityChangeTernaryEnum.DEGRADED.key) | (soc_array == SOCChangeEnum.DEGRADED.key) | (lulc_array == LulcChangeEnum.DEGRADED.key)
+			nodata_mask = (prod_array != nodata) & (soc_array != nodata) & (lulc_array != nodata)
+			datasource = np.full(prod_array.shape, nodata, dtype=np.int32)
+			datasource[degraded_mask] = LandDegradationTernaryChangeEnum.DEGRADED.key
 
 			# exclude no_data values
-			df.loc[~degraded_mask & nodata_mask, ['mapping']] = LandDegradationTernaryChangeEnum.IMPROVED.key
+			datasource[~degraded_mask & nodata_mask] = LandDegradationTernaryChangeEnum.IMPROVED.key
 		else:
-			# Replace values
+			matrix = []
 			for row in self.degradation_matrix:
-				# filter all matching entries as per the matrix
-				mask = (df['productivity'] == row['prod']) & (df['soc'] == row['soc']) & (df['lulc'] == row['lulc'])
-				if row['mapping'] == LandDegradationTernaryChangeEnum.STABLE and LandDegrationSettings.OVERRIDE_STABLE:
-					df.loc[mask, ['mapping']] = LandDegradationTernaryChangeEnum.IMPROVED
-				else:
-					df.loc[mask, ['mapping']] = row['mapping']
-		
-		datasource = df['mapping'].values.reshape(prod_array.shape)
-		datasource = datasource.astype(np.int32)
+				row = dict(row)
+				if row['mapping'] == LandDegradationTernaryChangeEnum.STABLE.key and LandDegrationSettings.OVERRIDE_STABLE:
+					row['mapping'] = LandDegradationTernaryChangeEnum.IMPROVED.key
+				matrix.append(row)
+			transitions = TransitionMatrix.from_rows(matrix, keys=['prod', 'soc', 'lulc'], nodata=nodata)
+			datasource = transitions.apply([prod_array, soc_array, lulc_array])
 
 		return return_raster_with_stats(
 			request=self.request,
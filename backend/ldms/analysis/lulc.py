@@ -16,8 +16,10 @@ from common.utils.file_util import (get_download_url,
 								get_media_dir, file_exists, get_absolute_media_path)
 from common_gis.utils.raster_util import (get_raster_meta, reproject_raster,
 								extract_pixels_using_vector, clip_raster_to_vector,
-								return_raster_with_stats, get_raster_models, compute_area, generate_tiles)
+								return_raster_with_stats, get_raster_models, compute_area, generate_tiles, get_clipped_raster,
+								align_rasters, save_raster)
 from common_gis.utils.vector_util import get_vector
+from common_gis.utils.transition_util import TransitionMatrix
 import numpy as np
 import pandas as pd
 import enum
@@ -217,7 +219,7 @@ class LULC:
 			return self.return_with_error(_("Raster %s does not exist" % (raster_model.rasterfile.name)))	
 
 		if raster_model.raster_year == start_year:
-				clipped_raster, out_meta = clip_raster_to_vector(raster_path, vector)
+				clipped_raster, out_meta, cached_file = get_clipped_raster(raster_path, vector)
 		
 		# this would be the file_path of the clipped raster
 		out_file = get_absolute_media_path(file_path=None, 
@@ -446,56 +448,51 @@ class LULC:
 		start_arry, nodata, start_rastfile = extract_pixels_using_vector(start_model.rasterfile.name, 
 										vector, use_temp_dir=False)
 
-		# Reproject based on the start model
-		end_raster_file, nodata = reproject_raster(reference_raster=start_model.rasterfile.name, 
-										   raster=end_model.rasterfile.name,
-										   vector=vector,
-										   resampling=Resampling.average)
-
-		end_arry, nodata, end_rastfile = extract_pixels_using_vector(end_raster_file, 
-										vector, use_temp_dir=False)
+		# Read the end and reference soc rasters on the grid of the start raster
+		end_arry = align_rasters(reference_raster=start_model.rasterfile.name, 
+										rasters=[end_model.rasterfile.name],
+										vector=vector,
+										resampling=Resampling.average,
+										dest_nodata=nodata)[0][0]
+		end_rastfile = get_absolute_media_path(file_path=None, 
+										is_random_file=True, 
+										random_file_prefix="",
+										random_file_ext=".tif")
+		save_raster(dataset=end_arry, source_path=start_rastfile, target_path=end_rastfile, 
+					dtype=end_arry.dtype, no_data=nodata)
 		
 		reference_soc_arry = None
 		reference_soc_rastfile = None
 		if reference_soc_file:
-			# If there is reference_soc_model, Reproject the reference soc with the start period raster
-			reference_soc_file, ndata = reproject_raster(reference_raster=start_model.rasterfile.name, 
-												raster=reference_soc_file,
-												vector=vector,
-												resampling=Resampling.average)
-			reference_soc_arry, ndata, reference_soc_rastfile = extract_pixels_using_vector(reference_soc_file, vector)
-		
-		if reference_soc_file:
-			start_arry, end_arry, reference_soc_arry = reshape_rasters(rasters=[start_arry, end_arry, reference_soc_arry])
-		else:
-			start_arry, end_arry = reshape_rasters(rasters=[start_arry, end_arry])
+			# keep the nodata of the reference soc raster
+			reference_soc_arry = align_rasters(reference_raster=start_model.rasterfile.name, 
+										rasters=[reference_soc_file],
+										vector=vector,
+										resampling=Resampling.average)[0][0]
+			reference_soc_rastfile = meta_raster_path # same grid
 		meta = get_raster_meta(start_model.rasterfile.name)
-		df = pd.DataFrame({'base': start_arry.flatten(), 'target': end_arry.flatten()})
-
-		# fill nan with nodata values
-		df['change'] = np.full(df['base'].shape, meta['nodata'])
-
 		if return_no_map == True:
+			df = pd.DataFrame({'base': start_arry.flatten(), 'target': end_arry.flatten()})
+			# fill nan with nodata values
+			df['change'] = np.full(df['base'].shape, meta['nodata'])
 			return df, reference_soc_arry, reference_soc_rastfile, nodata, start_model.resolution
 
-		for key in transition_matrix.keys():
-			"""
-			get where the 'start' is equal to the dict key
-			df['base'] contains pixel values for the base period
-			df['target'] contains pixel values for the target period
-			"""
-			stable = transition_matrix[key]['stable']
-			improved = transition_matrix[key]['improved']
-			degraded = transition_matrix[key]['degraded']
-			if stable:
-				df.loc[(df['base']==key) & (df['target'].isin(stable)), ['change']] = LulcChangeEnum.STABLE.key # stable
-			if improved:
-				df.loc[(df['base']==key) & (df['target'].isin(improved)), ['change']] = LulcChangeEnum.IMPROVED.key # improved
-			if degraded:
-				df.loc[(df['base']==key) & (df['target'].isin(degraded)), ['change']] = LulcChangeEnum.DEGRADED.key # degraded
-					
-		# convert to old shape
-		dataset = df['change'].values.reshape(start_arry.shape)
+		"""
+		Map each (base, target) pair of pixel values to the change type
+		start_arry contains pixel values for the base period
+		end_arry contains pixel values for the target period
+		"""
+		transitions = TransitionMatrix.from_class_lists(transition_matrix, 
+						class_map={
+							'stable': LulcChangeEnum.STABLE.key,
+							'improved': LulcChangeEnum.IMPROVED.key,
+							'degraded': LulcChangeEnum.DEGRADED.key
+						},
+						nodata=meta['nodata'])
+		dataset, transition_counts = transitions.apply([start_arry, end_arry], return_counts=True)
+		transition_counts = transitions.get_transition_counts(transition_counts)
+		for itm in transition_counts:
+			itm['area'] = compute_area(itm['count'], start_model.resolution)
 
 		return return_raster_with_stats(
 			request=self.request,
@@ -511,7 +508,8 @@ class LULC:
 			extras={'rasters': {
 								start_model.raster_year: get_download_url(request=self.request, file=start_rastfile.split("/")[-1]), 
 								end_model.raster_year: get_download_url(request=self.request, file=end_rastfile.split("/")[-1])
-							}
+							},
+							'transitions': transition_counts
 						},
 			is_intermediate_variable=self.is_intermediate_variable
 		)
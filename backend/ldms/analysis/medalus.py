@@ -1,7 +1,6 @@
 import rasterio
 import numpy as np
 import numpy.ma as ma
-import pandas as pd
 import enum
 from django.utils.translation import gettext as _
 from rest_framework.response import Response
@@ -9,7 +8,7 @@ from common_gis.utils.raster_util import (extract_pixels_using_vector, get_raste
 				return_raster_with_stats, do_raster_operation,
 				get_raster_meta, clip_raster_to_vector,
 				reshape_raster, reshape_rasters, reproject_raster, get_raster_values, reshape_and_reproject_rasters,
-				harmonize_raster_nodata, get_raster_models)
+				harmonize_raster_nodata, get_raster_models, reclassify_raster, align_rasters)
 from ldms.enums import (AridityIndexEnum, RasterCategoryEnum, RasterSourceEnum, 
 					RasterOperationEnum, ClimateQualityIndexEnum,
 					SoilQualityIndexEnum, SoilSlopeIndexEnum,
@@ -18,6 +17,7 @@ from ldms.enums import (AridityIndexEnum, RasterCategoryEnum, RasterSourceEnum,
 					SoilRockFragmentEnum, ManagementQualityIndexEnum, 
 					VegetationQualityEnum, GenericRasterBandEnum, ESAIEnum)
 from common_gis.utils.vector_util import get_vector
+from common_gis.utils.artifact_util import save_array_artifact
 from common import ModelNotExistError
 from common.utils.common_util import cint, return_with_error
 from common.utils.date_util import validate_years
@@ -61,6 +61,8 @@ class Medalus:
 					- a string with placeholder e.g x * x to mean square of that value
 			request (Request): 
 				A Web request object
+			save_intermediate_rasters (bool):
+				If True, the ESAI also saves its CQI, SQI, VQI and MQI rasters and returns them in its extras
 		""" 
 		self.admin_level = kwargs.get('admin_level', None)
 		self.shapefile_id = kwargs.get('shapefile_id', None)
@@ -74,6 +76,8 @@ class Medalus:
 		self.analysis_type = None #one of ProductivityCalcEnum				
 		self.raster_source = kwargs.get('raster_source', RasterSourceEnum.MODIS)
 		self.admin_0 = kwargs.get('admin_0', None)
+		# If True, the quality indices computed by calculate_esai are also saved
+		self.save_intermediate_rasters = kwargs.get('save_intermediate_rasters', False)
 
 		self.BASE_RESAMPLING_PATH = None # Base resampling path that should be used to reproject other rasters
 
@@ -85,18 +89,22 @@ class Medalus:
 	def resample(self, reference_raster, raster_file, vector, nodata):
 		"""
 		Will resample to a common raster if BASE_RESAMPLING_PATH is defined. Else, just clip the raster
+
+		Returns:
+			tuple (array, nodata, meta) where meta is the metadata of the grid of the array,
+			to be passed as `metadata_raster_path` when saving the results
 		"""		
-		ref_raster = reference_raster or self.BASE_RESAMPLING_PATH
-		if ref_raster:
-			reprojected_raster_file, nodata = reproject_raster(reference_raster=reference_raster or self.BASE_RESAMPLING_PATH, 
-												raster=raster_file,
-												vector=vector,
-												resampling=Resampling.nearest)
-		else:
-			reprojected_raster_file = raster_file
-		# Clip the raster
-		raster, nodata, raster_path = extract_pixels_using_vector(reprojected_raster_file, vector, dest_nodata=nodata)
-		return (raster, nodata, raster_path)
+		# Without a reference raster, the raster is clipped on its own grid
+		ref_raster = reference_raster or self.BASE_RESAMPLING_PATH or raster_file
+
+		# Read the raster on the grid of the reference raster within the vector. Nothing is written to disk
+		arrays, nodata_values, meta = align_rasters(reference_raster=ref_raster, 
+										rasters=[raster_file],
+										vector=vector,
+										resampling=Resampling.nearest,
+										dest_nodata=nodata)
+		meta.update({'nodata': nodata_values[0]})
+		return (arrays[0], nodata_values[0], meta)
 
 	def validate_periods(self):
 		"""
@@ -156,19 +164,7 @@ class Medalus:
 
 		self.initialize_aridity_matrix()
 
-		df = pd.DataFrame({
-						'ratio': ratios.filled(fill_value=nodata).flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in self.aridity_matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high']) & (df['ratio'] != nodata)
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-
-		datasource = df['mapping'].values.reshape(ratios.shape)
-		datasource = datasource.astype(np.int32)
+		datasource = reclassify_raster(ratios, self.aridity_matrix, nodata)
 		
 		self.ratios = ratios # just for unit testing purposes
 		if return_raster:
@@ -260,21 +256,10 @@ class Medalus:
 
 		self.initialize_cqi_matrix()
 
-		df = pd.DataFrame({
-						'ratio': cqi.flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in self.cqi_matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])			
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-		
-		datasource = df['mapping'].values.reshape(cqi.shape)
-		datasource = datasource.astype(np.int32)
+		datasource = reclassify_raster(cqi, self.cqi_matrix, nodata)
 		
-		extras = {'raw_raster': str(cqi.tolist())}
+		# Only a reference to the raw raster is returned. See `load_array_artifact`
+		extras = {'raw_raster': save_array_artifact(cqi, nodata)}
 		# self.ratios = ratios # just for unit testing purposes
 		return return_raster_with_stats(
 			request=self.request,
@@ -340,18 +325,7 @@ class Medalus:
 		self.initialize_rainfall_reclassification_matrix()
 		
 		"""Replace the values of rainfall by an index as specified in the self.rainfall_matrix"""
-		df = pd.DataFrame({
-						'ratio': rain_meta_raster.flatten(),												
-					})
-		df['mapping'] = nodata
-		# Replace values
-		for row in self.rainfall_matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high']) & (df['ratio'] != nodata)
-			df.loc[mask, ['mapping']] = row['mapping']
-
-		reclassed_rainfall = df['mapping'].values.reshape(rain_meta_raster.shape)
-		reclassed_rainfall = reclassed_rainfall.astype(np.int32)
+		reclassed_rainfall = reclassify_raster(rain_meta_raster, self.rainfall_matrix, nodata)
 
 		# compute AI
 		# ai_raster =  self.calculate_aridity_index(return_raster=True)
@@ -375,19 +349,7 @@ class Medalus:
 
 		self.initialize_cqi_matrix()
 
-		df = pd.DataFrame({
-						'ratio': cqi.flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in self.cqi_matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-		
-		datasource = df['mapping'].values.reshape(cqi.shape)
-		datasource = datasource.astype(np.int32)
+		datasource = reclassify_raster(cqi, self.cqi_matrix, nodata)
 				
 		# self.ratios = ratios # just for unit testing purposes
 		return return_raster_with_stats(
@@ -485,19 +447,7 @@ class Medalus:
 								
 		self.initialize_sqi_matrix()
 		
-		df = pd.DataFrame({
-						'ratio': sqi.filled(fill_value=nodata).flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in self.sqi_matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-		
-		datasource = df['mapping'].values.reshape(sqi.shape)
-		datasource = datasource.astype(np.int32)
+		datasource = reclassify_raster(sqi, self.sqi_matrix, nodata)
 		
 		# self.ratios = ratios # just for unit testing purposes
 		return return_raster_with_stats(
@@ -560,19 +510,7 @@ class Medalus:
 
 		self.initialize_mqi_matrix()
 
-		df = pd.DataFrame({
-						'ratio': ratios.filled(fill_value=nodata).flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in self.mqi_matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high']) & (df['ratio'] != nodata)
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-
-		datasource = df['mapping'].values.reshape(ratios.shape)
-		datasource = datasource.astype(np.int32)
+		datasource = reclassify_raster(ratios, self.mqi_matrix, nodata)
 		
 		self.ratios = ratios # just for unit testing purposes
 		if return_raster:
@@ -659,19 +597,7 @@ class Medalus:
 								
 		self.initialize_vqi_matrix()
 		
-		df = pd.DataFrame({
-						'ratio': vqi.filled(fill_value=nodata).flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in self.vqi_matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-		
-		datasource = df['mapping'].values.reshape(vqi.shape)
-		datasource = datasource.astype(np.int32)
+		datasource = reclassify_raster(vqi, self.vqi_matrix, nodata)
 		
 		# self.ratios = ratios # just for unit testing purposes
 		return return_raster_with_stats(
@@ -692,96 +618,168 @@ class Medalus:
 		"""
 		Compute ESAI
 		Combines VQI, SQI, CQI and MQI indices
+		ESAI = pow(CQI * SQI * VQI * MQI, 1/4)
+
+		All the input rasters are resolved once and read on the grid of the Aridity
+		Index raster in a single pass. The quality indices are computed in memory and
+		are only written to disk if `save_intermediate_rasters` is set.
 		"""		
 		self.in_sub_indicator_context = False
+		self.error = None
 
-		# Clip the raster and save for later referencing
 		vector, error = self.get_vector()	
-		start_model, error = self.get_raster_model(self.start_year, RasterCategoryEnum.ARIDITY_INDEX.value, throw_error=False)
 		if error:
 			return self.return_with_error(error)
 
-		# meta_raster, meta_raster_path, nodata = clip_raster_to_vector(start_model.rasterfile.name, vector)
-		meta_raster_path = start_model.rasterfile.name		
-		self.BASE_RESAMPLING_PATH = start_model.rasterfile.name # meta_raster_path
+		models, error = self.get_esai_raster_models()
+		if error:
+			return self.return_with_error(error)
 
-		start_meta = get_raster_meta(self.BASE_RESAMPLING_PATH)
-		nodata = start_meta['nodata'] 
+		# All the rasters are read on the grid of the Aridity Index raster
+		start_model = models['cqi'][0]
+		self.BASE_RESAMPLING_PATH = start_model.rasterfile.name
+		nodata = get_raster_meta(self.BASE_RESAMPLING_PATH, set_default_nodata=True)['nodata']
 
-		self.error = None
-		cqi, cqi_raster = self.calculate_climate_quality_index(resampling_raster=self.BASE_RESAMPLING_PATH)
-		if self.error:
-			return self.return_with_error(self.error)
-
-		sqi, sqi_raster = self.calculate_soil_quality_index(resampling_raster=self.BASE_RESAMPLING_PATH)
-		if self.error:
-			return self.return_with_error(self.error)
-
-		vqi, mqi_raster = self.calculate_vegetation_quality_index(resampling_raster=self.BASE_RESAMPLING_PATH)
-		if self.error:
-			return self.return_with_error(self.error)
-
-		mqi, vqi_raster = self.calculate_management_quality_index(resampling_raster=self.BASE_RESAMPLING_PATH)
-		if self.error:
-			return self.return_with_error(self.error)
-
-		base_file = cqi['rasterfile']
-
-		# cqi_raster = self.read_raster(cqi['rasterfile'], base_file)
-		# sqi_raster = self.read_raster(sqi['rasterfile'], base_file)
-		# mqi_raster = self.read_raster(mqi['rasterfile'], base_file)
-		# vqi_raster = self.read_raster(vqi['rasterfile'], base_file)
-
-		# harmonize nodata values
-		base_meta = get_raster_meta(self.get_file_path(base_file), set_default_nodata=True)
-		nodata = base_meta.get('nodata')
-
-		# replace with metadata 
- 		
-		#rasters = reshape_rasters([cqi_raster, sqi_raster, mqi_raster, vqi_raster])
-		rasters = reshape_and_reproject_rasters(raster_objects=[
-				{'raster': cqi_raster, 'rasterfile': get_physical_file_path_from_url(self.request, cqi['rasterfile'])},
-				{'raster': sqi_raster, 'rasterfile': get_physical_file_path_from_url(self.request, sqi['rasterfile'])},
-				{'raster': mqi_raster, 'rasterfile': get_physical_file_path_from_url(self.request, mqi['rasterfile'])},
-				{'raster': vqi_raster, 'rasterfile': get_physical_file_path_from_url(self.request, vqi['rasterfile'])}
-			], vector=vector)
-
-		esai = do_raster_operation(rasters=rasters,
-								operation=RasterOperationEnum.MULTIPLY, 
-								nodata=nodata)
-		esai = np.power(esai, 1/4)
+		rasters, meta, error = self.read_esai_rasters(models, vector, nodata)
+		if error:
+			return self.return_with_error(error)
+		meta.update({'nodata': nodata}) # used as metadata when saving the results
+
+		indices = {}
+		for key in ['cqi', 'sqi', 'vqi', 'mqi']:
+			indices[key] = self.compute_quality_index(rasters[key], nodata)
+
+		extras = {}
+		if self.save_intermediate_rasters:
+			extras['intermediates'] = self.save_esai_intermediates(indices, meta, nodata, start_model.resolution)
+
+		esai = self.compute_quality_index([indices['cqi'], indices['sqi'], indices['vqi'], indices['mqi']], nodata)
 
 		self.initialize_esai_matrix()
 		
-		df = pd.DataFrame({
-						'ratio': esai.filled(fill_value=nodata).flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in self.esai_matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-		
-		datasource = df['mapping'].values.reshape(esai.shape)
-		datasource = datasource.astype(np.int32)
+		datasource = reclassify_raster(esai, self.esai_matrix, nodata)
 		
-		# self.ratios = ratios # just for unit testing purposes
 		return return_raster_with_stats(
 			request=self.request,
 			datasource=datasource, 
 			prefix="esai", 
 			change_enum=ESAIEnum, 
-			metadata_raster_path=self.get_file_path(base_file), #meta_raster_path,  
+			metadata_raster_path=meta,  
 			nodata=nodata, 
 			resolution=start_model.resolution,
 			start_year=self.start_year,
 			end_year=self.end_year,
 			subdir=MedalusSettings.SUB_DIR,
+			extras=extras,
 			is_intermediate_variable=not self.in_sub_indicator_context
 		)	
 
+	def get_esai_raster_models(self):
+		"""
+		Get the models of all the rasters needed to compute the ESAI
+
+		Returns:
+			tuple (models, error) where models is a dict of the list of models of each quality index
+		"""
+		aridity_model, rain_model, cqi_error = self.get_cqi_raster_models(include_aspect=False)
+		*sqi_models, sqi_error = self.get_sqi_raster_models()
+		*vqi_models, vqi_error = self.get_vqi_raster_models()
+		*mqi_models, mqi_error = self.get_mqi_raster_models()
+		models = {
+			'cqi': [aridity_model, rain_model],
+			'sqi': sqi_models,
+			'vqi': vqi_models,
+			'mqi': mqi_models,
+		}
+		return (models, cqi_error or sqi_error or vqi_error or mqi_error)
+
+	def read_esai_rasters(self, models, vector, nodata):
+		"""
+		Read all the rasters of the ESAI in one pass on the grid of `self.BASE_RESAMPLING_PATH`
+
+		Args:
+			models (dict): Models of each quality index as returned by `get_esai_raster_models`
+			vector (geojson): Polygon to read
+			nodata (number): Nodata value of the aligned rasters
+
+		Returns:
+			tuple (rasters, meta, error) where rasters is a dict of the list of arrays of each quality index
+			and meta is the metadata of their grid
+		"""
+		keys = list(models.keys())
+		files = [model.rasterfile.name for key in keys for model in models[key]]
+		try:
+			arrays, nodata_values, meta = align_rasters(reference_raster=self.BASE_RESAMPLING_PATH, 
+										rasters=files,
+										vector=vector,
+										resampling=Resampling.nearest,
+										dest_nodata=nodata)
+		except rasterio.errors.RasterioIOError as e:
+			return (None, None, _("A raster file required to compute the ESAI could not be read. {0}").format(str(e)))
+
+		rasters, pos = {}, 0
+		for key in keys:
+			rasters[key] = arrays[pos:pos + len(models[key])]
+			pos += len(models[key])
+		return (rasters, meta, None)
+
+	def compute_quality_index(self, rasters, nodata):
+		"""
+		Compute a quality index as the geometric mean of its factors
+		i.e pow(factor_1 * factor_2 * ... * factor_n, 1/n)
+
+		Args:
+			rasters (list): Factor rasters. Pixels that are masked or equal to nodata are masked in the result
+			nodata (number): Nodata value
+
+		Returns:
+			float masked array
+		"""
+		# multiply as floats to avoid overflowing integer factors
+		rasters = [ma.asarray(x).astype(float) for x in rasters]
+		product = do_raster_operation(rasters=rasters,
+									  operation=RasterOperationEnum.MULTIPLY, 
+									  nodata=nodata)
+		return np.power(product, 1/len(rasters))
+
+	def save_esai_intermediates(self, indices, metadata_raster_path, nodata, resolution):
+		"""
+		Save the quality indices computed by `calculate_esai` and compute their statistics
+
+		Args:
+			indices (dict): Raw raster of each quality index
+			metadata_raster_path (string|dict): Path of the raster where to get Metadata from, or the metadata
+			nodata (number): Nodata value
+			resolution (int): Resolution to use to compute statistics
+
+		Returns:
+			dict of the results of each quality index
+		"""
+		enums = {
+			'cqi': (ClimateQualityIndexEnum, self.initialize_cqi_matrix, 'cqi_matrix'),
+			'sqi': (SoilQualityIndexEnum, self.initialize_sqi_matrix, 'sqi_matrix'),
+			'vqi': (VegetationQualityEnum, self.initialize_vqi_matrix, 'vqi_matrix'),
+			'mqi': (ManagementQualityIndexEnum, self.initialize_mqi_matrix, 'mqi_matrix'),
+		}
+		results = {}
+		for key, raster in indices.items():
+			change_enum, initialize_matrix, matrix_name = enums[key]
+			initialize_matrix()
+			results[key] = return_raster_with_stats(
+				request=self.request,
+				datasource=reclassify_raster(raster, getattr(self, matrix_name), nodata), 
+				prefix=key, 
+				change_enum=change_enum, 
+				metadata_raster_path=metadata_raster_path,  
+				nodata=nodata, 
+				resolution=resolution,
+				start_year=self.start_year,
+				end_year=self.end_year,
+				subdir=MedalusSettings.SUB_DIR,
+				is_intermediate_variable=True
+			)
+		return results
+
 	def get_file_path(self, url):
 		return get_physical_file_path_from_url(self.request, url)
 
@@ -802,19 +800,7 @@ class Medalus:
 		"""
 		Replace raster values with the matrix index values
 		"""
-		df = pd.DataFrame({
-					'ratio': raster.flatten(),												
-				})
-		df['index'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])
-			df.loc[mask & no_data_mask, ['index']] = row['index']
-
-		ds = df['index'].values.reshape(raster.shape)
-		ds = ds.astype(float)
+		ds = reclassify_raster(raster, matrix, nodata, mapping_key='index', dtype=float)
 		return ds
 	
 	def initialize_aridity_matrix(self):
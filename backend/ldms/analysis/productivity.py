@@ -26,11 +26,13 @@ from sklearn.linear_model import LinearRegression
 from scipy import stats
 import tempfile 
 from common_gis.utils.raster_util import (extract_pixels_using_vector, get_raster_meta, clip_raster_to_vector, reshape_rasters,
-				return_raster_with_stats)
+				return_raster_with_stats, reclassify_raster, compute_zonal_quantiles)
 from common_gis.utils.vector_util import get_vector
-from scipy.stats import percentileofscore
+from common_gis.utils.trend_util import compute_trend
+from common_gis.utils.transition_util import TransitionMatrix
+from common_gis.utils.percentile_util import get_value_counts, get_percentile_ranks
+from common_gis.utils.stack_util import RunningStats
 from common import ModelNotExistError, AnalysisParamError
-import collections 
 from rasterio.warp import Resampling
 from django.conf import settings
 import copy
@@ -253,22 +255,9 @@ class Productivity:
 				if self.error:
 					return self.return_with_error(self.error)
 
-				change_matrix = self.initialize_trajectory_change_matrix()
-
-				df = pd.DataFrame({
-								'baseline': baseline['datasource'].flatten(),
-								'reporting': reporting['datasource'].flatten(),
-							})
-				df['mapping'] = reporting['nodata']
-
-				# Replace values
-				for row in change_matrix:
-					# filter all matching entries as per the matrix
-					mask = (df['baseline'] == row['base']) & (df['reporting'] == row['curr'])
-					df.loc[mask, ['mapping']] = row['mapping']
-				
-				datasource = df['mapping'].values.reshape(baseline['datasource'].shape)
-				datasource = datasource.astype(np.int32)
+				change_matrix = TransitionMatrix.from_rows(self.initialize_trajectory_change_matrix(), 
+								keys=['base', 'curr'], nodata=reporting['nodata'])
+				datasource = change_matrix.apply([baseline['datasource'], reporting['datasource']])
 
 				return return_raster_with_stats(
 					request=self.request,
@@ -298,37 +287,6 @@ class Productivity:
 		4. Generate a raster containing the transitional values
 		5. compute the raster statistics to be returned together with the raster
 		"""
-		def get_linear_regression(item):
-			"""Get the slope"""
-			# slope, intercept, r_value, p_value, std_err = stats.linregress(time_array, item['values'])
-			data = extract_period_values(item)
-			if data == nodata:
-				return nodata		
-			
-			slope, intercept, r_value, p_value, std_err = stats.linregress(time_array, data)
-			return slope
-
-		def extract_period_values(item):
-			data = []			
-			# Extract values for all the periods to form the data series
-			for i, tm in enumerate(time_array):
-				val = item[str(tm)]
-				if val == nodata: # if any value has nodata, then return nodata as val of slope
-					return nodata
-				data.append(val)
-			return data
-
-		def get_pvalue(item):
-			"""Get pvalue"""
-			data = extract_period_values(item)
-			if data == nodata:
-				return nodata	
-			tau, p_value = stats.kendalltau(time_array, data)
-			# tau, p_value = stats.kendalltau(time_array, [item['base'], item['target']])
-			# p_value = p_value if not np.isnan(p_value) else 1.
-			return p_value
-
-		
 		error, vector, start_model, end_model, start_year, end_year = self.prevalidate()
 		if error:
 			return self.return_with_error(error)
@@ -381,66 +339,28 @@ class Productivity:
 
 		time_array = [x.raster_year for x in ndvi_models]
 		
-		"""
-		stack pixel values. This will put all pixel values at specific location 
-		into one single array such that values at the same location for different 
-		pixel location will be contained in a single array. The array will be of size 
-		(raster_rows, raster_cols, no_of_rasters)
-
-		To get mean of rasters by their positions, use the below form
-			np.mean(np.dstack([x, y, z]).transpose(), axis=0).transpose()
-		"""
-		rasters = np.dstack(ndvi_rasters)
-
 		if len(ndvi_rasters) != len(time_array):
 			error = _("The number of available datasets is different from the number of periods selected. Number of datasets is {0} while the number of periods is {1}. Ensure there is a dataset for each of the years within the reporting period."
 					.format(len(ndvi_rasters), len(time_array)))
 			return self.return_with_error(error)
 
-		# Create dataframe
-		df = pd.DataFrame()
-		# create dynamic index for each reporting period
-		for i, tm in enumerate(time_array):
-			df[str(tm)] = ndvi_rasters[i].flatten()
-
-		df['mapping'] = nodata #initialize all to nodata
-		df['slope'] = nodata #initialize all to nodata
-		df['pvalue'] = nodata #initialize all to nodata
-
-		# create masks
-		nodata_masks = []
-		for i, tm in enumerate(time_array):
-			msk = (df[str(tm)] == nodata)
-			nodata_masks.append(msk)
-	
-		# Compute slope
-		# 1.  compute slope		
-		"""
-		do linear regression on every pixel and for this 
-		we are getting the r/ship btwn base and target years pixel values
-		We only consider slope and the p_value. stats.linregress returns values as below
-			slope, intercept, r_value, p_value, std_err = stats.linregress(time_array, data_array).
-		linregress() uses Wald Test with t-distribution, not mann kandell, so we use kendalltau since
-		we want to do a non-parametric significance test
-		"""	
-		# for those values that have not changed, the slope is 0
-		df.loc[~np.logical_and.reduce(nodata_masks), ['slope']] = 0 # combine and apply masks
-
-		# Only do regression where pixel values have changed
-		df.loc[~np.logical_and.reduce(nodata_masks), ['slope']] = df.apply(lambda x: get_linear_regression(x), axis=1) 
-
-		# get p value
-		# 2. Compute pvalues to perform significance test
+		# Compute slope and p value
 		"""
-		If p Value is more than cutoff, then its stable.
-		p value will be nan if both x and y are the same. if values 
-		of x (base) and y (target) are same, it returns nan values.	
+		Compute the OLS slope and the Mann-Kendall significance of every pixel
+		over the whole stack at once. Pixels with nodata in any of the periods
+		are masked in both the slope and the pvalue.
+		We use the Mann-Kendall test rather than the Wald Test of the regression 
+		since we want to do a non-parametric significance test.
+		If p Value is more than cutoff, then its stable. Pixels whose values
+		have not changed over the periods have a p value of 1.0
 		"""
-		# get p value where the base and target are different, else assign p value to 1.0
-		df.loc[~np.logical_and.reduce(nodata_masks), ['pvalue']] = df.apply(lambda x: get_pvalue(x), axis=1) 
-		
-		# set mapping to stable first for all non-masked values
-		df.loc[~np.logical_and.reduce(nodata_masks), ['mapping']] = TrajectoryChangeTernaryEnum.STABLE.key
+		# stack pixel values into an array of size (no_of_rasters, raster_rows, raster_cols)
+		slope, pvalue = compute_trend(ndvi_rasters, time_array, nodata)
+		valid_mask = ~ma.getmaskarray(slope)
+
+		# initialize all to nodata and set mapping to stable for all non-masked values
+		out_raster = np.full(valid_mask.shape, nodata)
+		out_raster[valid_mask] = TrajectoryChangeTernaryEnum.STABLE.key
 
 		# 3. Set transitions. 
 		"""
@@ -448,18 +368,14 @@ class Productivity:
 		Improved: If pvalue <= ProductivitySettings.PVALUE_CUTOFF and slope > 0
 		Stable: If pvalue > ProductivitySettings.PVALUE_CUTOFF or (pvalue <= ProductivitySettings.PVALUE_CUTOFF and slope = 0)
 		"""
-		significant_pvalue_mask = (df['pvalue'] <= ProductivitySettings.PVALUE_CUTOFF)
+		significant_pvalue_mask = valid_mask & (pvalue.filled(1.0) <= ProductivitySettings.PVALUE_CUTOFF)
+		slope = slope.filled(0)
 		
 		# improved
-		improved_mask = (df['slope'] >= 0)
-		df.loc[~np.logical_and.reduce(nodata_masks) & improved_mask & significant_pvalue_mask, ['mapping']] = TrajectoryChangeTernaryEnum.IMPROVED.key
+		out_raster[significant_pvalue_mask & (slope >= 0)] = TrajectoryChangeTernaryEnum.IMPROVED.key
 		
 		# degraded
-		degraded_mask = (df['slope'] < 0)
-		df.loc[~np.logical_and.reduce(nodata_masks) & degraded_mask & significant_pvalue_mask, ['mapping']] = TrajectoryChangeTernaryEnum.DEGRADED.key
-
-		# reshape the pd.series into 2d array
-		out_raster = df['mapping'].values.reshape(ndvi_rasters[0].shape)
+		out_raster[significant_pvalue_mask & (slope < 0)] = TrajectoryChangeTernaryEnum.DEGRADED.key
 
 		# Clip the raster and save for later referencing
 		meta_raster, meta_raster_path, nodata = clip_raster_to_vector(start_model.rasterfile.name, vector)
@@ -502,36 +418,6 @@ class Productivity:
 		4. Generate a raster containing the transitional values
 		5. compute the raster statistics to be returned together with the raster
 		"""
-		def get_linear_regression(item):
-			"""Get the slope"""
-			# slope, intercept, r_value, p_value, std_err = stats.linregress(time_array, item['values'])
-			data = extract_period_values(item)
-			if data == nodata:
-				return nodata		
-			
-			slope, intercept, r_value, p_value, std_err = stats.linregress(time_array, data)
-			return slope
-
-		def extract_period_values(item):
-			data = []			
-			# Extract values for all the periods to form the data series
-			for i, tm in enumerate(time_array):
-				val = item[str(tm)]
-				if val == nodata: # if any value has nodata, then return nodata as val of slope
-					return nodata
-				data.append(val)
-			return data
-
-		def get_pvalue(item):
-			"""Get pvalue"""
-			data = extract_period_values(item)
-			if data == nodata:
-				return nodata	
-			tau, p_value = stats.kendalltau(time_array, data)
-			# tau, p_value = stats.kendalltau(time_array, [item['base'], item['target']])
-			# p_value = p_value if not np.isnan(p_value) else 1.
-			return p_value
-		
 		self.start_year = start_year
 		self.end_year = end_year
 
@@ -587,64 +473,25 @@ class Productivity:
 
 		time_array = [x.raster_year for x in ndvi_models]
 		
-		"""
-		stack pixel values. This will put all pixel values at specific location 
-		into one single array such that values at the same location for different 
-		pixel location will be contained in a single array. The array will be of size 
-		(raster_rows, raster_cols, no_of_rasters)
-
-		To get mean of rasters by their positions, use the below form
-			np.mean(np.dstack([x, y, z]).transpose(), axis=0).transpose()
-		"""
-		rasters = np.dstack(ndvi_rasters)
-
 		if len(ndvi_rasters) != len(time_array):
 			error = _("The number of available datasets is different from the number of periods selected. Number of datasets is {0} while the number of periods is {1}. Ensure there is a dataset for each of the years within the reporting period."
 					.format(len(ndvi_rasters), len(time_array)))
 			return self.return_with_error(error)
 
-		# Create dataframe
-		df = pd.DataFrame()
-		# create dynamic index for each reporting period
-		for i, tm in enumerate(time_array):
-			df[str(tm)] = ndvi_rasters[i].flatten()
-
-		df['mapping'] = nodata #initialize all to nodata
-		df['slope'] = nodata #initialize all to nodata
-		df['pvalue'] = nodata #initialize all to nodata
-
-		# create masks
-		nodata_masks = []
-		for i, tm in enumerate(time_array):
-			msk = (df[str(tm)] == nodata)
-			nodata_masks.append(msk)
-	
-		# Compute slope
-		# 1.  compute slope		
-		"""
-		do linear regression on every pixel and for this 
-		we are getting the r/ship btwn base and target years pixel values
-		We only consider slope and the p_value. stats.linregress returns values as below
-			slope, intercept, r_value, p_value, std_err = stats.linregress(time_array, data_array).
-		linregress() uses Wald Test with t-distribution, not mann kandell, so we use kendalltau since
-		we want to do a non-parametric significance test
-		"""	
-		# for those values that have not changed, the slope is 0
-		df.loc[~np.logical_and.reduce(nodata_masks), ['slope']] = 0 # combine and apply masks
-
-		# Only do regression where pixel values have changed
-		df.loc[~np.logical_and.reduce(nodata_masks), ['slope']] = df.apply(lambda x: get_linear_regression(x), axis=1) 
-
-		# get p value
-		# 2. Compute pvalues to perform significance test
+		# Compute slope and p value
 		"""
-		If p Value is more than cutoff, then its stable.
-		p value will be nan if both x and y are the same. if values 
-		of x (base) and y (target) are same, it returns nan values.	
+		Compute the OLS slope and the Mann-Kendall significance of every pixel
+		over the whole stack at once. Pixels with nodata in any of the periods
+		are masked in both the slope and the pvalue.
+		We use the Mann-Kendall test rather than the Wald Test of the regression 
+		since we want to do a non-parametric significance test.
+		If p Value is more than cutoff, then its stable. Pixels whose values
+		have not changed over the periods have a p value of 1.0
 		"""
-		# get p value where the base and target are different, else assign p value to 1.0
-		df.loc[~np.logical_and.reduce(nodata_masks), ['pvalue']] = df.apply(lambda x: get_pvalue(x), axis=1) 
-		
+		# stack pixel values into an array of size (no_of_rasters, raster_rows, raster_cols)
+		slope, pvalue = compute_trend(ndvi_rasters, time_array, nodata)
+		valid_mask = ~ma.getmaskarray(slope)
+
 		# set mapping to stable first for all non-masked values
 		# df.loc[~np.logical_and.reduce(nodata_masks), ['mapping']] = TrajectoryChangeTernaryEnum.STABLE.key
 
@@ -664,29 +511,13 @@ class Productivity:
 		# degraded_mask = (df['slope'] < 0)
 		# df.loc[~np.logical_and.reduce(nodata_masks) & degraded_mask & significant_pvalue_mask, ['mapping']] = TrajectoryChangeTernaryEnum.DEGRADED.key
 
-		# reshape the pd.series into 2d array
-		out_raster = df['slope'].values.reshape(ndvi_rasters[0].shape)
-
-		out_raster = self.mask_array(out_raster, nodata)
+		out_raster = slope
 		# Clip the raster and save for later referencing
 		meta_raster, meta_raster_path, nodata = clip_raster_to_vector(start_model.rasterfile.name, vector)
 		
 		trend_enum, change_map = self.initialize_trajectory_matrix() 
 		
-		ds = out_raster
-		df = pd.DataFrame({
-						'ratio': ds.filled(fill_value=nodata).flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in change_map:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-		
-		out_raster = df['mapping'].values.reshape(ds.shape)
-		out_raster = out_raster.astype(np.int32)
+		out_raster = reclassify_raster(out_raster, change_map, nodata)
 
 		if return_raw:
 			return {
@@ -737,22 +568,9 @@ class Productivity:
 				if self.error:
 					return self.return_with_error(self.error)
 
-				change_matrix = self.initialize_state_change_matrix()
-
-				df = pd.DataFrame({
-								'baseline': baseline['datasource'].flatten(),
-								'reporting': reporting['datasource'].flatten(),
-							})
-				df['mapping'] = reporting['nodata']
-
-				# Replace values
-				for row in change_matrix:
-					# filter all matching entries as per the matrix
-					mask = (df['baseline'] == row['base']) & (df['reporting'] == row['curr'])
-					df.loc[mask, ['mapping']] = row['mapping']
-				
-				datasource = df['mapping'].values.reshape(baseline['datasource'].shape)
-				datasource = datasource.astype(np.int32)
+				change_matrix = TransitionMatrix.from_rows(self.initialize_state_change_matrix(), 
+								keys=['base', 'curr'], nodata=reporting['nodata'])
+				datasource = change_matrix.apply([baseline['datasource'], reporting['datasource']])
 
 				return return_raster_with_stats(
 					request=self.request,
@@ -845,11 +663,12 @@ class Productivity:
 		if not baseline_period:
 			return self.return_with_error(_("There must be data for at least %s years in order to compute state" % (ProductivitySettings.MIN_COMPARISON_RANGE)))
 
-		base_line_rasters = self.get_vi_rasters(baseline_period[0], baseline_period[-1])
-		base_line_rasters = reshape_rasters(base_line_rasters)
+		base_line_stats, error = self.get_vi_running_stats(baseline_period[0], baseline_period[-1])
+		if error:
+			return self.return_with_error(error)
 
-		# compute the per pixel average for all the baseline rasters
-		base_line_avg_raster = self.compute_pixel_averages(rasters=base_line_rasters)
+		# the per pixel average for all the baseline rasters
+		base_line_avg_raster = base_line_stats.mean
 		
 		# get frequency distribution for pixel values in the combined baseline raster
 		freq_dist = self.get_frequency_distribution([base_line_avg_raster], nodata)
@@ -870,11 +689,12 @@ class Productivity:
 		"""
 		# Get rasters for the comparison period
 		# comparison_rasters = self.get_vi_rasters(self.start_year, self.end_year)
-		comparison_rasters = self.get_vi_rasters(comparison_period[0], comparison_period[-1])	
-		comparison_rasters = reshape_rasters(comparison_rasters)
+		comparison_stats, error = self.get_vi_running_stats(comparison_period[0], comparison_period[-1])
+		if error:
+			return self.return_with_error(error)
 
-		# compute the per pixel average for all the baseline rasters
-		comparison_avg_raster = self.compute_pixel_averages(rasters=comparison_rasters)
+		# the per pixel average for all the comparison rasters
+		comparison_avg_raster = comparison_stats.mean
 		
 		# get frequency distribution for pixel values in the combined 		baseline raster
 		freq_dist = self.get_frequency_distribution([comparison_avg_raster], nodata)
@@ -1011,14 +831,13 @@ class Productivity:
 		if not baseline_period:
 			return self.return_with_error(_("There must be data for at least %s years in order to compute state" % (ProductivitySettings.MIN_COMPARISON_RANGE)))
 
-		base_line_rasters = self.get_vi_rasters(baseline_period[0], baseline_period[-1])
-		base_line_rasters = reshape_rasters(base_line_rasters)
-
-		# compute the per pixel average for all the baseline rasters
-		base_line_avg_raster = self.compute_pixel_averages(rasters=base_line_rasters)
+		base_line_stats, error = self.get_vi_running_stats(baseline_period[0], baseline_period[-1])
+		if error:
+			return self.return_with_error(error)
 
-		# compute std dev for all the baseline rasters
-		baseline_stddev_raster = self.compute_std_deviation(rasters=base_line_rasters)
+		# the per pixel average and std dev for all the baseline rasters
+		base_line_avg_raster = base_line_stats.mean
+		baseline_stddev_raster = base_line_stats.get_std()
 				
 		# Step 2
 		"""
@@ -1029,11 +848,12 @@ class Productivity:
 		We repeat the same process we did for baseline period
 		"""
 		# Get rasters for the comparison period
-		comparison_rasters = self.get_vi_rasters(comparison_period[0], comparison_period[-1])	
-		comparison_rasters = reshape_rasters(comparison_rasters)
+		comparison_stats, error = self.get_vi_running_stats(comparison_period[0], comparison_period[-1])
+		if error:
+			return self.return_with_error(error)
  
-		# compute the per pixel average for all the baseline rasters
-		comparison_avg_raster = self.compute_pixel_averages(rasters=comparison_rasters)
+		# the per pixel average for all the comparison rasters
+		comparison_avg_raster = comparison_stats.mean
 	
 		# compute Z stats
 		z_stats = compute_z_statistics()
@@ -1041,19 +861,7 @@ class Productivity:
 		# Step 3
 		state_enum, change_map = self.initialize_state_matrix() 
 		
-		df = pd.DataFrame({
-						'ratio': z_stats.filled(fill_value=nodata).flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in change_map:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-		
-		out_raster = df['mapping'].values.reshape(z_stats.shape)
-		out_raster = out_raster.astype(np.int32)
+		out_raster = reclassify_raster(z_stats, change_map, nodata)
 
 		if return_raw:
 			return {
@@ -1138,48 +946,66 @@ class Productivity:
 		comparison_period = periods[-ProductivitySettings.MIN_COMPARISON_RANGE::]		
 		return (baseline_period, comparison_period)
 
-	def get_vi_rasters(self, start_period, end_period):
-		"""Get rasters between start and end periods
+	def iter_vi_rasters(self, start_period, end_period):
+		"""Iterate over the rasters between start and end periods, reading 
+		one raster at a time
 
 		Args:
-			start_year (int): Start period
-			end_year (int): End period
+			start_period (int): Start period
+			end_period (int): End period
+
+		Returns:
+			Generator of tuples (period, raster)
 		"""
-		rasters_list = []
 		vector, error = self.get_vector()	
 		period = start_period
-		min_shape = None # store smallest array size
 		while period <= end_period:
 			model, error = self.get_vi_raster_model(period, throw_error=False)
 			if model:
-				# Extract raster meta data
-				meta = get_raster_meta(model.rasterfile.name)				
 				"""
 				Extract pixels of the vector we are interested in.
 				We ignore the rest of the raster
 				"""
 				raster, nodata, rastfile = extract_pixels_using_vector(model.rasterfile.name, vector)				
-				rasters_list.append(raster)
+				yield period, raster
 			period += 1
-		return rasters_list
+
+	def get_vi_rasters(self, start_period, end_period):
+		"""Get rasters between start and end periods
+
+		Args:
+			start_year (int): Start period
+			end_year (int): End period
+		"""
+		return [raster for period, raster in self.iter_vi_rasters(start_period, end_period)]
+
+	def get_vi_running_stats(self, start_period, end_period):
+		"""Compute the per pixel statistics of the rasters between start and end periods
+		without holding all the rasters in memory
+
+		Args:
+			start_period (int): Start period
+			end_period (int): End period
+
+		Returns:
+			A tuple (RunningStats, error)
+		"""
+		stats = RunningStats()
+		for period, raster in self.iter_vi_rasters(start_period, end_period):
+			stats.update(raster)
+		if not stats.count:
+			return None, _("There are no {0} rasters for the selected periods {1} to {2}".format(
+				self.veg_index, start_period, end_period))
+		return stats, None
 		
 	def get_frequency_distribution(self, rasters, nodata):
 		"""Get the frequency distribution for different rasters 
 		Return:
 			An array with counts for each unique value
 		"""
-		uniques = []
-		for rast in rasters:
-			unique, counts = np.unique(rast[rast != nodata], return_counts=True)
-			# convert to {val:count} dictionary
-			freq_dists = dict(zip(unique, counts)) 
-			uniques.append(freq_dists)
-
-		# Sum along the dict keys
-		counter = collections.Counter()
-		for d in uniques:
-			counter.update(d)
-		return dict(counter)		
+		# count all the rasters at once
+		unique, counts = get_value_counts(rasters, nodata)
+		return dict(zip(unique, counts))
 	
 	def extend_frequency_distributions(self, freq_dist):
 		"""Add some % to highest pixel value and deduct 5% from
@@ -1471,23 +1297,10 @@ class Productivity:
 
 		Returns:
 			Raster whose values are the different percentile classes
-
-		TODO : https://engineering.upside.com/a-beginners-guide-to-optimizing-pandas-code-for-speed-c09ef2c6a4d6
 		"""
-
-		def get_percentile(val):
-			return percentileofscore(unique_vals, val)
-
-		raster_shape = raster.shape
-
-		# create an ndarray of unique values to speed up operations
-		unique_vals = np.array(list(freq_dist.keys())) #rem the keys rep the unique pixel val
-	
-		df = pd.DataFrame({'item': raster.flatten()})
-		df['percentile'] = nodata
-
-		df.loc[df['item'] != nodata, ['percentile']] = df['item'].map(lambda x: percentileofscore(unique_vals, x) if x != nodata else nodata, na_action='ignore')
-		return df['percentile'].values.reshape(raster_shape)
+		# rank against the unique values. rem the keys rep the unique pixel val
+		unique_vals = np.array(list(freq_dist.keys()))
+		return get_percentile_ranks(raster, unique_vals, nodata)
 	
 	def calculate_performance(self):
 		"""
@@ -1517,22 +1330,9 @@ class Productivity:
 				if self.error:
 					return self.return_with_error(self.error)
 
-				change_matrix = self.initialize_performance_change_matrix()
-
-				df = pd.DataFrame({
-								'baseline': baseline['datasource'].flatten(),
-								'reporting': reporting['datasource'].flatten(),
-							})
-				df['mapping'] = reporting['nodata']
-
-				# Replace values
-				for row in change_matrix:
-					# filter all matching entries as per the matrix
-					mask = (df['baseline'] == row['base']) & (df['reporting'] == row['curr'])
-					df.loc[mask, ['mapping']] = row['mapping']
-				
-				datasource = df['mapping'].values.reshape(baseline['datasource'].shape)
-				datasource = datasource.astype(np.int32)
+				change_matrix = TransitionMatrix.from_rows(self.initialize_performance_change_matrix(), 
+								keys=['base', 'curr'], nodata=reporting['nodata'])
+				datasource = change_matrix.apply([baseline['datasource'], reporting['datasource']])
 
 				return return_raster_with_stats(
 					request=self.request,
@@ -1611,13 +1411,15 @@ class Productivity:
 									reprojected_eco_units_raster_file, 
 									vector, nodata)
 	
-		# Get rasters for the reporting period
-		comparison_rasters = self.get_vi_rasters(self.start_year, self.end_year)
+		# Get the per pixel average of the rasters for the reporting period
+		comparison_stats, error = self.get_vi_running_stats(self.start_year, self.end_year)
+		if error:
+			return self.return_with_error(error)
 
-		rasters = reshape_rasters([reference_eco_units_raster] + comparison_rasters)
-		reference_eco_units_raster, comparison_rasters = rasters[0], rasters[1:]
+		reference_eco_units_raster, mean_ndvi = reshape_rasters([reference_eco_units_raster, comparison_stats.mean])
 		
-		datasource = self._do_compute_performance(comparison_rasters, base_rasters=reference_eco_units_raster, nodata=nodata)
+		datasource = self._do_compute_performance(None, base_rasters=reference_eco_units_raster, 
+											nodata=nodata, mean_ndvi=mean_ndvi)
 
 		return return_raster_with_stats(
 			request=self.request,
@@ -1779,19 +1581,16 @@ class Productivity:
 									reprojected_eco_units_raster_file, 
 									vector, nodata)
 	
-		# Get rasters for the reporting period
-		comparison_rasters = self.get_vi_rasters(self.start_year, self.end_year)
+		# Get the per pixel average of the rasters for the reporting period
+		comparison_stats, error = self.get_vi_running_stats(self.start_year, self.end_year)
+		if error:
+			return self.return_with_error(error)
 		
 		# reshape rasters
-		all_rasters = []
-		all_rasters += comparison_rasters
-		all_rasters.append(reference_eco_units_raster)
-
-		all_rasters = reshape_rasters(rasters=all_rasters)
-		comparison_rasters = all_rasters[:-1] #pick all except the last item
-		reference_eco_units_raster = all_rasters[-1] #ref raster is the last item in the list
+		mean_ndvi, reference_eco_units_raster = reshape_rasters(rasters=[comparison_stats.mean, reference_eco_units_raster])
 
-		datasource = self._do_compute_performance(comparison_rasters, base_rasters=reference_eco_units_raster, nodata=nodata)
+		datasource = self._do_compute_performance(None, base_rasters=reference_eco_units_raster, 
+											nodata=nodata, mean_ndvi=mean_ndvi)
 
 		if return_raw:
 			return {
@@ -1814,20 +1613,20 @@ class Productivity:
 			is_intermediate_variable=not self.in_sub_indicator_context
 		) 
 
-	def _do_compute_performance(self, ndvi_rasters, base_rasters, nodata):
-		# Get rasters for the reporting period		
-		comparison_rasters = []
-		# convert to masked array
-		for rast in ndvi_rasters:
-			ma_rast = ma.array(rast)
-			ma_rast[ma_rast==nodata] = ma.masked
-			comparison_rasters.append(ma_rast)
-
+	def _do_compute_performance(self, ndvi_rasters, base_rasters, nodata, mean_ndvi=None):
+		"""
+		Args:
+			ndvi_rasters (list): Rasters of the reporting period. Ignored if `mean_ndvi` is specified
+			base_rasters (ndarray): Reference ecological units
+			nodata (number): NoData value
+			mean_ndvi (ndarray): Per pixel average of the rasters of the reporting period
+		"""
 		# comparison_rasters = ndvi_rasters
 		reference_eco_units_raster = self.compute_pixel_averages(rasters=base_rasters) #base_rasters		
 		
 		# compute the per pixel average for rasters in the comparison periods
-		mean_ndvi = self.compute_pixel_averages(rasters=comparison_rasters)
+		if mean_ndvi is None:
+			mean_ndvi = self.compute_pixel_averages(rasters=list(ndvi_rasters))
 		mean_ndvi = ma.array(mean_ndvi) #initialize a masked array
 
 
@@ -1846,36 +1645,14 @@ class Productivity:
 		# 								 RasterOperationEnum.ADD, nodata=nodata)
 
 		"""
-		Get the frequency distributions of the ecological units
-		For each eco unit, get the value of the corresponding pixel
-		values from the mean ndvi raster
+		For each eco unit, get the 90th percentile of the corresponding pixel
+		values from the mean ndvi raster and set it as the value of the pixels of the unit
 		"""
-		unique_eco_units = self.get_frequency_distribution(reference_eco_units_raster, nodata)
-
-		"""Initialize new array to store max ndvi values"""
-		max_ndvi_raster = np.full(comparison_rasters[0].shape, nodata, dtype=float)
+		max_ndvi_raster = compute_zonal_quantiles(reference_eco_units_raster, mean_ndvi, 90, nodata)
 		max_ndvi_raster = ma.array(max_ndvi_raster) #initialize a masked array
 
-		"""Remove nodata from eco units"""
-		unique_eco_units = [x for x in unique_eco_units if x != nodata]
-		for eco in unique_eco_units:			
-			"""Get index of matching values"""
-			indices = np.where(reference_eco_units_raster==eco)
-
-			"""Extract the corresponding mean ndvi values"""
-			# mean_ndvi_vals = np.take(mean_ndvi, indices)
-			mean_ndvi_vals = mean_ndvi[tuple(indices)]
-			
-			# mask nodata values
-			mean_ndvi[mean_ndvi==nodata] = ma.masked
-			if mean_ndvi_vals.size != 0: #percentile requires an array			
-				"""Get the 90th percentile"""
-				perc_90 = np.percentile(mean_ndvi_vals, 90) 
-
-				"""Set this 90th percentile value as the value for the matching pixels"""
-				# for row, col in zip(indices[0], indices[1]):
-				# 	max_ndvi_raster[row, col] = perc_90
-				max_ndvi_raster[tuple(indices)] = perc_90
+		# mask nodata values
+		mean_ndvi[mean_ndvi==nodata] = ma.masked
 		
 		"""Compute mean_ndiv / max_ndvi"""
 		max_ndvi_raster[max_ndvi_raster==nodata] = ma.masked
@@ -1947,19 +1724,8 @@ class Productivity:
 		state_array = rasters[1]
 		perf_array = rasters[2]
  
-		df = pd.DataFrame({
-						'trajectory': traj_array.flatten(),
-						'state': state_array.flatten(),
-						'performance': perf_array.flatten()
-					})
-		df['mapping'] = nodata
-		for row in prod_matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['trajectory'] == row['traj']) & (df['state'] == row['state']) & (df['performance'] == row['perf'])
-			df.loc[mask, ['mapping']] = row['mapping']
-		
-		datasource = df['mapping'].values.reshape(traj_array.shape)
-		datasource = datasource.astype(np.int32)
+		transitions = TransitionMatrix.from_rows(prod_matrix, keys=['traj', 'state', 'perf'], nodata=nodata)
+		datasource = transitions.apply([traj_array, state_array, perf_array])
 
 		return return_raster_with_stats(
 			request=self.request,
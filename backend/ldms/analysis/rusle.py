@@ -1,14 +1,13 @@
 import numpy as np
 import numpy.ma as ma
-import pandas as pd
 import tempfile
 from django.utils.translation import gettext as _
 from rest_framework.response import Response
 
 from common_gis.utils.vector_util import get_vector
 from common_gis.utils.raster_util import (get_raster_models,
-					clip_rasters, mask_rasters,
-					get_raster_meta, return_raster_with_stats, reshape_rasters)
+					clip_rasters, mask_rasters, are_rasters_aligned, process_raster_blocks,
+					get_raster_meta, return_raster_with_stats, reshape_rasters, reclassify_raster)
 from ldms.enums import (RasterSourceEnum, RasterOperationEnum, 
 						RasterCategoryEnum, RUSLEEnum, RUSLEComputationTypeEnum, RUSLEFactorsEnum)
 from common.utils.common_util import return_with_error, get_random_floats, cint
@@ -17,6 +16,7 @@ from common.utils.file_util import (generate_file_name, get_absolute_media_path,
 								file_exists, get_physical_file_path_from_url)
 from common import ModelNotExistError 
 from common_gis.utils.raster_util import RasterCalcHelper
+from common_gis.utils.factor_util import compute_factor_product
 from django.conf import settings
 
 MIN_INT = settings.MIN_INT # -9223372036854775807
@@ -25,6 +25,18 @@ MAX_INT = settings.MAX_INT # 9223372036854775807
 class RUSLESettings:
 	SUB_DIR = "" # "rusle" # Subdirectory to store rasters for ILSWE
 	
+def compute_rusle_block(blocks, matrix, nodata):
+	"""Multiply the factors of a tile and classify the product. 
+	Used by `process_raster_blocks` hence defined at module level
+
+	Args:
+		blocks (list): Tiles of the R, K, S, C and P factors
+		matrix (list): Classification matrix
+		nodata (int): Nodata value
+	"""
+	rusle = compute_factor_product(blocks, nodata)
+	return reclassify_raster(rusle, matrix, nodata)
+
 class RUSLE:
 	"""
 	Wrapper class for RUSLE (Revised Universal Soil Loss Equation).
@@ -100,13 +112,12 @@ class RUSLE:
 		# c_raster = clipped_rasters[3][0]
 		# p_raster = clipped_rasters[4][0]
 		clipped_raster_paths = [x[1] for x in clipped_rasters]
-		# mask arrays to ensure nodata pixels are not considered
-		clipped_rasters = mask_rasters([x[0] for x in clipped_rasters], nodata)
-		r_raster = clipped_rasters[0]
-		k_raster = clipped_rasters[1]
-		s_raster = clipped_rasters[2]
-		c_raster = clipped_rasters[3]
-		p_raster = clipped_rasters[4]
+		if self.computation_type == RUSLEComputationTypeEnum.RUSLE and are_rasters_aligned(clipped_raster_paths):
+			return self.calculate_rusle_blocks(clipped_raster_paths, nodata, r_model)
+		raw_rasters = [x[0] for x in clipped_rasters]
+		if self.computation_type != RUSLEComputationTypeEnum.RUSLE:
+			# mask arrays to ensure nodata pixels are not considered
+			r_raster, k_raster, s_raster, c_raster, p_raster = mask_rasters(raw_rasters, nodata)
 
 		prefix = "rusle"
 		change_enum = RUSLEFactorsEnum
@@ -128,26 +139,13 @@ class RUSLE:
 		if self.computation_type == RUSLEComputationTypeEnum.RUSLE:
 			change_enum = RUSLEEnum
 			# Multiply factors.
-			rasters = reshape_rasters([r_raster, k_raster, s_raster, c_raster, p_raster])
-			rusle = rasters[0] * rasters[1] * rasters[2] * rasters[3] * rasters[4]
+			rusle = compute_factor_product(raw_rasters, nodata)
 
 		rusle = ma.array(rusle)		
 		
 		# Step 3
 		matrix = self.initialize_matrix()
-		df = pd.DataFrame({
-						'ratio': rusle.filled(fill_value=nodata).flatten(),												
-					})
-		df['mapping'] = nodata
-		no_data_mask = df['ratio'] != nodata
-		# Replace values
-		for row in matrix:
-			# filter all matching entries as per the matrix
-			mask = (df['ratio'] >= row['low']) & (df['ratio'] < row['high'])
-			df.loc[mask & no_data_mask, ['mapping']] = row['mapping']
-		
-		out_raster = df['mapping'].values.reshape(rusle.shape)
-		out_raster = out_raster.astype(np.int32)
+		out_raster = reclassify_raster(rusle, matrix, nodata)
 
 		return return_raster_with_stats(
 			request=self.request,
@@ -162,6 +160,40 @@ class RUSLE:
 			subdir=RUSLESettings.SUB_DIR
 		)
 	
+	def calculate_rusle_blocks(self, raster_paths, nodata, r_model):
+		"""Multiply the factors and classify RUSLE tile by tile using a pool of processes
+
+		Args:
+			raster_paths (list): Paths of the aligned clipped R, K, S, C and P rasters
+			nodata (int): Nodata value
+			r_model (Raster): Model of the rainfall erosivity raster
+		"""
+		out_file = get_absolute_media_path(file_path=None, 
+									is_random_file=True, 
+									random_file_prefix="rusle",
+									random_file_ext=".tif",
+									sub_dir=RUSLESettings.SUB_DIR,
+									use_static_dir=False)
+		value_counts = process_raster_blocks(raster_paths, 
+									func=compute_rusle_block, 
+									out_file=out_file, 
+									nodata=nodata,
+									func_kwargs={'matrix': self.initialize_matrix(), 'nodata': nodata})
+		return return_raster_with_stats(
+			request=self.request,
+			datasource=None, 
+			prefix="rusle", 
+			change_enum=RUSLEEnum, 
+			metadata_raster_path=raster_paths[0],
+			nodata=nodata, 
+			resolution=r_model.resolution,
+			start_year=self.start_year,
+			end_year=self.end_year,
+			subdir=RUSLESettings.SUB_DIR,
+			raster_path=out_file,
+			value_counts=value_counts
+		)
+
 	def return_input_rasters(self, vector, raster, raster_model, 
 					raster_type, nodata, metadata_raster_path, transform="area"):
 		"""Return input rasters
@@ -8,6 +8,7 @@ from rest_framework.response import Response
 from ldms.analysis.lulc import LULC, LCEnum
 from common_gis.utils.raster_util import (reproject_raster, extract_pixels_using_vector,
 			clip_raster_to_vector, return_raster_with_stats, get_raster_models)
+from common_gis.utils.transition_util import TransitionMatrix
 from rasterio.warp import Resampling
 from common.utils.common_util import cint, return_with_error
 from ldms.enums import SOCChangeEnum, LulcChangeEnum, ClimaticRegionEnum, \
@@ -199,22 +200,12 @@ class SOC:
 
 		for key in self.coefficient_matrix:
 			""" only a single dict expected with key == self.climatic_region"""
-			vals = self.coefficient_matrix[key]
-			for mapping in vals:
-				""" 
-				df['base'] contains pixel values for the base period
-				df['target'] contains pixel values for the target period
-				"""
-				for target_lc_key in mapping['coeffs']:
-					target_lc_coeff = mapping['coeffs'][target_lc_key]
-					initial_val = mapping['base_lc'][0]
-					curr_val = target_lc_key[0]
-					mask = (df['base']==initial_val) & (df['target']==curr_val)
-					df.loc[mask, ['change']] = target_lc_coeff # Assign coefficient value 
-
-					# target_lc_coeff = mapping['coeffs'][target_lc_key]
-					# mask = (df['base']==mapping['base_lc']) & (df['target']== target_lc_key)
-					# df.loc[mask, ['change']] = target_lc_coeff # Assign coefficient value 
+			""" 
+			df['base'] contains pixel values for the base period
+			df['target'] contains pixel values for the target period
+			"""
+			coefficients = TransitionMatrix.from_coefficient_matrix(self.coefficient_matrix[key], nodata=nodata)
+			df['change'] = coefficients.apply([df['base'].values, df['target'].values]) # Assign coefficient value 
 
 		# base_model = get_raster_models(
 		# 				raster_category=RasterCategoryEnum.LULC.value,
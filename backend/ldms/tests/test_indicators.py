@@ -1,6 +1,6 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.urls import include, path
-from common_gis.models import AdminLevelZero, AdminLevelOne, AdminLevelTwo
+from common_gis.models import AdminLevelZero, AdminLevelOne, AdminLevelTwo, ScheduledTask
 
 from rest_framework.test import APITestCase, RequestsClient, URLPatternsTestCase
 from common.utils.common_util import get_random_string, get_random_int
@@ -237,4 +237,1246 @@ class ProductivityTest(TestCase):
 				expected_mapping, 
 				result),
 				"Mapping not matching"
-		)
\ No newline at end of file
+		)
+class TrendTest(TestCase):
+	def test_trend_matches_per_pixel_computation(self):
+		"""
+		Test that the vectorized slope and Mann-Kendall p value match
+		the values returned by scipy for each pixel
+		"""
+		from scipy import stats
+		from common_gis.utils.trend_util import compute_trend
+
+		nodata = settings.DEFAULT_NODATA
+		time_array = list(range(2001, 2011))
+		rng = np.random.default_rng(1)
+		rasters = rng.integers(0, 5, (len(time_array), 4, 5)) # small range to get ties
+		rasters[:, 0, 0] = 3 # no change
+		rasters[4, 1, 1] = nodata
+
+		slope, pvalue = compute_trend(rasters, time_array, nodata)
+
+		self.assertTrue(slope.mask[1, 1] and pvalue.mask[1, 1], "Nodata pixel not masked")
+		for row in range(rasters.shape[1]):
+			for col in range(rasters.shape[2]):
+				if (row, col) == (1, 1):
+					continue
+				data = rasters[:, row, col]
+				expected_pvalue = stats.kendalltau(time_array, data).pvalue
+				expected_pvalue = 1.0 if np.isnan(expected_pvalue) else expected_pvalue
+				self.assertAlmostEqual(slope[row, col], stats.linregress(time_array, data).slope)
+				self.assertAlmostEqual(pvalue[row, col], expected_pvalue)
+
+class ReclassificationTest(TestCase):
+	def test_reclassify_raster(self):
+		"""
+		Test that values are mapped to the class of the range [low, high) they fall in
+		and that nodata and unmapped values are set to nodata
+		"""
+		from common_gis.utils.raster_util import reclassify_raster
+
+		nodata = settings.DEFAULT_NODATA
+		matrix = [
+			{'low': settings.MIN_INT, 'high': 1.1, 'mapping': 1},
+			{'low': 1.1, 'high': 1.5, 'mapping': 2},
+			{'low': 2, 'high': settings.MAX_INT, 'mapping': 3},
+		]
+		raster = np.array([
+			[0.5, 1.1],
+			[1.7, nodata],
+			[2.0, 3.5]
+		])
+		expected = np.array([
+			[1, 2],
+			[nodata, nodata],
+			[3, 3]
+		])
+		self.assertTrue(np.array_equal(reclassify_raster(raster, matrix, nodata), expected))
+		self.assertTrue(np.array_equal(reclassify_raster(raster.astype(np.int16), matrix, nodata),
+			np.array([[1, 1], [1, nodata], [3, 3]])))
+
+class TransitionMatrixTest(TestCase):
+	def test_transition_matrix(self):
+		"""
+		Test that (base, target) pairs are mapped as per the matrix, undefined
+		pairs are set to nodata and the transitions are counted
+		"""
+		from common_gis.utils.transition_util import TransitionMatrix
+
+		nodata = settings.DEFAULT_NODATA
+		matrix = [
+			{'base': 1, 'curr': 1, 'mapping': 1},
+			{'base': 1, 'curr': 2, 'mapping': 2},
+			{'base': 2, 'curr': 1, 'mapping': 3},
+		]
+		base = np.array([[1, 1], [2, nodata]])
+		target = np.array([[1, 2], [2, 1]])
+
+		transitions = TransitionMatrix.from_rows(matrix, keys=['base', 'curr'], nodata=nodata)
+		out, counts = transitions.apply([base, target], return_counts=True)
+
+		self.assertTrue(np.array_equal(out, np.array([[1, 2], [nodata, nodata]])))
+		self.assertEquals(transitions.get_transition_counts(counts), [
+			{'categories': [1, 1], 'count': 1},
+			{'categories': [1, 2], 'count': 1},
+			{'categories': [2, 2], 'count': 1},
+		])
+
+class RasterBlockProcessingTest(TestCase):
+	def test_process_raster_blocks(self):
+		"""
+		Test that processing rasters tile by tile with a pool of processes gives
+		the same raster and value counts as processing the whole arrays
+		"""
+		import rasterio
+		from rasterio.transform import from_origin
+		from common.utils.file_util import get_temp_file
+		from common_gis.utils.raster_util import process_raster_blocks
+		from ldms.analysis.rusle import compute_rusle_block
+
+		nodata = -1
+		matrix = [
+			{'low': 0, 'high': 10, 'mapping': 1},
+			{'low': 10, 'high': 100, 'mapping': 2},
+			{'low': 100, 'high': 10000, 'mapping': 3},
+		]
+		meta = {'driver': 'GTiff', 'width': 300, 'height': 200, 'count': 1, 'dtype': 'int16',
+				'crs': 'EPSG:4326', 'transform': from_origin(30, 5, 0.01, 0.01), 'nodata': nodata}
+		factors = np.random.randint(-1, 10, size=(5, 200, 300)).astype(np.int16)
+		raster_files = []
+		for factor in factors:
+			raster_files.append(get_temp_file(suffix=".tif"))
+			with rasterio.open(raster_files[-1], "w", **meta) as dest:
+				dest.write(factor, 1)
+
+		expected = compute_rusle_block(list(factors), matrix, nodata)
+		unique, counts = np.unique(expected, return_counts=True)
+		out_file = get_temp_file(suffix=".tif")
+		value_counts = process_raster_blocks(raster_files, compute_rusle_block, out_file, nodata, 
+							func_kwargs={'matrix': matrix, 'nodata': nodata}, workers=2, window_size=64)
+
+		with rasterio.open(out_file) as src:
+			self.assertTrue(np.array_equal(src.read(1), expected))
+		self.assertEquals(value_counts, dict(zip(unique.tolist(), counts.tolist())))
+
+class PercentileTest(TestCase):
+	def test_assign_percentiles(self):
+		"""
+		Test that percentile ranks assigned from the frequency distribution match
+		scipy's percentileofscore for every pixel
+		"""
+		from scipy.stats import percentileofscore
+
+		nodata = -32768
+		raster = np.random.randint(-2000, 9000, size=(40, 50)).astype(np.float64)
+		raster[np.random.random(raster.shape) < 0.1] = nodata
+
+		prod = Productivity()
+		freq_dist = prod.get_frequency_distribution([raster], nodata)
+		unique, counts = np.unique(raster[raster != nodata], return_counts=True)
+		self.assertEquals(freq_dist, dict(zip(unique, counts)))
+
+		freq_dist = prod.extend_frequency_distributions(freq_dist)
+		unique_vals = np.array(list(freq_dist.keys()))
+		expected = np.array([percentileofscore(unique_vals, x) if x != nodata else nodata 
+						for x in raster.flatten()]).reshape(raster.shape)
+		self.assertTrue(np.allclose(prod.assign_percentiles(raster, freq_dist, nodata), expected))
+
+class ArrayArtifactTest(TestCase):
+	def test_save_and_load_artifact(self):
+		"""
+		Test that an array saved as an artifact is referenced by its hash and 
+		can be memory-mapped back with its nodata values masked
+		"""
+		from common_gis.utils.artifact_util import save_array_artifact, load_array_artifact
+
+		nodata = -32768
+		raster = ma.masked_equal(np.random.random((30, 40)), 0)
+		raster[5:10, 5:10] = ma.masked
+
+		ref = save_array_artifact(raster, nodata)
+		self.assertEquals(ref['shape'], [30, 40])
+		self.assertEquals(save_array_artifact(raster, nodata)['path'], ref['path'])
+		json.dumps(ref)
+
+		loaded = load_array_artifact(ref, masked=True)
+		self.assertTrue(np.array_equal(ma.getmaskarray(loaded), ma.getmaskarray(raster)))
+		self.assertTrue(np.allclose(loaded.compressed(), raster.compressed()))
+
+class VectorTileTest(TestCase):
+	def test_tile_bounds(self):
+		"""
+		Test that the tile coordinates map to the web mercator bounds and are validated
+		"""
+		from common_gis.utils.tile_util import get_tile_bounds, validate_tile, WEB_MERCATOR_EXTENT
+		from common import AnalysisParamError
+
+		extent = WEB_MERCATOR_EXTENT
+		self.assertTrue(np.allclose(get_tile_bounds(0, 0, 0), (-extent, -extent, extent, extent)))
+		self.assertTrue(np.allclose(get_tile_bounds(1, 1, 0), (0, 0, extent, extent)))
+		self.assertRaises(AnalysisParamError, validate_tile, 0, 1, 2, 0)
+		self.assertRaises(AnalysisParamError, validate_tile, 5, 0, 0, 0)
+
+	def test_tile_response(self):
+		"""
+		Test that a tile of an admin level is encoded by PostGIS and revalidated with its ETag
+		"""
+		from django.contrib.gis.geos import MultiPolygon, Polygon
+		from common_gis.utils.tile_util import MVT_CONTENT_TYPE
+
+		AdminLevelZero.objects.create(gid_0="TST", name_0="Test", 
+			geom=MultiPolygon(Polygon(((30, -5), (35, -5), (35, 0), (30, 0), (30, -5)))))
+		response = self.client.get('/api/tiles/0/0/0/0.mvt')
+		self.assertEquals(response.status_code, 200)
+		self.assertEquals(response['Content-Type'], MVT_CONTENT_TYPE)
+		self.assertTrue(len(response.content) > 0)
+
+		response = self.client.get('/api/tiles/0/0/0/0.mvt', HTTP_IF_NONE_MATCH=response['ETag'])
+		self.assertEquals(response.status_code, 304)
+		# an empty tile
+		response = self.client.get('/api/tiles/0/4/0/0.mvt')
+		self.assertEquals(response.content, b"")
+
+class ClippedRasterCacheTest(TestCase):
+	def setUp(self):
+		import rasterio
+		import tempfile
+		from rasterio.transform import from_origin
+
+		self.cache_dir = tempfile.mkdtemp()
+		self.meta = {'driver': 'GTiff', 'width': 50, 'height': 40, 'count': 1, 'dtype': 'float32',
+				'crs': 'EPSG:4326', 'transform': from_origin(30, 5, 0.01, 0.01), 'nodata': -1}
+		self.raster_file = self.cache_dir + "/source.tif"
+		with rasterio.open(self.raster_file, "w", **self.meta) as dest:
+			dest.write(np.zeros((1, 40, 50), dtype=np.float32))
+		self.vector = {"type": "Polygon", "coordinates": [[[30, 5], [30.2, 5], [30.2, 4.8], [30, 5]]]}
+		self.array = np.random.random((1, 40, 50)).astype(np.float32)
+
+	def test_key_changes_with_raster_mtime(self):
+		"""
+		Test that an entry is no longer found once the source raster is modified
+		"""
+		import os
+		from common_gis.utils.raster_util import ClippedRasterCache
+
+		cache = ClippedRasterCache(cache_dir=self.cache_dir + "/clips", max_bytes=10**9)
+		key = cache.get_key(self.raster_file, self.vector, False, -1)
+		cache.set(key, self.array, self.meta)
+		self.assertTrue(np.array_equal(cache.get(key)[0], self.array))
+
+		stat = os.stat(self.raster_file)
+		os.utime(self.raster_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+		new_key = cache.get_key(self.raster_file, self.vector, False, -1)
+		self.assertNotEqual(new_key, key)
+		self.assertIsNone(cache.get(new_key))
+		self.assertEquals(cache.get_stats()['process'], {'hits': 1, 'misses': 1, 'evictions': 0})
+
+	def test_evicts_least_recently_used_by_bytes(self):
+		"""
+		Test that the least recently used entries are evicted once the cache exceeds its size
+		"""
+		import os
+		import time
+		from common_gis.utils.raster_util import ClippedRasterCache
+
+		cache = ClippedRasterCache(cache_dir=self.cache_dir + "/clips", max_bytes=10**9)
+		keys = [cache.get_key(self.raster_file, self.vector, False, nodata) for nodata in (1, 2, 3)]
+		cache.set(keys[0], self.array, self.meta)
+		cache.set(keys[1], self.array, self.meta)
+		size = max([x[1] for x in cache.get_entries()])
+		now = time.time()
+		for i, key in enumerate(keys[:2]): # the first entry is the oldest
+			for fl in cache.get_paths(key):
+				os.utime(fl, (now - 100 + i * 50, now - 100 + i * 50))
+		cache.get(keys[0]) # ...until it is read
+
+		cache.max_bytes = int(size * 2.5)
+		cache.set(keys[2], self.array, self.meta)
+		self.assertIsNotNone(cache.get(keys[0]))
+		self.assertIsNone(cache.get(keys[1]))
+		self.assertIsNotNone(cache.get(keys[2]))
+		self.assertEquals(cache.get_stats()['process']['evictions'], 1)
+		self.assertTrue(cache.get_stats()['bytes'] <= cache.max_bytes)
+
+class StreamingClipTest(TestCase):
+	def test_streamed_clip_matches_mask(self):
+		"""
+		Test that clipping a raster window by window gives the same array and 
+		transform as rasterio.mask for the same vector
+		"""
+		import rasterio
+		import rasterio.mask
+		import tempfile
+		from rasterio.transform import from_origin
+		from django.test import override_settings
+		from common_gis.utils.raster_util import get_clip_window, stream_clip_raster, get_clipped_raster
+
+		temp_dir = tempfile.mkdtemp()
+		meta = {'driver': 'GTiff', 'width': 150, 'height': 120, 'count': 1, 'dtype': 'int16',
+				'crs': 'EPSG:4326', 'transform': from_origin(30, 5, 0.01, 0.01), 'nodata': -1}
+		raster_file = temp_dir + "/source.tif"
+		with rasterio.open(raster_file, "w", tiled=True, blockxsize=16, blockysize=16, **meta) as dest:
+			dest.write(np.random.randint(-1, 100, size=(1, 120, 150)).astype(np.int16))
+		# vertices off the pixel grid so that no edge goes exactly through a pixel center
+		vector = {"type": "Polygon", "coordinates": [[[30.1337, 4.9123], [31.2741, 4.5517], 
+					[30.6119, 3.9302], [30.0531, 4.2087], [30.1337, 4.9123]]]}
+
+		with override_settings(CLIP_STREAMING_WINDOW_SIZE=32, CLIP_CACHE_ENABLED=False):
+			for all_touched in (True, False):
+				with rasterio.open(raster_file) as src:
+					expected, transform = rasterio.mask.mask(src, [vector], all_touched=all_touched, nodata=-9, crop=True)
+					out_meta = stream_clip_raster(src, [vector], get_clip_window(src, [vector]), -9, all_touched,
+									raster_file=temp_dir + "/clip.tif", array_file=temp_dir + "/clip.npy")
+				self.assertTrue(np.array_equal(np.load(temp_dir + "/clip.npy"), expected))
+				self.assertEquals(out_meta['transform'], transform)
+				with rasterio.open(temp_dir + "/clip.tif") as src:
+					self.assertTrue(np.array_equal(src.read(), expected))
+
+			streamed, streamed_meta, streamed_file = get_clipped_raster(raster_file, json.dumps(vector), dest_nodata=-9, streaming=True)
+			in_memory, in_memory_meta, in_memory_file = get_clipped_raster(raster_file, json.dumps(vector), dest_nodata=-9, streaming=False)
+		self.assertTrue(np.array_equal(streamed, in_memory))
+		self.assertEquals(streamed_meta['transform'], in_memory_meta['transform'])
+
+class AlignRastersTest(TestCase):
+	def test_rasters_are_pixel_aligned(self):
+		"""
+		Test that rasters of a different CRS and resolution are read on the grid of 
+		the reference raster, each reference pixel taking the value at its center
+		"""
+		import rasterio
+		import tempfile
+		from rasterio.transform import from_origin
+		from rasterio.warp import transform_bounds
+		from common_gis.utils.raster_util import align_rasters
+
+		temp_dir = tempfile.mkdtemp()
+		def write(name, crs, transform, width, height, data):
+			with rasterio.open(temp_dir + name, "w", driver='GTiff', width=width, height=height, count=1, 
+							dtype='int32', crs=crs, transform=transform, nodata=-1) as dest:
+				dest.write(data.astype(np.int32), 1)
+			return temp_dir + name
+
+		# reference grid: 0.01 degree pixels with origin (30, 5)
+		ref = write("/ref.tif", "EPSG:4326", from_origin(30, 5, 0.01, 0.01), 100, 80, np.zeros((80, 100)))
+		# finer raster in degrees whose values are the column of the reference pixel they fall in
+		cols = np.floor(np.arange(200) / 2)
+		fine = write("/fine.tif", "EPSG:4326", from_origin(30, 5, 0.005, 0.005), 200, 160, np.tile(cols, (160, 1)))
+		# web mercator raster whose values are the row of the reference pixel they fall in
+		left, bottom, right, top = transform_bounds("EPSG:4326", "EPSG:3857", 29.9, 4.1, 31.1, 5.1)
+		size = 250
+		width, height = int((right - left) / size), int((top - bottom) / size)
+		transform = from_origin(left, top, size, size)
+		ys = np.array([transform * (0, row + 0.5) for row in range(height)])[:, 1]
+		lats = np.degrees(2 * np.arctan(np.exp(ys / 6378137.0)) - np.pi / 2)
+		rows = np.floor((5 - lats) / 0.01)
+		mercator = write("/mercator.tif", "EPSG:3857", transform, width, height, np.tile(rows[:, None], (1, width)))
+
+		arrays, nodata_values, meta = align_rasters(ref, [fine, mercator])
+		self.assertEquals(meta['transform'], from_origin(30, 5, 0.01, 0.01))
+		self.assertEquals((meta['height'], meta['width']), (80, 100))
+		self.assertEquals(nodata_values, [-1, -1])
+		self.assertTrue(all([x.shape == (80, 100) for x in arrays]))
+		self.assertTrue(np.array_equal(arrays[0], np.tile(np.arange(100), (80, 1))))
+		self.assertTrue(np.array_equal(arrays[1], np.tile(np.arange(80)[:, None], (1, 100))))
+
+class ConcurrentClipTest(TestCase):
+	def test_workers_return_same_rasters(self):
+		"""
+		Test that the rasters clipped by a pool of threads are the same as those
+		clipped one at a time and are returned in the order of the models, 
+		including a raster on another grid which is aligned to the reference raster
+		"""
+		import rasterio
+		import tempfile
+		from types import SimpleNamespace
+		from rasterio.transform import from_origin
+		from django.test import override_settings
+		from common_gis.utils.raster_util import clip_rasters, clip_raster_to_vector, align_rasters
+
+		temp_dir = tempfile.mkdtemp()
+		rng = np.random.RandomState(0)
+		def write(name, transform, width, height, data):
+			with rasterio.open(temp_dir + name, "w", driver='GTiff', width=width, height=height, count=1, 
+							dtype='int16', crs='EPSG:4326', transform=transform, nodata=-1) as dest:
+				dest.write(data.astype(np.int16), 1)
+			return SimpleNamespace(rasterfile=SimpleNamespace(name=temp_dir + name))
+
+		models = [write("/factor_%s.tif" % i, from_origin(30, 5, 0.01, 0.01), 100, 80, 
+						rng.randint(-1, 100, size=(80, 100))) for i in range(4)]
+		# factor on a finer grid whose values are the column of the reference pixel they fall in
+		fine = write("/fine.tif", from_origin(30, 5, 0.005, 0.005), 200, 160, np.tile(np.floor(np.arange(200) / 2), (160, 1)))
+		models = models[:2] + [fine, None] + models[2:]
+		vector = {"type": "Polygon", "coordinates": [[[30.1337, 4.9123], [30.7741, 4.5517], 
+					[30.4119, 4.3302], [30.0531, 4.4087], [30.1337, 4.9123]]]}
+
+		with override_settings(CLIP_CACHE_ENABLED=False):
+			nodata, serial = clip_rasters(json.dumps(vector), models, workers=1)
+			concurrent_nodata, concurrent = clip_rasters(json.dumps(vector), models, workers=4)
+			expected = [clip_raster_to_vector(model.rasterfile.name, json.dumps(vector), dest_nodata=nodata)[0] 
+							if model and model != fine else None for model in models]
+			aligned = align_rasters(models[0].rasterfile.name, [fine.rasterfile.name], 
+							vector=json.dumps(vector), dest_nodata=nodata)[0][0]
+
+		self.assertEquals(concurrent_nodata, nodata)
+		self.assertEquals(len(serial), len(models))
+		self.assertEquals(len(concurrent), len(models))
+		expected[2] = aligned[np.newaxis]
+		for (raster, raster_file), (other, other_file), expected_raster in zip(serial, concurrent, expected):
+			if expected_raster is None:
+				self.assertEquals((raster, raster_file, other, other_file), (None, None, None, None))
+				continue
+			self.assertEquals(raster.shape, serial[0][0].shape)
+			self.assertTrue(np.array_equal(raster, expected_raster))
+			self.assertTrue(np.array_equal(other, expected_raster))
+			with rasterio.open(raster_file) as src, rasterio.open(other_file) as other_src:
+				self.assertTrue(np.array_equal(src.read(), other_src.read()))
+				self.assertEquals(src.transform, other_src.transform)
+		# the aligned factor takes the column of the reference pixels
+		valid = expected[2][0] != nodata
+		self.assertTrue(valid.any())
+		cols = np.tile(np.arange(serial[0][0].shape[-1]), (serial[0][0].shape[-2], 1))
+		self.assertEquals(len(np.unique(expected[2][0][valid] - cols[valid])), 1)
+
+class ResultCacheTest(TestCase):
+	def test_local_and_shared_tiers(self):
+		"""
+		Test that values are served from the local tier, then from the shared tier 
+		once evicted locally, and that the local tier is an LRU
+		"""
+		from common.utils.cache_util import ResultCache
+
+		cache = ResultCache(max_local_entries=2, local_timeout=60)
+		cache.get_redis = lambda: None # use the Django cache as the shared tier
+		key = get_random_string(10)
+		cache.set(key + "a", {"value": np.int64(1)}, 60)
+		self.assertEquals(cache.get(key + "a"), {"value": 1})
+		self.assertEquals(json.loads(cache.get(key + "a", raw=True)), {"value": 1})
+		self.assertEquals(cache.metrics['local_hits'], 2)
+
+		cache.set(key + "b", [2], 60)
+		cache.get(key + "a") # b is now the least recently used
+		cache.set(key + "c", [3], 60)
+		self.assertEquals(list(cache.local.keys()), [key + "a", key + "c"])
+
+		self.assertEquals(cache.get(key + "b"), [2])
+		self.assertEquals(cache.metrics['shared_hits'], 1)
+		self.assertIn(key + "b", cache.local) # promoted back to the local tier
+
+		cache.delete(key + "b")
+		self.assertIsNone(cache.get(key + "b"))
+		self.assertEquals(cache.metrics['misses'], 1)
+
+	def test_local_entries_expire(self):
+		"""
+		Test that local entries do not outlive their timeout
+		"""
+		import time
+		from common.utils.cache_util import ResultCache
+
+		cache = ResultCache(max_local_entries=2, local_timeout=60)
+		key = get_random_string(10)
+		cache.set_local(key, cache.encode([1]), 0.01)
+		time.sleep(0.02)
+		self.assertIsNone(cache.get_local(key))
+
+	def test_single_flight_wait_is_bounded(self):
+		"""
+		Test that a request waiting for an identical computation gives up after the
+		wait timeout instead of the lock timeout, and that the lock is released
+		"""
+		import threading
+		import time
+		import redis
+		from common.utils.cache_util import ResultCache
+
+		cache = ResultCache()
+		if not cache.get_redis():
+			self.skipTest("The result cache is not configured with Redis")
+		try:
+			cache.get_redis().ping()
+		except redis.RedisError:
+			self.skipTest("Redis is not available")
+
+		key = get_random_string(10)
+		holding, release = threading.Event(), threading.Event()
+		def compute():
+			with cache.single_flight(key, timeout=60, wait_timeout=1):
+				holding.set()
+				release.wait(10)
+		holder = threading.Thread(target=compute)
+		holder.start()
+		holding.wait(10)
+
+		start = time.time()
+		with cache.single_flight(key, timeout=60, wait_timeout=1):
+			waited = time.time() - start
+		self.assertTrue(0.5 < waited < 5)
+		self.assertEquals(cache.metrics['lock_waits'], 1)
+		self.assertEquals(cache.metrics['lock_timeouts'], 1)
+
+		release.set()
+		holder.join()
+		start = time.time()
+		with cache.single_flight(key, timeout=60, wait_timeout=1):
+			self.assertTrue(time.time() - start < 0.5)
+
+class QueuedJobSubscriptionTest(TestCase):
+	"""
+	Test the deduplication of identical queued analyses. Requires the Redis server of the queues
+	"""
+	def setUp(self):
+		import redis
+		from common.queue import in_flight_jobs
+
+		try:
+			in_flight_jobs.get_connection().ping()
+		except redis.RedisError:
+			self.skipTest("Redis is not available")
+		self.cache_key = get_random_string(20)
+		self.job_id = get_random_string(20)
+		self.request = type('Request', (), {'path': '/api/lulc/', 'data': {'vector': 1}})()
+
+	def tearDown(self):
+		from common.queue import in_flight_jobs
+		in_flight_jobs.release(self.cache_key, self.job_id)
+
+	def create_task(self, job_id=None, **kwargs):
+		return ScheduledTask.objects.create(owner="owner@example.com", name="lulc", job_id=job_id or self.job_id,
+					method=self.request.path, status="Processing", orig_args=json.dumps(self.request.data), **kwargs)
+
+	def subscribe(self):
+		from ldms.analysis.analysis_router import subscribe_to_job, lulc
+		return subscribe_to_job(self.job_id, self.cache_key, self.request, lulc, 
+					{'email': "subscriber@example.com"}, self.request.data, {})
+
+	def test_register_and_release(self):
+		"""
+		Test that the first job registered for a key owns it until it releases it
+		"""
+		from common.queue import in_flight_jobs
+
+		self.assertEquals(in_flight_jobs.register(self.cache_key, self.job_id), self.job_id)
+		self.assertEquals(in_flight_jobs.register(self.cache_key, "other"), self.job_id)
+		in_flight_jobs.release(self.cache_key, "other") # not the owner
+		self.assertEquals(in_flight_jobs.get(self.cache_key), self.job_id)
+		in_flight_jobs.release(self.cache_key, self.job_id)
+		self.assertIsNone(in_flight_jobs.get(self.cache_key))
+		self.assertFalse(in_flight_jobs.is_alive(self.job_id)) # not a job known to RQ
+
+	def test_registered_job_is_alive_until_enqueued(self):
+		"""
+		Test that an identical request arriving between the registration of a job 
+		and its enqueuing considers the job alive instead of failing it
+		"""
+		import django_rq
+		from django.test import override_settings
+		from common.queue import in_flight_jobs
+
+		in_flight_jobs.register(self.cache_key, self.job_id)
+		self.assertEquals(in_flight_jobs.register(self.cache_key, "other"), self.job_id)
+		self.assertTrue(in_flight_jobs.is_alive(self.job_id, self.cache_key))
+		self.assertFalse(in_flight_jobs.is_alive("other", self.cache_key)) # does not own the key
+		with override_settings(IN_FLIGHT_JOB_ENQUEUE_GRACE=0): # never enqueued
+			self.assertFalse(in_flight_jobs.is_alive(self.job_id, self.cache_key))
+
+		job = django_rq.get_queue('default').enqueue(print, job_id=self.job_id)
+		try:
+			with override_settings(IN_FLIGHT_JOB_ENQUEUE_GRACE=0):
+				self.assertTrue(in_flight_jobs.is_alive(self.job_id, self.cache_key))
+		finally:
+			job.delete()
+
+	def test_subscribers_are_notified(self):
+		"""
+		Test that the tasks subscribed to a job are completed with its results
+		"""
+		from unittest import mock
+		from django.utils import timezone
+		from common.queue import in_flight_jobs
+		from ldms.analysis import analysis_router
+
+		in_flight_jobs.register(self.cache_key, self.job_id)
+		subscriber = self.subscribe()
+		self.assertIsNotNone(subscriber)
+		task = self.create_task(result='{"stats": []}', status="Finished", succeeded=True, completed_on=timezone.now())
+		with mock.patch.object(analysis_router, 'notify_user') as notify_user:
+			analysis_router.notify_subscribers(self.request, task, self.cache_key)
+		subscriber.refresh_from_db()
+		self.assertEquals((subscriber.status, subscriber.result, subscriber.succeeded), ("Finished", '{"stats": []}', True))
+		self.assertEquals(notify_user.call_count, 1)
+		self.assertIsNone(in_flight_jobs.get(self.cache_key))
+
+	def test_subscription_after_completion(self):
+		"""
+		Test that a request does not subscribe to a job that has completed and
+		that a task it gave up on is not saved again when subscribers are notified
+		"""
+		from unittest import mock
+		from ldms.analysis import analysis_router
+
+		self.assertIsNone(self.subscribe())
+		self.assertFalse(ScheduledTask.objects.filter(job_id=self.job_id).exists())
+
+		subscriber = self.create_task()
+		ScheduledTask.objects.filter(id=subscriber.id).delete() # given up after the subscribers were fetched
+		with mock.patch.object(analysis_router, 'notify_user') as notify_user:
+			analysis_router.fail_job_tasks(self.request, self.job_id, self.cache_key, "lulc", "Error")
+		self.assertFalse(ScheduledTask.objects.filter(job_id=self.job_id).exists())
+		self.assertEquals(notify_user.call_count, 0)
+
+	def test_failed_job(self):
+		"""
+		Test that the tasks of a job that returns an error before completing them
+		are failed, their owners notified and the key released
+		"""
+		from unittest import mock
+		from rest_framework.response import Response
+		from common.queue import in_flight_jobs
+		from ldms.analysis import analysis_router
+
+		in_flight_jobs.register(self.cache_key, self.job_id)
+		subscriber = self.subscribe()
+		job = type('Job', (), {'meta': {'cache_key': self.cache_key}, 'get_id': lambda job: self.job_id})()
+		with mock.patch.object(analysis_router, 'notify_user') as notify_user:
+			analysis_router.complete_failed_job(job, analysis_router.lulc, Response({"error": "Invalid value for raster source"}), 
+					None, {'data': self.request.data, 'user': None, 'orig_request': None})
+		subscriber.refresh_from_db()
+		self.assertEquals((subscriber.status, subscriber.succeeded), ("Failed", False))
+		self.assertEquals(subscriber.error, "Invalid value for raster source")
+		self.assertIsNotNone(subscriber.completed_on)
+		self.assertEquals(notify_user.call_count, 1)
+		self.assertIsNone(in_flight_jobs.get(self.cache_key))
+
+class ZonalHistogramTest(TestCase):
+	def setUp(self):
+		import rasterio
+		import tempfile
+		from rasterio.transform import from_origin
+		from django.contrib.gis.geos import MultiPolygon, Polygon
+		from common_gis.models import ComputedResult
+
+		# a 5 x 5 degrees raster, 0 in its western half and 2 in its eastern half
+		self.raster_file = tempfile.mkdtemp() + "/precomputed.tif"
+		data = np.zeros((1, 50, 50), dtype=np.int16)
+		data[:, :, 25:] = 2
+		data[:, 0, 0] = -1
+		with rasterio.open(self.raster_file, "w", driver='GTiff', width=50, height=50, count=1, dtype='int16',
+				crs='EPSG:4326', transform=from_origin(30, 0, 0.1, 0.1), nodata=-1) as dest:
+			dest.write(data)
+
+		def _polygon(xmin, ymin, xmax, ymax):
+			return MultiPolygon(Polygon(((xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax), (xmin, ymin))))
+
+		self.admin_zero = AdminLevelZero.objects.create(gid_0="TST", name_0="Test", geom=_polygon(30, -5, 35, 0))
+		# the edges of the units are within pixels so that both clipping algorithms select the same pixels
+		self.west = AdminLevelOne.objects.create(admin_zero=self.admin_zero, gid_0="TST", name_0="Test", 
+					gid_1="TST.1", name_1="West", geom=_polygon(30.01, -4.99, 32.49, -0.01))
+		self.east = AdminLevelOne.objects.create(admin_zero=self.admin_zero, gid_0="TST", name_0="Test", 
+					gid_1="TST.2", name_1="East", geom=_polygon(32.51, -4.99, 34.99, -0.01))
+		self.result = ComputedResult.objects.create(cache_key="precomputed", admin_zero=self.admin_zero, 
+					computation_type="lulc_change", change_enum="<enum 'LulcChangeEnum'>", nodata=-1, 
+					resolution=0.1, raster_file=self.raster_file, start_year=2015, end_year=2020, 
+					succeeded=True, queue_msg="", results=json.dumps({
+						"base": 2015, "target": 2020, "rasterfile": "http://localhost/media/precomputed.tif", 
+						"rasterpath": self.raster_file, "precomputed_field_map": None, "nodataval": -1, "nodata": 4,
+						"stats": [{"change_type": 2, "label": "Degradation", "count": 1250, "area": 5000},
+								  {"change_type": 0, "label": "Stable", "count": 1249, "area": 4996},
+								  {"change_type": 1, "label": "Improvement", "count": 0, "area": 0}],
+						"extras": {"total": 10000}, "change_enum": "<enum 'LulcChangeEnum'>", 
+						"tiles": {"url": "http://localhost/wms", "layer": "precomputed"}}))
+
+	def test_histogram_round_trip(self):
+		"""
+		Test that the results of a unit built from its histogram have the statistics
+		of the unit and none of the raster fields of the precomputed result
+		"""
+		from common_gis.utils.precompute_util import generate_zonal_histograms, get_histogram_result
+
+		self.assertEquals(generate_zonal_histograms(self.result), 2)
+		west = get_histogram_result(self.result, 1, self.west.id)
+		self.assertEquals({x['change_type']: x['count'] for x in west['stats']}, {2: 0, 0: 1249, 1: 0})
+		self.assertEquals(west['nodata'], 4)
+		self.assertEquals(west['stats'][1]['area'], 4996)
+		self.assertIsNone(west['rasterfile'])
+		self.assertIsNone(west['tiles']['url'])
+		self.assertEquals(west['extras'], {})
+
+		east = get_histogram_result(self.result, 1, self.east.id)
+		self.assertEquals({x['change_type']: x['count'] for x in east['stats']}, {2: 1250, 0: 0, 1: 0})
+		self.assertIsNone(get_histogram_result(self.result, 2, self.east.id))
+
+	def test_backfill_command(self):
+		"""
+		Test that the backfill command only generates the missing histograms unless forced
+		"""
+		from io import StringIO
+		from django.core.management import call_command
+
+		out = StringIO()
+		call_command('backfill_zonal_histograms', stdout=out)
+		self.assertIn("2 histograms", out.getvalue())
+		self.assertEquals(self.result.histograms.count(), 2)
+
+		out = StringIO()
+		call_command('backfill_zonal_histograms', stdout=out)
+		self.assertEquals(out.getvalue(), "")
+		call_command('backfill_zonal_histograms', '--result-id', str(self.result.id), '--force', stdout=out)
+		self.assertIn("2 histograms", out.getvalue())
+		self.assertEquals(self.result.histograms.count(), 2)
+
+class RasterCatalogTest(TestCase):
+	def setUp(self):
+		from django.contrib.gis.geos import MultiPolygon, Polygon
+		from common_gis.models import Raster, ContinentalAdminLevel, RegionalAdminLevel
+		from common_gis.enums import AdminLevelEnum
+
+		geom = MultiPolygon(Polygon(((30, -5), (35, -5), (35, 0), (30, 0), (30, -5))))
+		continent = ContinentalAdminLevel.objects.create(name="Continent", geom=geom)
+		region = RegionalAdminLevel.objects.create(name="Region", continent_admin=continent, geom=geom)
+		self.country = AdminLevelZero.objects.create(gid_0="TST", name_0="Test", regional_admin=region, geom=geom)
+		self.regional_country = AdminLevelZero.objects.create(gid_0="TSU", name_0="Test 2", regional_admin=region, geom=geom)
+		self.other_country = AdminLevelZero.objects.create(gid_0="TSV", name_0="Test 3", geom=geom)
+
+		def _raster(name, year, admin_level, **kwargs):
+			return Raster.objects.create(name=name, raster_year=year, raster_category="LULC", 
+						raster_source="LULC", admin_level=admin_level.key, **kwargs)
+		self.continental = [_raster("continental", yr, AdminLevelEnum.CONTINENTAL, continent_admin=continent) for yr in (2015, 2016)]
+		self.regional = _raster("regional", 2015, AdminLevelEnum.REGIONAL, regional_admin=region)
+		self.national = _raster("national", 2015, AdminLevelEnum.COUNTRY, admin_zero=self.country)
+
+	def test_fallback_resolution(self):
+		"""
+		Test that the datasets of a country, then of its region and then of the 
+		continent are returned for each year
+		"""
+		from common_gis.utils.raster_util import RasterCatalog
+
+		catalog = RasterCatalog(timeout=300)
+		args = {'raster_category': "LULC", 'raster_source': "LULC"}
+		self.assertEquals(list(catalog.get_raster_models(admin_zero_id=self.country.id, **args)), 
+					[self.continental[1], self.national])
+		self.assertEquals(list(catalog.get_raster_models(admin_zero_id=self.regional_country.id, **args)), 
+					[self.continental[1], self.regional])
+		self.assertEquals(list(catalog.get_raster_models(admin_zero_id=self.other_country.id, **args)), 
+					[self.continental[1], self.continental[0]])
+		self.assertEquals(list(catalog.get_raster_models(**args)), [self.continental[1], self.continental[0]])
+		self.assertEquals(list(catalog.get_raster_models(admin_zero_id=self.country.id, raster_year__lte=2015, **args)), 
+					[self.national])
+		self.assertEquals(list(catalog.get_raster_models(admin_zero_id=self.country.id, raster_year=2014, **args)), [])
+
+	def test_invalidated_by_other_processes(self):
+		"""
+		Test that a catalog drops its index once another process bumps the version stamp
+		"""
+		import redis
+		from common_gis.models import Raster
+		from common_gis.utils.raster_util import RasterCatalog
+		from common_gis.enums import AdminLevelEnum
+
+		catalog = RasterCatalog(timeout=300)
+		try:
+			catalog.get_connection().ping()
+		except redis.RedisError:
+			self.skipTest("Redis is not available")
+		args = {'raster_category': "LULC", 'raster_source': "LULC"}
+		self.assertEquals(len(catalog.get_raster_models(admin_zero_id=self.regional_country.id, **args)), 2)
+		# saved by another process, whose signal is deferred until its transaction commits
+		Raster.objects.filter(id=self.national.id).update(admin_zero=self.regional_country)
+		self.assertEquals(list(catalog.get_raster_models(admin_zero_id=self.regional_country.id, **args)), 
+					[self.continental[1], self.regional])
+		catalog.get_connection().incr(RasterCatalog.VERSION_KEY)
+		catalog.next_check = 0
+		self.assertEquals(list(catalog.get_raster_models(admin_zero_id=self.regional_country.id, **args)), 
+					[self.continental[1], self.national])
+
+class FactorProductTest(TestCase):
+	def test_fuzzified_product(self):
+		"""
+		Test the fuzzification and product of factors against a direct computation,
+		including their bounds options and the masking of invalid pixels
+		"""
+		import math
+		from common_gis.utils.factor_util import (compute_factor_product, FuzzyMembership, 
+					FUZZY_LINEAR, FUZZY_EXPONENTIAL, FUZZY_SIGMOID)
+
+		nodata = -9999
+		rng = np.random.RandomState(0)
+		linear = rng.uniform(1, 10, (7, 6))
+		linear[0, 0], linear[1, 1] = nodata, np.nan
+		decreasing = rng.uniform(-2, 5, (7, 6)) # negative values are clamped to 0
+		decreasing[2, 2] = nodata
+		sigmoid = ma.array(rng.uniform(0, 100, (7, 6)))
+		sigmoid[3, 3] = ma.masked
+		constant = np.full((7, 6), 4.0)
+		constant[4, 4] = nodata
+
+		def _fuzzify(x, kind, switch_bounds=False, min_value=None):
+			x = ma.masked_invalid(ma.masked_equal(ma.array(x, dtype=np.float64), nodata))
+			if min_value is not None:
+				x = ma.maximum(x, min_value)
+			low, high = (x.max(), x.min()) if switch_bounds else (x.min(), x.max())
+			t = (x - low) / (high - low)
+			if kind == FUZZY_EXPONENTIAL:
+				return t ** 2
+			if kind == FUZZY_SIGMOID:
+				return ma.cos((1 - t) * math.pi / 2) ** 2
+			return t
+
+		memberships = [FuzzyMembership(FUZZY_LINEAR), 
+					   FuzzyMembership(FUZZY_EXPONENTIAL, switch_bounds=True, min_value=0),
+					   FuzzyMembership(FUZZY_SIGMOID), None]
+		expected = _fuzzify(linear, FUZZY_LINEAR) * _fuzzify(decreasing, FUZZY_EXPONENTIAL, True, 0) * \
+					_fuzzify(sigmoid, FUZZY_SIGMOID) * ma.masked_equal(constant, nodata)
+		product = compute_factor_product([linear, decreasing, sigmoid, constant], nodata, memberships, block_rows=2)
+		self.assertEquals(product.dtype, np.float32)
+		self.assertTrue(np.array_equal(ma.getmaskarray(product), ma.getmaskarray(expected)))
+		self.assertEquals(ma.count_masked(product), 5)
+		self.assertTrue(np.allclose(product.compressed(), expected.compressed(), rtol=1e-5, atol=1e-6))
+		# the nodata pixels of the clamped factor stay masked
+		self.assertTrue(product.mask[2, 2])
+
+		# a fuzzified factor whose valid values are all equal has nothing to scale against
+		product = compute_factor_product([linear, constant], nodata, [None, FuzzyMembership(FUZZY_LINEAR)])
+		self.assertTrue(product.mask.all())
+		# rasters of different shapes are cropped to the smallest one
+		product = compute_factor_product([linear, constant[:5, :4]], nodata, func=lambda x: np.sqrt(x, out=x))
+		self.assertEquals(product.shape, (5, 4))
+		self.assertTrue(np.allclose(product[2:, 2:], np.sqrt(linear[2:5, 2:4] * 4.0)))
+
+class PreparedAdminGeometryTest(TestCase):
+	def test_contains_points(self):
+		"""
+		Test that the points checked against the simplified geometries are 
+		accepted or rejected like against the exact geometry
+		"""
+		import math
+		import shapely.geometry
+		from common_gis.utils.vector_util import PreparedAdminGeometry
+
+		geom = shapely.geometry.Point(30, -2).buffer(1, 256) # 1024 vertices
+		prepared = PreparedAdminGeometry(geom)
+		self.assertIsNotNone(prepared.inner)
+		self.assertIsNotNone(prepared.outer)
+
+		vertex = geom.exterior.coords[10]
+		def _on_ray(scale):
+			return (30 + (vertex[0] - 30) * scale, -2 + (vertex[1] + 2) * scale)
+		cases = [
+			([(30, -2), (30.5, -1.8)], True, True), # inside
+			([(30, -2), (32, -2)], False, False), # outside the bounds
+			([(30, -2), (30.95, -1.05)], False, False), # inside the bounds but outside the unit
+			([(30, -2), vertex], False, True), # on the boundary
+			([(30, -2), _on_ray(1 - 1e-9)], True, True), # just inside the boundary
+			([(30, -2), _on_ray(1 + 1e-9)], False, False), # just outside the boundary
+		]
+		for points, expected, expected_all_touched in cases:
+			points = shapely.geometry.MultiPoint(points)
+			self.assertEquals(prepared.contains_points(points, all_touched=False), expected)
+			self.assertEquals(prepared.contains_points(points, all_touched=True), expected_all_touched)
+
+		# points around the boundary
+		rng = np.random.RandomState(0)
+		for angle, radius in zip(rng.uniform(0, 2 * math.pi, 200), rng.uniform(0.98, 1.02, 200)):
+			points = shapely.geometry.MultiPoint([(30, -2), (30 + radius * math.cos(angle), -2 + radius * math.sin(angle))])
+			self.assertEquals(prepared.contains_points(points), geom.contains_properly(points))
+			self.assertEquals(prepared.contains_points(points, all_touched=True), geom.covers(points))
+
+class PolygonAreaTest(TestCase):
+	def test_equator_cell(self):
+		"""
+		Test the geodesic area of a 1 x 1 degree cell at the equator (about 1.23 million hectares)
+		whether it is passed as a GeoJSON string, a GeoJSON dict or a shapely geometry
+		"""
+		import shapely.geometry
+		from common_gis.utils.vector_util import calculate_polygon_areas, calculate_polygon_area
+
+		cell = shapely.geometry.box(0, 0, 1, 1)
+		geojson = shapely.geometry.mapping(cell)
+		areas = calculate_polygon_areas([json.dumps(geojson), geojson, cell])
+		for area in areas:
+			self.assertAlmostEqual(area, 1230878, delta=1)
+		self.assertAlmostEqual(calculate_polygon_area(geojson), areas[0])
+
+	def test_admin_level_areas(self):
+		"""
+		Test that the areas computed in the database with ST_Area(geography) match
+		those computed from the stored geometries
+		"""
+		from django.contrib.gis.geos import MultiPolygon, Polygon
+		from common_gis.utils.vector_util import calculate_polygon_areas, get_admin_level_areas
+
+		equator = AdminLevelZero.objects.create(gid_0="EQT", name_0="Equator", 
+					geom=MultiPolygon(Polygon(((0, 0), (1, 0), (1, 1), (0, 1), (0, 0)))))
+		kenya = AdminLevelZero.objects.create(gid_0="KEN", name_0="Kenya", 
+					geom=MultiPolygon(Polygon(((34, -4), (41, -4), (40, 4), (34, 5), (34, -4)))))
+		areas = get_admin_level_areas(0, [equator.id, kenya.id, kenya.id + 1000])
+		self.assertEquals(set(areas.keys()), {equator.id, kenya.id})
+		self.assertAlmostEqual(areas[equator.id], 1230878, delta=100)
+		for unit in [equator, kenya]:
+			unit.refresh_from_db()
+			expected = calculate_polygon_areas([unit.geom.json])[0]
+			self.assertAlmostEqual(areas[unit.id], expected, delta=expected * 1e-4)
+		self.assertEquals(get_admin_level_areas(5, [equator.id]), {})
+
+class VectorSearchTest(TestCase):
+	def setUp(self):
+		from django.contrib.gis.geos import MultiPolygon, Polygon
+		from common_gis.models import ContinentalAdminLevel, RegionalAdminLevel
+
+		geom = MultiPolygon(Polygon(((30, -5), (35, -5), (35, 0), (30, 0), (30, -5))))
+		continent = ContinentalAdminLevel.objects.create(name="Africa", geom=geom)
+		self.region = RegionalAdminLevel.objects.create(name="East Kenya Region", continent_admin=continent, geom=geom)
+		self.country = AdminLevelZero.objects.create(gid_0="KEN", name_0="Kenya", geom=geom)
+		# less similar to the term but first in alphabetical order
+		self.other_country = AdminLevelZero.objects.create(gid_0="GKE", name_0="Greater Kenya", geom=geom)
+		self.admin_one = AdminLevelOne.objects.create(admin_zero=self.country, gid_0="KEN", name_0="Kenya", 
+					gid_1="KEN.1", name_1="Nairobi", geom=geom)
+		self.coast = AdminLevelOne.objects.create(admin_zero=self.country, gid_0="KEN", name_0="Kenya", 
+					gid_1="KEN.2", name_1="Kenya Coast", geom=geom)
+		self.admin_two = AdminLevelTwo.objects.create(admin_one=self.admin_one, gid_0="KEN", name_0="Kenya", 
+					gid_1="KEN.1", name_1="Nairobi", gid_2="KEN.1.1", name_2="Kenya West", geom=geom)
+
+	def test_union_ranking_and_pagination(self):
+		"""
+		Test that all the levels are searched in one query, ordered by level and by 
+		similarity to the term, and paginated
+		"""
+		from django.db import connection
+		from django.test import override_settings
+		from django.test.utils import CaptureQueriesContext
+		from common_gis.utils.vector_util import search_vectors
+
+		with override_settings(VECTOR_SEARCH_CACHE_TIMEOUT=0, VECTOR_SEARCH_MAX_RESULTS=100):
+			with CaptureQueriesContext(connection) as queries:
+				results = search_vectors("  KENYA ")
+			self.assertEquals(len(queries), 1)
+			self.assertEquals([(x['level'], x['id']) for x in results], [
+				(-1, self.region.id), (0, self.country.id), (0, self.other_country.id), 
+				(1, self.coast.id), (2, self.admin_two.id)])
+			self.assertEquals(results[3], {'id': self.coast.id, 'name': "Kenya, Kenya Coast ", 'level': 1, 
+						'admin0': self.country.id, 'admin1': self.coast.id, 'admin2': None})
+			self.assertEquals((results[4]['admin0'], results[4]['admin1'], results[4]['admin2']), 
+						(self.country.id, self.admin_one.id, self.admin_two.id))
+
+			self.assertEquals(search_vectors("kenya", limit=2, offset=1), results[1:3])
+			self.assertEquals(search_vectors("kenya", offset=4), results[4:])
+			self.assertEquals(search_vectors("nowhere"), [])
+		with override_settings(VECTOR_SEARCH_CACHE_TIMEOUT=0, VECTOR_SEARCH_MAX_RESULTS=3):
+			self.assertEquals(search_vectors("kenya", limit=10), results[:3])
+
+class TableResponseCacheTest(TransactionTestCase):
+	"""
+	Test the conditional responses of the admin levels. The version of a table is
+	bumped once a change is committed, hence the transactions
+	"""
+	def setUp(self):
+		from django.contrib.gis.geos import MultiPolygon, Polygon
+		self.country = AdminLevelZero.objects.create(gid_0="TST", name_0="Test", 
+			geom=MultiPolygon(Polygon(((30, -5), (35, -5), (35, 0), (30, 0), (30, -5)))))
+		self.table = AdminLevelZero._meta.db_table
+
+	def test_not_modified(self):
+		"""
+		Test that a client with the current version of a response gets a 304
+		"""
+		response = self.client.get('/api/vect0/')
+		self.assertEquals(response.status_code, 200)
+		self.assertIn(b'"Test"', response.content)
+
+		for headers in [{'HTTP_IF_NONE_MATCH': response['ETag']}, 
+						{'HTTP_IF_NONE_MATCH': 'W/' + response['ETag']},
+						{'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}]:
+			self.assertEquals(self.client.get('/api/vect0/', **headers).status_code, 304)
+		# another variant of the response has another ETag
+		other = self.client.get('/api/vect0/?include=all', HTTP_IF_NONE_MATCH=response['ETag'])
+		self.assertEquals(other.status_code, 200)
+		self.assertNotEquals(other['ETag'], response['ETag'])
+
+	def test_invalidated_on_commit(self):
+		"""
+		Test that the cached responses and tiles of a table are only replaced 
+		once a change to the table is committed
+		"""
+		from django.db import transaction
+		from common_gis.utils.response_cache_util import get_table_version
+
+		response = self.client.get('/api/vect0/')
+		tile = self.client.get('/api/tiles/0/0/0/0.mvt')
+		version = get_table_version(self.table)
+		with transaction.atomic():
+			self.country.name_0 = "Renamed"
+			self.country.save()
+			self.assertEquals(get_table_version(self.table), version)
+		self.assertNotEquals(get_table_version(self.table), version)
+
+		response = self.client.get('/api/vect0/', HTTP_IF_NONE_MATCH=response['ETag'])
+		self.assertEquals(response.status_code, 200)
+		self.assertIn(b'"Renamed"', response.content)
+		tile = self.client.get('/api/tiles/0/0/0/0.mvt', HTTP_IF_NONE_MATCH=tile['ETag'])
+		self.assertEquals(tile.status_code, 200)
+
+class SettingsCacheTest(TransactionTestCase):
+	"""
+	Test the process-local cache of the settings models. The version stamp is
+	bumped once the saved settings are committed, hence the transactions
+	"""
+	def setUp(self):
+		from common.models import CommonSettings
+		CommonSettings(backend_port=8000).save()
+
+	def test_cached_within_interval(self):
+		"""
+		Test that the cached settings are returned without querying the database 
+		until the interval elapses
+		"""
+		from common.models import CommonSettings
+		from common.utils.settings_util import SettingsCache
+
+		cache = SettingsCache(CommonSettings, check_interval=300)
+		self.assertEquals(cache.get().backend_port, 8000)
+		# saved without invalidating the cache
+		CommonSettings.objects.update(backend_port=9000)
+		with self.assertNumQueries(0):
+			setts = cache.get()
+		self.assertEquals(setts.backend_port, 8000)
+		# callers get a copy
+		setts.backend_port = 1
+		self.assertEquals(cache.get().backend_port, 8000)
+
+	def test_reloaded_after_invalidate_commits(self):
+		"""
+		Test that the settings are reloaded once the transaction in which they 
+		were invalidated commits
+		"""
+		from django.db import transaction
+		from common.models import CommonSettings
+		from common.utils.settings_util import SettingsCache
+
+		cache = SettingsCache(CommonSettings, check_interval=300)
+		self.assertEquals(cache.get().backend_port, 8000)
+		with transaction.atomic():
+			setts = CommonSettings.load()
+			setts.backend_port = 9000
+			setts.save()
+			cache.invalidate()
+		self.assertEquals(cache.get().backend_port, 9000)
+		self.assertEquals(CommonSettings.objects.count(), 1)
+
+	def test_invalidated_by_other_processes(self):
+		"""
+		Test that an instance reloads the settings once another process bumps the version stamp
+		"""
+		import redis
+		from common.models import CommonSettings
+		from common.utils.settings_util import SettingsCache
+
+		cache = SettingsCache(CommonSettings, check_interval=300)
+		try:
+			cache.get_connection().ping()
+		except redis.RedisError:
+			self.skipTest("Redis is not available")
+		other = SettingsCache(CommonSettings, check_interval=300)
+		self.assertEquals(cache.get().backend_port, 8000)
+		self.assertEquals(other.get().backend_port, 8000)
+
+		# saved by another process, whose stamp is bumped once its transaction commits
+		CommonSettings.objects.update(backend_port=9000)
+		cache.next_check = 0
+		self.assertEquals(cache.get().backend_port, 8000)
+		other.invalidate()
+		self.assertEquals(other.get().backend_port, 9000)
+		self.assertEquals(cache.get().backend_port, 8000) # until the next check
+		cache.next_check = 0
+		self.assertEquals(cache.get().backend_port, 9000)
+		self.assertEquals(cache.version, cache.get_version())
+
+class RunningStatsTest(TestCase):
+	def test_matches_stacked_statistics(self):
+		"""
+		Test that the statistics of rasters streamed one at a time match those of 
+		the stacked rasters cropped to the smallest shape
+		"""
+		from common_gis.utils.stack_util import RunningStats
+
+		rng = np.random.RandomState(0)
+		rasters = [rng.uniform(-1, 1, (6, 5)) for i in range(3)]
+		rasters.append(rng.uniform(-1, 1, (5, 4))) # cropped
+		rasters.append(ma.array(rng.uniform(-1, 1, (6, 5)), mask=rng.randint(0, 2, (6, 5)))) # masks are ignored
+		rasters[0][0, 0] = -9999 # nodata values are used as they are
+
+		stats = RunningStats()
+		for raster in rasters:
+			stats.update(raster)
+		stack = np.array([ma.getdata(x)[:5, :4] for x in rasters])
+		self.assertEquals(stats.count, 5)
+		self.assertEquals(stats.mean.shape, (5, 4))
+		self.assertTrue(np.allclose(stats.mean, np.mean(stack, axis=0)))
+		for ddof in (0, 1):
+			self.assertTrue(np.allclose(stats.get_std(ddof), np.std(stack, axis=0, ddof=ddof)))
+		self.assertTrue(np.isnan(stats.get_std(ddof=5)).all())
+
+class ESAITest(TestCase):
+	nodata = -9999
+
+	def get_factors(self, count, seed):
+		"""Return `count` aligned factor rasters with a few nodata pixels"""
+		rng = np.random.RandomState(seed)
+		factors = [rng.uniform(1, 2, (4, 5)) for i in range(count)]
+		factors[0][0, 0] = self.nodata
+		factors[-1][3, 4] = self.nodata
+		return factors
+
+	def assert_masked_equal(self, result, expected):
+		self.assertTrue(np.array_equal(ma.getmaskarray(result), ma.getmaskarray(expected)))
+		self.assertTrue(np.allclose(result.compressed(), expected.compressed()))
+
+	def test_quality_indices_match_formulas(self):
+		"""
+		Test that the geometric means computed by compute_quality_index match
+		the formulas of the CQI, SQI, VQI, MQI and ESAI
+		"""
+		from ldms.analysis.medalus import Medalus
+		from common_gis.utils.raster_util import do_raster_operation
+		from ldms.enums import RasterOperationEnum
+
+		medalus = Medalus()
+		nodata = self.nodata
+		def product(rasters):
+			return do_raster_operation(rasters, RasterOperationEnum.MULTIPLY, nodata)
+
+		# CQI = (AI * Rainfall)^(1/2)
+		ai, rain = self.get_factors(2, 0)
+		ma_ai, ma_rain = ma.masked_equal(ai, nodata), ma.masked_equal(rain, nodata)
+		cqi = medalus.compute_quality_index([ai, rain], nodata)
+		self.assert_masked_equal(cqi, np.power(np.multiply(ma_rain, ma_ai), 1/2))
+		self.assertTrue(cqi.mask[0, 0] and cqi.mask[3, 4])
+
+		# SQI = (slope * group * drainage * parent material * texture * rock fragment)^(1/6)
+		sqi_factors = self.get_factors(6, 1)
+		sqi = medalus.compute_quality_index(sqi_factors, nodata)
+		self.assert_masked_equal(sqi, np.power(product(sqi_factors), 1/6))
+
+		# VQI = (fire risk * erosion * drought * plant cover)^(1/4)
+		vqi_factors = self.get_factors(4, 2)
+		vqi = medalus.compute_quality_index(vqi_factors, nodata)
+		self.assert_masked_equal(vqi, np.power(product(vqi_factors), 1/4))
+
+		# MQI = (population density * land use)^(1/2). Integer factors must not overflow
+		mqi_factors = [np.full((4, 5), 100000, dtype=np.int32), np.full((4, 5), 100000, dtype=np.int32)]
+		mqi_factors[0][2, 2] = nodata
+		mqi = medalus.compute_quality_index(mqi_factors, nodata)
+		self.assertTrue(mqi.mask[2, 2])
+		self.assertTrue(np.allclose(mqi.compressed(), 100000))
+
+		# ESAI = (CQI * SQI * VQI * MQI)^(1/4) with the nodata of all the indices
+		esai = medalus.compute_quality_index([cqi, sqi, vqi, mqi], nodata)
+		expected = np.power(cqi.astype(float) * sqi * vqi * mqi, 1/4)
+		self.assert_masked_equal(esai, expected)
+		self.assertTrue(esai.mask[0, 0] and esai.mask[3, 4] and esai.mask[2, 2])
+
+	def test_save_intermediate_rasters(self):
+		"""
+		Test that calculate_esai reads the rasters in model order and only
+		returns the four quality indices if `save_intermediate_rasters` is set
+		"""
+		from unittest import mock
+		from ldms.analysis import medalus as medalus_module
+		from ldms.analysis.medalus import Medalus
+
+		models = {}
+		for key, count in [('cqi', 2), ('sqi', 6), ('vqi', 4), ('mqi', 2)]:
+			models[key] = [mock.Mock(resolution=250) for i in range(count)]
+			for i, model in enumerate(models[key]):
+				model.rasterfile.name = "%s_%s.tif" % (key, i)
+		files = [model.rasterfile.name for key in models for model in models[key]]
+		arrays = self.get_factors(len(files), 3)
+
+		for save_intermediate_rasters in (False, True):
+			medalus = Medalus(save_intermediate_rasters=save_intermediate_rasters)
+			with mock.patch.object(medalus, 'get_vector', return_value=({}, None)), \
+				mock.patch.object(medalus, 'get_esai_raster_models', return_value=(models, None)), \
+				mock.patch.object(medalus_module, 'get_raster_meta', return_value={'nodata': self.nodata}), \
+				mock.patch.object(medalus_module, 'align_rasters', 
+					return_value=(arrays, [self.nodata] * len(arrays), {})) as align_rasters, \
+				mock.patch.object(medalus_module, 'return_raster_with_stats', 
+					side_effect=lambda **kwargs: kwargs):
+				res = medalus.calculate_esai()
+
+			self.assertEquals(align_rasters.call_args[1]['rasters'], files)
+			self.assertEquals(res['prefix'], "esai")
+			intermediates = res['extras'].get('intermediates')
+			if not save_intermediate_rasters:
+				self.assertIsNone(intermediates)
+				continue
+
+			self.assertEquals(list(intermediates.keys()), ['cqi', 'sqi', 'vqi', 'mqi'])
+			pos = 0
+			for key, intermediate in intermediates.items():
+				factors = arrays[pos:pos + len(models[key])]
+				pos += len(factors)
+				index = medalus.compute_quality_index(factors, self.nodata)
+				matrix = getattr(medalus, key + '_matrix')
+				self.assertEquals(intermediate['prefix'], key)
+				self.assertTrue(intermediate['is_intermediate_variable'])
+				self.assertTrue(np.array_equal(intermediate['datasource'], 
+									medalus_module.reclassify_raster(index, matrix, self.nodata)))
+
+class JSONSerializationTest(TestCase):
+	def get_result(self):
+		from django.utils.translation import gettext_lazy
+		from ldms.enums import LCEnum
+		return {
+			'area': np.int64(1250),
+			'mean': np.float32(0.5),
+			'stats': {np.int64(1): np.int64(10), np.uint8(2): [np.int32(3), np.float64(0.25)]},
+			'class': LCEnum.WATER,
+			'label': gettext_lazy("Water"),
+			'raster': np.array([[1, 2], [3, 4]], dtype=np.int16),
+		}
+
+	def get_expected(self):
+		return {
+			'area': 1250,
+			'mean': 0.5,
+			'stats': {'1': 10, '2': [3, 0.25]},
+			'class': [1, "Water"],
+			'label': "Water",
+			'raster': [[1, 2], [3, 4]],
+		}
+
+	def test_round_trip(self):
+		"""
+		Test that results with numpy values and keys, enums and lazy translation strings
+		round trip through dumps and loads with orjson and with the json fallback
+		"""
+		from unittest import mock
+		from common.utils import json_util
+		from common.utils.json_util import dumps, loads, normalize_keys
+
+		self.assertEquals(normalize_keys({np.int64(1): [{np.uint8(2): 'a'}]}), {1: [{2: 'a'}]})
+		self.assertIs(type(list(normalize_keys({np.int64(1): 0}).keys())[0]), int)
+
+		encoders = [None] + ([json_util.orjson] if json_util.orjson else [])
+		for encoder in encoders:
+			with mock.patch.object(json_util, 'orjson', encoder):
+				data = dumps(self.get_result())
+				self.assertIsInstance(data, bytes)
+				self.assertEquals(loads(data), self.get_expected())
+				self.assertEquals(loads(data.decode("utf-8")), self.get_expected())
+
+	def test_json_bytes_response(self):
+		"""
+		Test that serialized results are returned as they are and others are serialized once
+		"""
+		from common.utils.json_util import dumps, loads, to_json_bytes, JSONBytesResponse
+
+		data = dumps(self.get_result())
+		self.assertIs(to_json_bytes(data), data)
+		self.assertEquals(to_json_bytes(data.decode("utf-8")), data)
+		self.assertEquals(loads(to_json_bytes(self.get_result())), self.get_expected())
+
+		for value in [data, self.get_result()]:
+			response = JSONBytesResponse(value, status=202)
+			self.assertEquals(response.status_code, 202)
+			self.assertEquals(response['Content-Type'], 'application/json')
+			self.assertEquals(loads(response.content), self.get_expected())
@@ -1,5 +1,7 @@
 from common_gis.models import ScheduledPreComputation, ComputedResult, ComputedResultItem, AdminLevelOne
 import ldms.analysis.analysis_router as router
+from common_gis.utils.precompute_util import generate_zonal_histograms_job
+from common.queue import RedisQueue
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from common_gis.enums import AdminLevelEnum, RasterSourceEnum
@@ -7,6 +9,7 @@ from ldms.enums import ComputationEnum
 from common.utils.common_util import cint
 import copy
 import json
+import logging
 #from rest_framework.request import Request
 from django.http import HttpRequest
 from django.db import DatabaseError, transaction
@@ -18,6 +21,7 @@ from django.db import DatabaseError, transaction
 - 
 """
 User = get_user_model()
+logger = logging.getLogger(__name__)
 def run_computations():
 	"""
 	Run computations that have been scheduled
@@ -214,6 +218,16 @@ def start_job(job, success, method, args, queue_msg, error):
 	job.error = error
 	job.save()
 
+def _enqueue_zonal_histograms(computed_result_id):
+	"""
+	Queue the generation of the zonal histograms of a precomputed result so that
+	completing the precomputation does not wait for them
+	"""
+	try:
+		RedisQueue().enqueue_low(func=generate_zonal_histograms_job, computed_result_id=computed_result_id)
+	except Exception:
+		logger.exception("Failed to queue the zonal histograms of %s", computed_result_id)
+
 def complete_job(scheduled_task, cache_key, success=True, error=None, func=None):
 	"""
 	Complete job processing
@@ -281,6 +295,11 @@ def complete_job(scheduled_task, cache_key, success=True, error=None, func=None)
 				)
 				child.save()
 			""" 
+
+		# Store the statistics of the units within the area so that they are not recomputed per request
+		if success:
+			transaction.on_commit(lambda: _enqueue_zonal_histograms(parent.id))
+		return parent
 	
 	def _extract_stats(results, parent):
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/dev/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 from corsheaders.defaults import default_headers
 
@@ -294,6 +295,27 @@ CACHES = {
 }
 
 JOB_TIMEOUT = os.getenv('QUEUED_JOB_TIMEOUT', 10800) #3 hours
+# Seconds during which a job that registered its cache key but is not enqueued yet is considered alive
+# by identical requests. See common.queue.InFlightJobs
+IN_FLIGHT_JOB_ENQUEUE_GRACE = int(os.getenv('IN_FLIGHT_JOB_ENQUEUE_GRACE', 60))
+# Attempts of a queued request to subscribe to an identical job or to register its own
+IN_FLIGHT_JOB_REGISTER_ATTEMPTS = int(os.getenv('IN_FLIGHT_JOB_REGISTER_ATTEMPTS', 3))
+
+# Tiered cache of analysis results. See common.utils.cache_util.ResultCache
+# If no Redis host is set, the default Django cache is used as the shared tier
+RESULT_CACHE_REDIS = {
+    'HOST': os.getenv('RESULT_CACHE_REDIS_HOST', os.getenv('REDIS_HOST')),
+    'PORT': int(os.getenv('RESULT_CACHE_REDIS_PORT', 6379)),
+    'DB': int(os.getenv('RESULT_CACHE_REDIS_DB', 1)),
+}
+RESULT_CACHE_LOCAL_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_LOCAL_MAX_ENTRIES', 256))
+RESULT_CACHE_LOCAL_TIMEOUT = int(os.getenv('RESULT_CACHE_LOCAL_TIMEOUT', 300)) # seconds
+# Seconds an instant computation may hold its single-flight lock. Matches the proxy read timeout of requests (see deploy/DEPLOY.md)
+RESULT_CACHE_LOCK_TIMEOUT = int(os.getenv('RESULT_CACHE_LOCK_TIMEOUT', 300)) # seconds
+# Seconds a request waits for an identical computation before computing it itself
+RESULT_CACHE_LOCK_WAIT_TIMEOUT = int(os.getenv('RESULT_CACHE_LOCK_WAIT_TIMEOUT', 30)) # seconds
+# Seconds between checks of the version stamp of the cached settings models. See common.utils.settings_util.SettingsCache
+SETTINGS_CACHE_CHECK_INTERVAL = float(os.getenv('SETTINGS_CACHE_CHECK_INTERVAL', 1))
 RQ_QUEUES = {
     # 'default': {
     #     'USE_REDIS_CACHE': 'default'
@@ -568,3 +590,38 @@ if FRONTEND_URL and FRONTEND_URL not in CORS_ALLOWED_ORIGINS:
 PRECOMPUTATION_FUNCTION = "ldms.utils.precomputation_util.run_computations"
 DEFAULT_CRS = "EPSG:4326"
 DELETE_TEMP_FILES_AFTER=86400 #Time in seconds after which temp .tif files will be deleted
+
+# Cache of rasters clipped to vectors. See common_gis.utils.raster_util.ClippedRasterCache
+CLIP_CACHE_ENABLED = int(os.getenv('CLIP_CACHE_ENABLED', 1))
+CLIP_CACHE_DIR = os.getenv('CLIP_CACHE_DIR', os.path.join(tempfile.gettempdir(), "ldms_clip_cache"))
+CLIP_CACHE_MAX_BYTES = int(os.getenv('CLIP_CACHE_MAX_BYTES', 5 * 1024 * 1024 * 1024)) # 5GB
+
+# Rasters whose clipped area exceeds this number of pixels are clipped window by window
+CLIP_STREAMING_PIXEL_THRESHOLD = int(os.getenv('CLIP_STREAMING_PIXEL_THRESHOLD', 50 * 1000 * 1000))
+CLIP_STREAMING_WINDOW_SIZE = int(os.getenv('CLIP_STREAMING_WINDOW_SIZE', 1024)) # pixels
+
+# Seconds for which the in-process raster catalog is kept. It is also cleared in all the processes when a Raster 
+# is saved or deleted, through a version stamp in Redis. Set to 0 to always query the database. 
+# See common_gis.utils.raster_util.RasterCatalog
+RASTER_CATALOG_TIMEOUT = int(os.getenv('RASTER_CATALOG_TIMEOUT', 300))
+# Number of prepared admin unit geometries kept by each process to validate custom polygons. 
+# See common_gis.utils.vector_util.AdminGeometryCache
+ADMIN_GEOMETRY_CACHE_MAX_ENTRIES = int(os.getenv('ADMIN_GEOMETRY_CACHE_MAX_ENTRIES', 32))
+# Simplification tolerance of the cached geometries as a fraction of their size, bounded in degrees
+ADMIN_GEOMETRY_TOLERANCE_RATIO = float(os.getenv('ADMIN_GEOMETRY_TOLERANCE_RATIO', 0.001))
+ADMIN_GEOMETRY_MAX_TOLERANCE = float(os.getenv('ADMIN_GEOMETRY_MAX_TOLERANCE', 0.01))
+# Maximum number of results of a search of admin units and seconds for which the results of a term are cached. 
+# See common_gis.utils.vector_util.search_vectors
+VECTOR_SEARCH_MAX_RESULTS = int(os.getenv('VECTOR_SEARCH_MAX_RESULTS', 100))
+VECTOR_SEARCH_CACHE_TIMEOUT = int(os.getenv('VECTOR_SEARCH_CACHE_TIMEOUT', 300))
+# Seconds for which rendered admin level responses are cached. They are also invalidated when the table changes.
+# See common_gis.utils.response_cache_util
+TABLE_RESPONSE_CACHE_TIMEOUT = int(os.getenv('TABLE_RESPONSE_CACHE_TIMEOUT', 86400))
+# Vector tiles of the admin levels. See common_gis.utils.tile_util
+# Seconds for which encoded tiles are cached. They are also invalidated when their table changes.
+VECTOR_TILE_CACHE_TIMEOUT = int(os.getenv('VECTOR_TILE_CACHE_TIMEOUT', 86400))
+# Maximum zoom level served
+VECTOR_TILE_MAX_ZOOM = int(os.getenv('VECTOR_TILE_MAX_ZOOM', 14))
+# Size of the tile coordinate space and of the buffer around a tile in tile units
+VECTOR_TILE_EXTENT = int(os.getenv('VECTOR_TILE_EXTENT', 4096))
+VECTOR_TILE_BUFFER = int(os.getenv('VECTOR_TILE_BUFFER', 64))